@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+# bench_simulated.py: End-to-end throughput on a simulated phone
+# Copyright (C) 2018 - 2021 Arnaud Gardelein <arnaud@oscopy.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+""" Send messages and read the phonebook through BTPhone, on a phone
+emulated by simulated.SimulatedBackend
+
+    PYTHONPATH=src python3 benchmarks/bench_simulated.py [-n 200]
+        [--contacts 1000] [--photo 0] [--all-fields] [--page-size N] [--inbox 500]
+        [--latency 10] [--bandwidth 100000] [--failure-rate 0.0]
+        [--json results.json]
+
+With --photo 4096, compare the bytes of the phonebook pull with and
+without --all-fields to see the effect of the Fields filter.
+
+Needs PyGObject, but neither Bluetooth nor D-Bus.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from gi.repository import GLib
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fixtures
+from btphonelib import BTPhone, SimulatedBackend, SimulatedDevice, MessageStore
+
+DEVAD = '00:11:22:33:44:55'
+
+
+def run(future):
+    """ Iterate the main loop until future is done, return its result
+    """
+    context = GLib.MainContext.default()
+    while not future.done():
+        context.iteration(True)
+    return future.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', type=int, default=200, help='Number of messages')
+    parser.add_argument('--contacts', type=int, default=1000, help='Size of the phonebook')
+    parser.add_argument('--photo', type=int, default=0, help='Size of the photos, in bytes')
+    parser.add_argument('--all-fields', action='store_true',
+                        help='Pull every vCard field, as without the Fields filter')
+    parser.add_argument('--page-size', type=int, help='Pull the phonebook by pages')
+    parser.add_argument('--inbox', type=int, default=500, help='Messages in the phone inbox')
+    parser.add_argument('--latency', type=int, default=10, help='D-Bus latency, in ms')
+    parser.add_argument('--bandwidth', type=int, default=100000, help='Transfer speed, in bytes/s')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Failure probability')
+    parser.add_argument('--seed', type=int, default=fixtures.SEED)
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+
+    inbox = [('+3361234{:04d}'.format(i % 50), '20210320T{:06d}'.format(i), 'Reply {}'.format(i))
+             for i in range(args.inbox)]
+    device = SimulatedDevice(DEVAD, contacts=fixtures.contacts(args.contacts),
+                             photo_size=args.photo, inbox=inbox)
+    backend = SimulatedBackend([device], latency=args.latency, bandwidth=args.bandwidth,
+                               failure_rate=args.failure_rate, sdp_latency=args.latency,
+                               seed=args.seed)
+    phone = BTPhone(backend=backend)
+    if args.all_fields:
+        phone.vcard_fields = None
+    results = {}
+
+    start = time.perf_counter()
+    first = []
+    contacts = run(phone.read_phonebook_async(
+        DEVAD, page_size=args.page_size,
+        page_cb=lambda folder, page: first or first.append(time.perf_counter() - start)))
+    results['phonebook'] = {'contacts': len(contacts),
+                            'elapsed': time.perf_counter() - start,
+                            'first_page': first[0] if first else None,
+                            'bytes': phone.stats()['transfer_bytes']}
+
+    jobs = [('+3361234{:04d}'.format(i), 'Message {}'.format(i)) for i in range(args.n)]
+    report = run(phone.send_bulk_async(DEVAD, jobs, backoff=args.latency))
+    results['send'] = report.stats()
+    results['send']['received'] = len(device.messages)
+
+    # The second sync only lists the newest page of each folder
+    store = MessageStore(':memory:')
+    for sync in ('first_sync', 'second_sync'):
+        calls = backend.calls
+        start = time.perf_counter()
+        added = run(phone.sync_messages_async(DEVAD, store))
+        results[sync] = {'added': added, 'calls': backend.calls - calls,
+                         'elapsed': time.perf_counter() - start}
+    results['calls'] = backend.calls
+    results['stats'] = phone.stats()
+    phone.sessions.close_all()
+
+    print(json.dumps(results, indent=1))
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
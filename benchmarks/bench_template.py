@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+# bench_template.py: Render throughput of message templates
+# Copyright (C) 2018 - 2021 Arnaud Gardelein <arnaud@oscopy.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+""" Compare MessageTemplate.render() with prepare_message() + format()
+
+    python3 benchmarks/bench_template.py [-n 100000]
+"""
+
+import argparse
+import time
+from btphonelib.template import MessageTemplate, prepare_message
+
+TEXT = 'Bonjour {name},\nvotre rendez-vous est le {date} à {time}.\nRéférence : {ref}'
+
+
+def rows(n):
+    for i in range(n):
+        yield ('+3361234{:04d}'.format(i % 10000),
+               {'name': 'Contact {}'.format(i),
+                'date': '12/10',
+                'time': '{:02d}:{:02d}'.format(8 + i % 10, i % 60),
+                'ref': 'R{:08d}'.format(i)})
+
+
+def bench_template(n):
+    t = MessageTemplate(TEXT)
+    start = time.perf_counter()
+    size = 0
+    for num, m in t.render_many(rows(n)):
+        size += len(m)
+    return time.perf_counter() - start, size
+
+
+def bench_prepare_message(n):
+    start = time.perf_counter()
+    size = 0
+    for num, values in rows(n):
+        m = prepare_message(num, TEXT.format(**values)).encode('utf-8')
+        size += len(m)
+    return time.perf_counter() - start, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', type=int, default=100000, help='Number of messages')
+    args = parser.parse_args()
+    for name, bench in (('template', bench_template),
+                        ('prepare_message', bench_prepare_message)):
+        elapsed, size = bench(args.n)
+        print('{:16s} {:8d} messages {:8.3f} s {:10.0f} msg/s {:8.1f} MB'.format(
+            name, args.n, elapsed, args.n / elapsed, size / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+# fixtures.py: Synthetic data for the benchmarks
+# Copyright (C) 2018 - 2021 Arnaud Gardelein <arnaud@oscopy.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+""" Synthetic phonebooks, sdptool dumps and devices
+
+The data is generated from a fixed seed so runs can be compared.
+"""
+
+import base64
+import os
+import random
+
+SEED = 1234
+FIRST_NAMES = ['Jean', 'Marie', 'Pierre', 'Anne', 'Louis', 'Hélène', 'Paul',
+               'Zoé', 'Jacques', 'Céline', 'Michel', 'Sophie']
+LAST_NAMES = ['Martin', 'Bernard', 'Dubois', 'Thomas', 'Robert', 'Richard',
+              'Petit', 'Durand', 'Leroy', 'Moreau', 'Simon', 'Laurent']
+TEL_TYPES = ['CELL', 'HOME', 'WORK', 'VOICE']
+
+
+def contacts(n, seed=SEED):
+    """ Return n (name, [(number, type), ...]) tuples
+    """
+    rnd = random.Random(seed)
+    res = []
+    for i in range(n):
+        name = '{} {} {}'.format(rnd.choice(FIRST_NAMES), rnd.choice(LAST_NAMES), i)
+        tels = [('+336{:08d}'.format(rnd.randrange(10 ** 8)), rnd.choice(TEL_TYPES))
+                for j in range(rnd.randint(1, 3))]
+        res.append((name, tels))
+    return res
+
+
+def vcard(name, tels, photo=None):
+    """ Return one vCard 2.1 as sent by phones over PBAP
+    """
+    first, last = name.split(' ', 1)
+    lines = ['BEGIN:VCARD', 'VERSION:2.1',
+             'N;CHARSET=UTF-8:{};{};;;'.format(last, first),
+             'FN;CHARSET=UTF-8:{}'.format(name)]
+    lines += ['TEL;{}:{}'.format(t, num) for num, t in tels]
+    if photo is not None:
+        # Folded base64, as most phones do
+        lines.append('PHOTO;ENCODING=BASE64;JPEG:' + photo[:64])
+        lines += ['  ' + photo[i:i + 72] for i in range(64, len(photo), 72)]
+        lines.append('')
+    lines.append('END:VCARD')
+    return '\r\n'.join(lines) + '\r\n'
+
+
+def write_phonebook(fn, n, photo_size=0, seed=SEED):
+    """ Write a phonebook of n vCards to fn
+
+    Parameters
+    ----------
+    fn: str
+    The file to write
+
+    n: int
+    The number of vCards
+
+    photo_size: int (default 0)
+    The size of the PHOTO of each vCard in bytes before base64, 0 for none
+
+    Returns
+    -------
+    int
+    The size of the file in bytes
+    """
+    rnd = random.Random(seed)
+    photo = None
+    if photo_size:
+        photo = base64.b64encode(bytes(rnd.randrange(256) for i in range(photo_size))).decode('ascii')
+    with open(fn, 'w', encoding='utf-8', newline='') as f:
+        for name, tels in contacts(n, seed):
+            f.write(vcard(name, tels, photo))
+    return os.path.getsize(fn)
+
+
+def sdp_record(handle, service_id, name, channel):
+    """ Return one service record as printed by sdptool browse --xml
+    """
+    return ('<?xml version="1.0" encoding="UTF-8" ?>\n'
+            '\n'
+            '<record>\n'
+            '\t<attribute id="0x0000">\n'
+            '\t\t<uint32 value="0x{handle:08x}" />\n'
+            '\t</attribute>\n'
+            '\t<attribute id="0x0001">\n'
+            '\t\t<sequence>\n'
+            '\t\t\t<uuid value="{service_id}" />\n'
+            '\t\t</sequence>\n'
+            '\t</attribute>\n'
+            '\t<attribute id="0x0004">\n'
+            '\t\t<sequence>\n'
+            '\t\t\t<sequence>\n'
+            '\t\t\t\t<uuid value="0x0100" />\n'
+            '\t\t\t</sequence>\n'
+            '\t\t\t<sequence>\n'
+            '\t\t\t\t<uuid value="0x0003" />\n'
+            '\t\t\t\t<uint8 value="0x{channel:02x}" />\n'
+            '\t\t\t</sequence>\n'
+            '\t\t\t<sequence>\n'
+            '\t\t\t\t<uuid value="0x0008" />\n'
+            '\t\t\t</sequence>\n'
+            '\t\t</sequence>\n'
+            '\t</attribute>\n'
+            '\t<attribute id="0x0005">\n'
+            '\t\t<sequence>\n'
+            '\t\t\t<uuid value="0x1002" />\n'
+            '\t\t</sequence>\n'
+            '\t</attribute>\n'
+            '\t<attribute id="0x0100">\n'
+            '\t\t<text value="{name}" />\n'
+            '\t</attribute>\n'
+            '</record>\n'
+            '\n').format(handle=handle, service_id=service_id, name=name, channel=channel)
+
+
+def sdp_dump(n, service_id='0x1132', devad='00:11:22:33:44:55'):
+    """ Return an sdptool browse --xml output of n records
+
+    The record of service_id comes last, which is the worst case for the
+    lookup.
+    """
+    out = ['Browsing {} ...\n'.format(devad)]
+    for i in range(n - 1):
+        out.append(sdp_record(0x10000 + i, '0x{:04x}'.format(0x1101 + i % 16),
+                              'Service {}'.format(i), 1 + i % 30))
+    out.append(sdp_record(0x10000 + n, service_id, 'Message Access', 16))
+    return ''.join(out)
+
+
+def split_records(dump):
+    """ Split a dump as get_device_port() did before the incremental parser
+    """
+    return ['<?xml' + r for r in dump.split('<?xml')[1:]]
+
+
+def devices(n):
+    """ Return n (object path, interfaces) tuples as InterfacesAdded args
+    """
+    res = []
+    for i in range(n):
+        addr = ':'.join('{:02X}'.format((i >> s) & 0xff) for s in (40, 32, 24, 16, 8, 0))
+        path = '/org/bluez/hci0/dev_' + addr.replace(':', '_')
+        ifaces = {'org.freedesktop.DBus.Introspectable': {},
+                  'org.bluez.Device1': {'Address': addr,
+                                        'Name': 'Phone {}'.format(i),
+                                        'Paired': True,
+                                        'Connected': False,
+                                        'UUIDs': ['0000112f-0000-1000-8000-00805f9b34fb',
+                                                  '00001132-0000-1000-8000-00805f9b34fb']},
+                  }
+        res.append((path, ifaces))
+    return res
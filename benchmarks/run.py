@@ -0,0 +1,287 @@
+#!/usr/bin/python3
+# run.py: Benchmarks of the btphonelib hot paths
+# Copyright (C) 2018 - 2021 Arnaud Gardelein <arnaud@oscopy.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+""" Time and peak memory of the btphonelib hot paths, on synthetic data
+
+No phone, D-Bus or GTK is needed. Cases which need PyGObject are skipped
+when it is not installed.
+
+    PYTHONPATH=src python3 benchmarks/run.py [-k filter] [--quick]
+        [--json results.json] [--compare baseline.json [--threshold 1.2]]
+
+With --compare, the exit status is 1 when a case is slower than the
+baseline by more than the threshold factor.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fixtures
+from btphonelib import template
+from btphonelib.vcard import iter_contacts
+from btphonelib.sdp import parse_output
+from btphonelib.contacts import ContactIndex, display
+from btphonelib.devices import DeviceRegistry
+from btphonelib.search import ContactSearch
+
+
+class Skip(Exception):
+    """ Raised by a case which cannot run here
+    """
+    pass
+
+
+def case_prepare_message(size):
+    text = ('Bonjour, ceci est un message de test éè. ' * (size // 40 + 1))[:size]
+
+    def run():
+        template.prepare_message('+33612345678', text)
+    return run
+
+
+def case_parse_phonebook(tmpdir, n, photo_size):
+    fn = os.path.join(tmpdir, 'pb-{}-{}.vcf'.format(n, photo_size))
+    if not os.path.exists(fn):
+        fixtures.write_phonebook(fn, n, photo_size)
+
+    def run():
+        for c in iter_contacts(fn):
+            pass
+    return run
+
+
+def case_sdp_parser(n):
+    lines = fixtures.sdp_dump(n).splitlines(True)
+
+    def run():
+        parse_output(lines, ['0x1132'])
+    return run
+
+
+def case_find_service(n):
+    try:
+        from btphonelib.btphone import BTPhone
+    except ImportError as e:
+        raise Skip(str(e))
+    records = fixtures.split_records(fixtures.sdp_dump(n))
+
+    def run():
+        # find_service() does not use the phone connection
+        for record in records:
+            if BTPhone.find_service(None, record, '0x1132') is not None:
+                break
+    return run
+
+
+def recipients(n):
+    entries = [(name, num) for name, tels in fixtures.contacts(n) for num, t in tels]
+    # Typed as displayed, as a number, as a name, and not found
+    typed = [display(*entries[-1]), entries[len(entries) // 2][1],
+             entries[len(entries) // 3][0].lower(), 'Nobody']
+    return entries, typed
+
+
+def case_resolve_index(n):
+    entries, typed = recipients(n)
+    index = ContactIndex()
+    for name, num in entries:
+        index.add(name, num)
+
+    def run():
+        for t in typed:
+            index.lookup(t)
+    return run
+
+
+def case_index_build(n):
+    entries, typed = recipients(n)
+    # Each phonebook read twice, as when refreshed
+    entries = entries * 2
+
+    def run():
+        index = ContactIndex()
+        for name, num in entries:
+            index.add(name, num)
+    return run
+
+
+def case_search_typing(n):
+    entries, typed = recipients(n)
+    index = ContactIndex()
+    for name, num in entries:
+        index.add(name, num)
+    engine = ContactSearch(index.entries)
+    name = entries[len(entries) // 3][0].lower()
+    number = entries[len(entries) // 2][1]
+    # Each keystroke of a name, then of a number
+    keystrokes = [name[:i] for i in range(1, len(name) + 1)] + \
+                 [number[:i] for i in range(1, len(number) + 1)]
+
+    def run():
+        for t in keystrokes:
+            engine.search(t, 50)
+    return run
+
+
+def case_resolve_scan(n):
+    entries, typed = recipients(n)
+    rows = [(display(name, num), num) for name, num in entries]
+
+    def run():
+        # As ok_clicked() did before ContactIndex, walking the store
+        for t in typed:
+            for d, num in rows:
+                if d == t:
+                    break
+    return run
+
+
+def case_interfaces_added(n):
+    # What BTPhone.interfaces_added() and interfaces_removed() do with the
+    # signal arguments
+    devs = fixtures.devices(n)
+
+    def run():
+        registry = DeviceRegistry()
+        registry.added_cb = lambda device: None
+        for path, ifaces in devs:
+            registry.interfaces_added(path, ifaces)
+        registry.best()
+        for path, ifaces in devs:
+            registry.interfaces_removed(path, ifaces)
+    return run
+
+
+def cases(tmpdir, quick):
+    """ Yield (name, params, factory) of each case
+    """
+    for size in (10, 160, 1000, 10000):
+        yield 'prepare_message', {'chars': size}, lambda s=size: case_prepare_message(s)
+    for n in ((1000,) if quick else (1000, 10000, 50000)):
+        for photo in (0, 2048):
+            yield ('parse_phonebook', {'vcards': n, 'photo': photo},
+                   lambda n=n, p=photo: case_parse_phonebook(tmpdir, n, p))
+    for n in (5, 20, 100):
+        yield 'sdp_parser', {'records': n}, lambda n=n: case_sdp_parser(n)
+        yield 'find_service', {'records': n}, lambda n=n: case_find_service(n)
+    for n in ((1000,) if quick else (1000, 10000)):
+        yield 'resolve_index', {'contacts': n}, lambda n=n: case_resolve_index(n)
+        yield 'resolve_scan', {'contacts': n}, lambda n=n: case_resolve_scan(n)
+    for n in ((1000,) if quick else (1000, 20000)):
+        yield 'index_build', {'contacts': n}, lambda n=n: case_index_build(n)
+        yield 'search_typing', {'contacts': n}, lambda n=n: case_search_typing(n)
+    for n in (100, 500):
+        yield 'interfaces_added', {'devices': n}, lambda n=n: case_interfaces_added(n)
+
+
+def measure(run, repeat, min_time=0.2):
+    """ Return the best time of one call of run, and its peak memory
+
+    Each repeat calls run enough times to last about min_time / repeat.
+    """
+    gc.collect()
+    start = time.perf_counter()
+    run()
+    once = time.perf_counter() - start
+    loops = max(1, int(min_time / repeat / max(once, 1e-9)))
+    best = once
+    for i in range(repeat):
+        start = time.perf_counter()
+        for j in range(loops):
+            run()
+        best = min(best, (time.perf_counter() - start) / loops)
+    # tracemalloc slows everything down, measured separately
+    gc.collect()
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def key(result):
+    return result['name'] + ' ' + ' '.join('{}={}'.format(k, v) for k, v in sorted(result['params'].items()))
+
+
+def compare(results, baseline, threshold):
+    """ Print the ratio to the baseline, return the keys of the regressions
+    """
+    base = {key(r): r for r in baseline['results']}
+    regressions = []
+    for r in results:
+        b = base.get(key(r), None)
+        if b is None or r.get('skipped') or b.get('skipped'):
+            continue
+        ratio = r['time'] / b['time']
+        flag = ' REGRESSION' if ratio > threshold else ''
+        print('{:45s} {:6.2f}x{}'.format(key(r), ratio, flag))
+        if flag:
+            regressions.append(key(r))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-k', default='', help='Only run the cases whose name contains this')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timed repeats')
+    parser.add_argument('--quick', action='store_true', help='Skip the largest sizes')
+    parser.add_argument('--json', help='Write the results to this file')
+    parser.add_argument('--compare', help='Compare with the results in this file')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='Slowdown factor reported as a regression')
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='textoter-bench-') as tmpdir:
+        for name, params, factory in cases(tmpdir, args.quick):
+            if args.k not in name:
+                continue
+            res = {'name': name, 'params': params}
+            try:
+                run = factory()
+            except Skip as e:
+                res['skipped'] = str(e)
+                print('{:45s} skipped: {}'.format(key(res), e))
+                results.append(res)
+                continue
+            res['time'], res['peak'] = measure(run, args.repeat)
+            print('{:45s} {:12.1f} us {:10.1f} KiB'.format(key(res), res['time'] * 1e6,
+                                                           res['peak'] / 1024))
+            results.append(res)
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'machine': platform.machine(),
+                       'results': results}, f, indent=1)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1 +1,44 @@
-from .btphone import BTPhone
+# The modules are only imported on first use of their names, so that
+# textoter-send only loads what sending needs, the parsers can be used, and
+# benchmarked, without a DBus environment, and ElementTree is not needed to
+# start the application.
+_LAZY = {'Contact': 'vcard',
+         'iter_contacts': 'vcard',
+         'CachedPhonebook': 'pbcache',
+         'PhonebookCache': 'pbcache',
+         'ContactIndex': 'contacts',
+         'canonical': 'numbers',
+         'is_number': 'numbers',
+         'set_default_region': 'numbers',
+         'PortCache': 'ports',
+         'MAP_SERVICE': 'ports',
+         'PBAP_SERVICE': 'ports',
+         'MessageTemplate': 'template',
+         'Metrics': 'metrics',
+         'Device': 'devices',
+         'DeviceRegistry': 'devices',
+         'SDPParser': 'sdp',
+         'BTPhone': 'btphone',
+         'as_asyncio': 'gasync',
+         'Transfer': 'transfer',
+         'TransferTracker': 'transfer',
+         'SessionPool': 'session',
+         'BulkSender': 'bulk',
+         'BulkReport': 'bulk',
+         'MessageResult': 'bulk',
+         'DeviceProber': 'probe',
+         'Delivery': 'delivery',
+         'BlueZBackend': 'backend',
+         'SimulatedBackend': 'simulated',
+         'SimulatedDevice': 'simulated',
+         'ContactSearch': 'search',
+         'MessageStore': 'messages',
+         }
+
+
+def __getattr__(name):
+    module = _LAZY.get(name, None)
+    if module is None:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    import importlib
+    return getattr(importlib.import_module('.' + module, __name__), name)
@@ -0,0 +1,116 @@
+# backend.py: Access to the Bluetooth services used by BTPhone
+# Copyright (C) 2018 - 2021 Arnaud Gardelein <arnaud@oscopy.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+""" Transport backends of BTPhone
+
+A backend provides what BTPhone talks to:
+
+bus: Gio.DBusConnection or alike
+    The session bus where obexd runs
+
+sysbus: Gio.DBusConnection or alike
+    The system bus where bluetoothd runs
+
+browse(devad, parser) and browse_async(devad, parser)
+    Feed the SDP records of a device, in sdptool browse --xml format, to
+    an sdp.SDPParser until parser.feed() returns True
+
+BlueZBackend uses the real services, simulated.SimulatedBackend emulates
+them in process.
+"""
+
+from gi.repository import GLib
+from gi.repository import Gio
+from subprocess import Popen, PIPE, DEVNULL
+from concurrent.futures import Future
+
+
+class BlueZBackend:
+    """ bluetoothd and obexd on D-Bus, sdptool for SDP browses
+    """
+    def __init__(self):
+        self.bus = Gio.bus_get_sync(Gio.BusType.SESSION)
+        self.sysbus = Gio.bus_get_sync(Gio.BusType.SYSTEM)
+
+    def browse(self, devad, parser):
+        """ Run sdptool on devad and feed its output to parser
+
+        sdptool output is read from the pipe while it is produced, sdptool
+        is stopped as soon as parser has found everything.
+
+        Parameters
+        ----------
+        devad: str
+        The device to browse
+
+        parser: sdp.SDPParser
+        The parser to feed
+
+        Returns
+        -------
+        dict of str:int
+        parser.ports
+        """
+        from .sdp import sdptool_args
+        try:
+            proc = Popen(sdptool_args(devad), stdout=PIPE, stderr=DEVNULL,
+                         encoding='utf-8')
+        except OSError as e:
+            print(e)
+            return {}
+        with proc:
+            for line in proc.stdout:
+                if parser.feed(line):
+                    proc.terminate()
+                    break
+        return parser.ports
+
+    def browse_async(self, devad, parser):
+        """ Same as browse() without blocking, sdptool is run with
+        Gio.Subprocess and its output read line by line asynchronously
+
+        Returns
+        -------
+        Future
+        Resolved with parser.ports
+        """
+        from .sdp import sdptool_args
+        future = Future()
+        try:
+            proc = Gio.Subprocess.new(sdptool_args(devad),
+                                      Gio.SubprocessFlags.STDOUT_PIPE |
+                                      Gio.SubprocessFlags.STDERR_SILENCE)
+        except GLib.Error as e:
+            print(e.message)
+            future.set_result({})
+            return future
+        stream = Gio.DataInputStream.new(proc.get_stdout_pipe())
+
+        def on_line(stream, result, future):
+            try:
+                line, length = stream.read_line_finish_utf8(result)
+            except GLib.Error as e:
+                print(e.message)
+                line = None
+            if line is None:
+                # End of output
+                future.set_result(parser.ports)
+                return
+            if parser.feed(line):
+                proc.force_exit()
+                future.set_result(parser.ports)
+                return
+            stream.read_line_async(GLib.PRIORITY_DEFAULT, None, on_line, future)
+        stream.read_line_async(GLib.PRIORITY_DEFAULT, None, on_line, future)
+        return future
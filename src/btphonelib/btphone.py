@@ -15,25 +15,41 @@
 import gi
 from gi.repository import GLib
 from gi.repository import Gio
-from subprocess import run
-import io
-import traceback
-import xml.etree.ElementTree as ET
-import vobject
+import os
+import stat
+import tempfile
 import time
+import atexit
+from .gasync import run_task, resolved
+from .transfer import TransferTracker
+from .vcard import iter_contacts
+from .pbcache import COUNTERS, MAIN_FOLDER, FOLDERS, merge_contacts
+from .session import SessionPool
+from .bulk import BulkSender, MessageResult
+from .ports import PortCache, TARGETS, MAP_SERVICE
+from .backend import BlueZBackend
+from .metrics import Metrics, STATS_ENV
+from .delivery import Delivery, DeliveryTracker, MESSAGE_IFACE
+from .devices import DeviceRegistry, DEVICE_IFACE
+from .probe import DeviceProber
+from . import template
+from concurrent.futures import Future
 DBUS_NAME = 'org.bluez.obex'
 DBUS_PATH = '/org/bluez/obex'
 DBUS_SYS_NAME = 'org.bluez'
 DBUS_SYS_PATH = '/org/bluez'
 HCI = 'hci'
+# The vCard fields textoter uses, the only ones requested to the phone
+FIELDS = ('VERSION', 'N', 'FN', 'TEL', 'X-IRMC-CALL-DATETIME')
+# Contacts per PullAll when pulling by pages
+PAGE_SIZE = 100
+# MAP folders synchronized by sync_messages_async(), and messages per listing
+MAP_FOLDERS = ('inbox', 'sent')
+MAP_PAGE_SIZE = 50
+# Seconds before pushing again a message with several recipients to a
+# device which refused one
+GROUP_RETRY_AFTER = 3600
 
-header = 'BEGIN:BMSG\r\nVERSION:1.0\r\nSTATUS:READ\r\nTYPE:MMS\r\nFOLDER:null\r\nBEGIN:BENV\r\n'
-footer = 'END:BENV\r\nEND:BMSG\r\n'
-vcard2 = 'BEGIN:VCARD\r\nVERSION:2.1\r\nN:null;;;;\r\nTEL:{}\r\nEND:VCARD\r\n'
-body2 = 'BEGIN:BBODY\r\nLENGTH:{}\r\nBEGIN:MSG\r\n{}\r\nEND:MSG\r\nEND:BBODY\r\n'
-msg_header = 'BEGIN:MSG\r\n'
-msg_footer = '\r\nEND:MSG\r\n'
-msg_length = 'BEGIN:BBODY\r\nLENGTH:{}\r\n'
 
 class BTPhone:
     """ A class representing a phone connected using Bluetooth
@@ -50,84 +66,546 @@ class BTPhone:
     4. Send the message with push_message()
     5. Close the session
     """
-    def __init__(self, bus_name=DBUS_NAME, bus_path=DBUS_PATH):
+    def __init__(self, bus_name=DBUS_NAME, bus_path=DBUS_PATH, backend=None):
         self.bus_name = bus_name
         self.bus_path = bus_path
-        self.bus = Gio.bus_get_sync(Gio.BusType.SESSION)
-        self.sysbus = Gio.bus_get_sync(Gio.BusType.SYSTEM)
-        self.paths2dev = {}
+        # See backend.py, simulated.SimulatedBackend runs without a phone
+        self.backend = backend if backend is not None else BlueZBackend()
+        self.bus = self.backend.bus
+        self.sysbus = self.backend.sysbus
+        self.metrics = Metrics()
+        if os.environ.get(STATS_ENV):
+            atexit.register(self.metrics.dump, os.environ[STATS_ENV])
+        self.devices = DeviceRegistry()
+        self.devices.added_cb = self.device_added
+        self.devices.removed_cb = self.device_removed
+        self.devices.changed_cb = self.device_changed
         self.path = None
         self.port = None
+        self.ports = PortCache()
         self.iface_added_cb = None
         self.iface_removed_cb = None
+        self.transfers = TransferTracker(self)
+        # PBAP filters, photos and other unused fields are not transferred
+        self.vcard_fields = FIELDS
+        # 'vcard21' or 'vcard30', None for the phone default
+        self.vcard_format = None
+        self.deliveries = DeliveryTracker(self)
+        self.sessions = SessionPool(self)
+        self.prober = DeviceProber(self)
+        # Time at which each device rejected a message with several
+        # recipients, see group_supported()
+        self.group_unsupported = {}
+        self.probing = False
+        # Only the objects below /org/bluez/, the adapters and devices
         self.signal_subscribe('org.freedesktop.DBus.ObjectManager',
                               'InterfacesAdded',
                               self.interfaces_added,
-                              None,
+                              DBUS_SYS_PATH + '/',
                               bus=self.sysbus,
                               name=DBUS_SYS_NAME,
-                              path='/')
+                              path='/',
+                              flags=Gio.DBusSignalFlags.MATCH_ARG0_PATH)
         self.signal_subscribe('org.freedesktop.DBus.ObjectManager',
                               'InterfacesRemoved',
                               self.interfaces_removed,
-                              None,
+                              DBUS_SYS_PATH + '/',
                               bus=self.sysbus,
                               name=DBUS_SYS_NAME,
-                              path='/')
-        # Initialize the list on first time
-        self.get_devices()
+                              path='/',
+                              flags=Gio.DBusSignalFlags.MATCH_ARG0_PATH)
+        # Name and connection changes of the devices
+        self.sysbus.signal_subscribe(DBUS_SYS_NAME,  # sender
+                                     'org.freedesktop.DBus.Properties',
+                                     'PropertiesChanged',
+                                     None,  # any object path
+                                     DEVICE_IFACE,  # arg0
+                                     Gio.DBusSignalFlags.NONE,
+                                     self.device_properties_changed,
+                                     None,  # user data
+                                     )
+        # Enumerate once, the registry is then updated by the signals
+        self.load_devices()
 
-    def read_phonebook(self, devad):
+    def read_phonebook(self, devad, progress_cb=None):
         """ Read the PhoneBook of devad
 
-        While transferring the data on Bluetooth link, poll the status
-        every 0.1 s.
+        While transferring the data on Bluetooth link, the main loop is
+        iterated until the transfer signals its completion. This is only
+        possible outside of the main loop callbacks, applications with a
+        main loop use read_phonebook_async().
 
         Parameters
         ----------
         devad: str
         The device address to read the phonebook from
 
+        progress_cb: callable(int, int or None) or None (default None)
+        Called with transferred bytes and size during the transfer
+
         Returns
         -------
-        list of vcard
-        The list of the parsed vcards
+        list of Contact
+        The list of the parsed contacts
         """
         vcards = []
         # Retrieve the Bluetooth port
-        port = self.get_device_port(devad, service_id='0x112f')
-
         # Perform session to retrieve the phonebook
-        self.create_session(devad, port, target='pbap')
+        if self.create_session(devad, target='pbap') is None:
+            return vcards
         self.select_pb()
         res = self.pullall_pb()
         if res is None:
             return vcards
         fn = res[1]['Filename']
-        transfer_path = res[0]
-        status = res[1]['Status']
-        
+        transfer = self.transfers.track(res[0], res[1]['Status'],
+                                        res[1].get('Size', None), progress_cb)
+
         # Wait for transfer completion
-        while status == 'queued':
-            # poll every 0.1 s
-            time.sleep(0.1)
-            res = self.get_transfer_status(transfer_path)
-            if res is None:
-                break
-            status = res[0]
-        data = ''
-        # Process vcards file
-        with open(fn, 'r') as f:
-            for line in f:
-                data = data + line
-                if 'END:VCARD' in line:
-                    vcards.append(vobject.readOne(data))
-                    data = ''
+        if self.transfers.wait(transfer) != 'error':
+            vcards = self.parse_vcards(fn)
 
         # Close the session, this delete the temporary transfer file
         self.remove_session()
         return vcards
-        
+
+    def read_phonebook_async(self, devad, progress_cb=None, folders=(MAIN_FOLDER,),
+                             page_size=None, page_cb=None):
+        """ Read the PhoneBook of devad without blocking
+
+        Same sequence as read_phonebook(), using asynchronous calls. The
+        session is independent from self.path so several operations can
+        be overlapped. All the folders are read in the same session, the
+        ones the phone does not have are skipped.
+
+        Parameters
+        ----------
+        devad: str
+        The device address to read the phonebook from
+
+        progress_cb: callable(int, int or None) or None (default None)
+        Called with transferred bytes and size during the transfer
+
+        folders: tuple of str (default (MAIN_FOLDER,))
+        The phonebooks to read, as 'location/name', the first one being
+        the main phonebook, the others merged with pbcache.merge_contacts()
+
+        page_size: int or None (default None)
+        Pull the phonebooks by pages of page_size contacts, at once if None
+
+        page_cb: callable(str, list of Contact) or None (default None)
+        Called with the folder and the contacts of each page, as they
+        arrive
+
+        Returns
+        -------
+        Future
+        Resolved with the list of the parsed contacts
+        """
+        def op():
+            session = yield self.create_session_async(devad, target='pbap')
+            if session is None:
+                return []
+            try:
+                pulled = {}
+                for folder in folders:
+                    contacts = yield from self.pull_folder(session, folder, progress_cb,
+                                                           page_size, page_cb)
+                    if contacts is not None:
+                        pulled[folder] = contacts
+                main = pulled.pop(folders[0], []) if folders else []
+                return merge_contacts(main, pulled)
+            finally:
+                # Close the session, this delete the temporary transfer files
+                yield self.remove_session_async(session)
+        return run_task(op())
+
+    def pull_vcards(self, session, method, args, progress_cb=None):
+        """ Pull vcards with PullAll or Pull and parse them
+
+        Generator, to be delegated to with yield from in a task.
+
+        Returns
+        -------
+        list of Contact or None
+        The parsed contacts, None on error
+        """
+        res = yield self.bus_call('org.bluez.obex.PhonebookAccess1',
+                                  method,
+                                  args=args, path=session[0])
+        if res is None:
+            return None
+        transfer = self.transfers.track(res[0], res[1]['Status'],
+                                        res[1].get('Size', None),
+                                        progress_cb)
+        status = yield transfer.future
+        if status == 'error':
+            return None
+        return self.parse_vcards(res[1]['Filename'])
+
+    def pull_filters(self, offset=None, max_count=None):
+        """ Return the filters of PullAll and Pull
+
+        Parameters
+        ----------
+        offset: int or None (default None)
+        The index of the first vcard to return, PullAll only
+
+        max_count: int or None (default None)
+        The maximum number of vcards to return, PullAll only
+
+        Returns
+        -------
+        dict of str:GLib.Variant
+        The filters
+        """
+        filters = {}
+        if self.vcard_fields:
+            filters['Fields'] = GLib.Variant('as', list(self.vcard_fields))
+        if self.vcard_format is not None:
+            filters['Format'] = GLib.Variant('s', self.vcard_format)
+        if offset is not None:
+            filters['Offset'] = GLib.Variant('q', offset)
+        if max_count is not None:
+            filters['MaxCount'] = GLib.Variant('q', max_count)
+        return filters
+
+    def pull_folder(self, session, folder, progress_cb=None, page_size=None, page_cb=None,
+                    select=True):
+        """ Select the phonebook folder and pull all its vcards
+
+        Generator, to be delegated to with yield from in a task.
+
+        Parameters
+        ----------
+        session: tuple
+        The PBAP session
+
+        folder: str
+        The phonebook as 'location/name', such as 'sim1/pb' or 'int/cch'
+
+        progress_cb: callable(int, int or None) or None (default None)
+        Called with transferred bytes and size during each transfer
+
+        page_size: int or None (default None)
+        Pull by pages of page_size vcards, at once if None
+
+        page_cb: callable(str, list of Contact) or None (default None)
+        Called with folder and the contacts of each page
+
+        select: bool (default True)
+        Whether to select folder first, False if already selected
+
+        Returns
+        -------
+        list of Contact or None
+        The parsed contacts, None if the phone does not have folder
+        """
+        if select:
+            location, name = folder.split('/')
+            res = yield self.bus_call('org.bluez.obex.PhonebookAccess1',
+                                      'Select',
+                                      args=GLib.Variant('(ss)', (location, name)),
+                                      path=session[0])
+            if res is None:
+                return None
+        if page_size is None:
+            contacts = yield from self.pull_vcards(session, 'PullAll',
+                                                   GLib.Variant('(sa{sv})', ('', self.pull_filters())),
+                                                   progress_cb)
+            if contacts is not None and page_cb is not None:
+                page_cb(folder, contacts)
+            return contacts
+        contacts = []
+        while True:
+            filters = self.pull_filters(len(contacts), page_size)
+            page = yield from self.pull_vcards(session, 'PullAll',
+                                               GLib.Variant('(sa{sv})', ('', filters)),
+                                               progress_cb)
+            if page is None:
+                # Keep the pages already pulled
+                return contacts if contacts else None
+            contacts.extend(page)
+            if page and page_cb is not None:
+                page_cb(folder, page)
+            # A short page is the last one, as is a phone ignoring MaxCount
+            if len(page) != page_size:
+                return contacts
+
+    def read_counters(self, session):
+        """ Return the PBAP version counters of the selected folder
+
+        Generator, to be delegated to with yield from in a task.
+
+        Returns
+        -------
+        dict of str:str
+        The counters, empty when the phone does not provide them, as
+        before PBAP 1.2
+        """
+        res = yield self.bus_call('org.freedesktop.DBus.Properties',
+                                  'GetAll',
+                                  args=GLib.Variant('(s)', ('org.bluez.obex.PhonebookAccess1',)),
+                                  path=session[0],
+                                  reply=GLib.VariantType('(a{sv})'))
+        if res is None:
+            return {}
+        return {k: str(v) for k, v in res[0].items() if k in COUNTERS}
+
+    def sync_phonebook_async(self, devad, phonebook, progress_cb=None, folders=FOLDERS,
+                             full=False):
+        """ Refresh phonebook from devad, transferring only what changed
+
+        The PBAP version counters are read first, when they did not change
+        nothing else is transferred. Otherwise the listing is read and
+        compared with the cached one, new or renamed entries are pulled
+        one by one. When too many entries changed, or nothing is cached,
+        the whole phonebook is pulled, and if its cards do not match the
+        listing, they are pulled one by one.
+
+        The other folders are then read in the same session and stored in
+        phonebook.folders. Each one is pulled whole, but only when its own
+        counters changed, or, for phones without counters, when the main
+        phonebook changed. A full refresh pulls them all.
+
+        Parameters
+        ----------
+        devad: str
+        The device address to read the phonebook from
+
+        phonebook: pbcache.CachedPhonebook
+        The cached phonebook of devad, updated in place
+
+        progress_cb: callable(int, int or None) or None (default None)
+        Called with transferred bytes and size during a full transfer
+
+        folders: tuple of str (default FOLDERS)
+        The other phonebooks to read, as 'location/name'. The ones the
+        phone does not have are skipped
+
+        full: bool (default False)
+        Pull the other folders even when they did not change
+
+        Returns
+        -------
+        Future
+        Resolved with True if phonebook changed, False if not, None if the
+        phone could not be reached
+        """
+        def sync(session):
+            res = yield self.bus_call('org.bluez.obex.PhonebookAccess1',
+                                      'Select',
+                                      args=GLib.Variant('(ss)', ('int', 'pb')),
+                                      path=session[0])
+            if res is None:
+                return None
+            counters = yield from self.read_counters(session)
+            if phonebook.unchanged(counters):
+                return False
+            res = yield self.bus_call('org.bluez.obex.PhonebookAccess1',
+                                      'List',
+                                      args=GLib.Variant('(a{sv})', ({},)),
+                                      path=session[0])
+            if res is None:
+                return None
+            listing = [(str(h), str(n)) for h, n in res[0]]
+            if phonebook.unchanged(counters, listing):
+                phonebook.counters = counters
+                return False
+            handles = phonebook.delta(listing)
+            if not phonebook.contacts or len(handles) > len(listing) // 2:
+                contacts = yield from self.pull_vcards(session, 'PullAll',
+                                                       GLib.Variant('(sa{sv})', ('', self.pull_filters())),
+                                                       progress_cb)
+                if contacts is None:
+                    return None
+                if phonebook.replace(listing, contacts, counters):
+                    return True
+                # The cards cannot be matched with the handles, pull them
+                # one by one this time so that the next syncs are deltas
+                handles = [h for h, n in listing]
+            pulled = {}
+            for handle in handles:
+                contacts = yield from self.pull_vcards(session, 'Pull',
+                                                       GLib.Variant('(ssa{sv})', (handle, '', self.pull_filters())),
+                                                       progress_cb)
+                if contacts is None:
+                    return None
+                if contacts:
+                    pulled[handle] = contacts[0]
+            phonebook.update(listing, pulled, counters)
+            return True
+
+        def op():
+            session = yield self.create_session_async(devad, target='pbap')
+            if session is None:
+                return None
+            try:
+                changed = yield from sync(session)
+                if changed is None:
+                    return None
+                for folder in folders:
+                    location, name = folder.split('/')
+                    res = yield self.bus_call('org.bluez.obex.PhonebookAccess1',
+                                              'Select',
+                                              args=GLib.Variant('(ss)', (location, name)),
+                                              path=session[0])
+                    if res is None:
+                        # Not on this phone
+                        continue
+                    counters = yield from self.read_counters(session)
+                    if not full and folder in phonebook.folders:
+                        if counters and phonebook.folder_counters.get(folder, None) == counters:
+                            continue
+                        if not counters and not changed:
+                            continue
+                    contacts = yield from self.pull_folder(session, folder, progress_cb,
+                                                           select=False)
+                    if contacts is not None and phonebook.set_folder(folder, contacts, counters):
+                        changed = True
+                return changed
+            finally:
+                # Close the session, this delete the temporary transfer files
+                yield self.remove_session_async(session)
+        return run_task(op())
+
+    def sync_messages_async(self, devad, store, folders=MAP_FOLDERS,
+                            page_size=MAP_PAGE_SIZE, message_cb=None):
+        """ Copy the new messages of devad to store
+
+        The folders are listed by pages, newest messages first as phones
+        do, and only the messages whose handle is not in store are
+        transferred. Once a sync listed a whole folder, listing stops at the
+        first page without new message, so a repeated sync lists a single
+        page per folder. An interrupted sync lists the whole folder again
+        the next time, not to miss the older pages. A session of its
+        own is used, as the folder it selects would apply to the messages
+        pushed on the pooled sessions.
+
+        Parameters
+        ----------
+        devad: str
+        The device address
+
+        store: messages.MessageStore
+        The local store, updated as messages arrive
+
+        folders: tuple of str (default MAP_FOLDERS)
+        The folders below telecom/msg to synchronize
+
+        page_size: int (default MAP_PAGE_SIZE)
+        The number of messages per listing
+
+        message_cb: callable(Message) or None (default None)
+        Called with each message stored
+
+        Returns
+        -------
+        Future
+        Resolved with the number of messages added, None if the phone
+        could not be reached
+        """
+        # SQLite is only needed when messages are read
+        from .messages import message_from_map, message_handle
+
+        def get(path, folder, props):
+            res = yield self.bus_call(MESSAGE_IFACE,
+                                      'Get',
+                                      args=GLib.Variant('(sb)', ('', False)),
+                                      path=path)
+            if res is None:
+                return None
+            transfer = self.transfers.track(res[0], res[1]['Status'],
+                                            res[1].get('Size', None))
+            status = yield transfer.future
+            if status == 'error':
+                return None
+            try:
+                with open(res[1]['Filename'], 'r', encoding='utf-8', errors='replace') as f:
+                    data = f.read()
+            except OSError as e:
+                print('Unable to read message:', e)
+                return None
+            # Do not keep the files of a long sync until the session is
+            # removed
+            try:
+                os.unlink(res[1]['Filename'])
+            except OSError:
+                pass
+            return message_from_map(message_handle(path), folder, props, data)
+
+        def op():
+            session = yield self.create_session_async(devad, target='map')
+            if session is None:
+                return None
+            try:
+                res = yield self.bus_call('org.bluez.obex.MessageAccess1',
+                                          'SetFolder',
+                                          args=GLib.Variant('(s)', ('/telecom/msg',)),
+                                          path=session[0])
+                if res is None:
+                    return None
+                added = 0
+                for folder in folders:
+                    known = store.handles(devad, folder)
+                    # Cleared until this pass completes, in case it is
+                    # interrupted
+                    complete = store.complete(devad, folder)
+                    store.set_complete(devad, folder, False)
+                    failed = False
+                    offset = 0
+                    while True:
+                        filters = {'Offset': GLib.Variant('q', offset),
+                                   'MaxCount': GLib.Variant('q', page_size)}
+                        res = yield self.bus_call('org.bluez.obex.MessageAccess1',
+                                                  'ListMessages',
+                                                  args=GLib.Variant('(sa{sv})', (folder, filters)),
+                                                  path=session[0])
+                        if res is None:
+                            failed = True
+                            break
+                        # Listing is a{oa{sv}}, the properties by object path
+                        listing = [(str(p), props) for p, props in res[0].items()]
+                        new = [(p, props) for p, props in listing
+                               if message_handle(p) not in known]
+                        for path, props in new:
+                            message = yield from get(path, folder, props)
+                            if message is None:
+                                failed = True
+                                continue
+                            added += store.add(devad, [message])
+                            known.add(message.handle)
+                            if message_cb is not None:
+                                message_cb(message)
+                        if (complete and not new) or len(listing) < page_size:
+                            break
+                        offset += page_size
+                    if not failed:
+                        store.set_complete(devad, folder, True)
+                return added
+            finally:
+                # Close the session, this delete the temporary transfer files
+                yield self.remove_session_async(session)
+        return run_task(op())
+
+    def parse_vcards(self, fn):
+        """ Parse the vcards file transferred from the phone
+
+        The file is parsed by vcard.iter_contacts() which only keeps the
+        fields textoter uses.
+
+        Parameters
+        ----------
+        fn: str
+        The file name of the transfer
+
+        Returns
+        -------
+        list of Contact
+        The list of the parsed contacts
+        """
+        return list(iter_contacts(fn))
+
     def find_service(self, record, service_id='0x1132'):
         """ Parse XML to find relevant record including port for MAP
         Return port, None if not found
@@ -145,21 +623,13 @@ class BTPhone:
         int or None
         The port related to service_id, None if not found
         """
-        root = ET.fromstring(record)
-        if root.find('./attribute[@id="0x0001"]/sequence/uuid[@value="{}"]'.format(service_id)) is not None:
-            port = root.find('./attribute[@id="0x0004"]/sequence/sequence/uuid[@value="0x0003"]/../uint8')
-            print(port.attrib)
-            if port is None:
-                return None
-            else:
-                return int(port.attrib['value'], 16)
+        from .sdp import parse_output
+        return parse_output(record, [service_id]).get(service_id, None)
 
     def get_device_port(self, devad, service_id='0x1132'):
         """ Lookup for service on device
 
-        Browse device using sdptool with XML output, then parse the XML
-        sdptool is run on a separate process, output is captured.
-        Capture is then analyzed with self.find_service()
+        Browse device using sdptool with XML output, see get_device_ports()
 
         Parameters
         ----------
@@ -169,30 +639,85 @@ class BTPhone:
         service_id: str (default '0x1132')
         The service ID to lookup, in hex format
         """
-        res = run(['/usr/bin/sdptool', 'browse', '--xml', devad],
-                  capture_output=True,
-                  encoding='utf-8')
-        b_in = io.StringIO(res.stdout)
-        record = ''
-        for line in b_in:
-            if line.strip().startswith('<?xml'):
-                # New record
-                record = line
-            elif line.strip().startswith('</record>'):
-                # Record completed
-                record = record + line
-                # Parse data recorded so far
-                self.port = self.find_service(record, service_id)
-                if self.port is not None:
-                    break
-            else:
-                # Append line
-                if line.strip().startswith('<'):
-                    record = record + line
-                else:
-                    continue
+        self.port = self.get_device_ports(devad, [service_id]).get(service_id, None)
         return self.port
 
+    def get_device_ports(self, devad, service_ids):
+        """ Lookup for several services on device in one browse
+
+        The records are parsed incrementally with sdp.SDPParser, the browse
+        is stopped as soon as all the services were found, see
+        backend.BlueZBackend.browse().
+
+        Parameters
+        ----------
+        devad: str
+        The device to scan
+
+        service_ids: iterable of str
+        The service IDs to lookup, in hex format
+
+        Returns
+        -------
+        dict of str:int
+        The port of each service found
+        """
+        # ElementTree is only loaded when a device is browsed
+        from .sdp import SDPParser
+        start = time.monotonic()
+        ports = self.backend.browse(devad, SDPParser(service_ids))
+        self.metrics.record_browse(time.monotonic() - start, bool(ports))
+        return ports
+
+    def get_device_port_async(self, devad, service_id='0x1132'):
+        """ Lookup for service on device without blocking
+
+        Same as get_device_port(), self.port is not modified.
+
+        Parameters
+        ----------
+        devad: str
+        The device to scan
+
+        service_id: str (default '0x1132')
+        The service ID to lookup, in hex format
+
+        Returns
+        -------
+        Future
+        Resolved with the port, None if not found
+        """
+        def op():
+            ports = yield self.get_device_ports_async(devad, [service_id])
+            return ports.get(service_id, None)
+        return run_task(op())
+
+    def get_device_ports_async(self, devad, service_ids):
+        """ Lookup for several services on device without blocking
+
+        Same as get_device_ports(), see backend.BlueZBackend.browse_async().
+
+        Parameters
+        ----------
+        devad: str
+        The device to scan
+
+        service_ids: iterable of str
+        The service IDs to lookup, in hex format
+
+        Returns
+        -------
+        Future
+        Resolved with the dict of the port of each service found
+        """
+        from .sdp import SDPParser
+        start = time.monotonic()
+        future = self.backend.browse_async(devad, SDPParser(service_ids))
+        # A browse which raised found nothing
+        future.add_done_callback(lambda f: self.metrics.record_browse(
+            time.monotonic() - start, f.exception() is None and bool(f.result())))
+        return future
+
     def introspect(self, bus, name, path):
         """ Instrospect an object on DBus
 
@@ -248,27 +773,27 @@ class BTPhone:
     def get_devices(self):
         """ Retrieve list of Bluetooth Devices
 
-        Use DBus's GetManagedObjects
+        The devices are read from self.devices, without DBus call
 
         Returns
         -------
         devs: dict of str:str pairs
         A dict associating the bluetooth device address with its name
         """
-        # Look for adapter
+        return self.devices.names()
+
+    def load_devices(self):
+        """ Enumerate the devices with GetManagedObjects, once at startup
+
+        Later changes are applied from the signals, see devices.py.
+        """
         res = self.bus_call_sync('org.freedesktop.DBus.ObjectManager',
                                  'GetManagedObjects',
                                  bus=self.sysbus,
                                  name=DBUS_SYS_NAME,
                                  path='/')
-        devs = {}
-        for path, dev in res[0].items():
-            mydev = dev.get('org.bluez.Device1', None)
-            if mydev is not None:
-                devs[mydev.get('Address', None)] = mydev.get('Name', None)
-                self.interfaces_added(None, None, None, None, None,
-                                    (path, dev), None)
-        return devs
+        if res is not None:
+            self.devices.load(res[0])
         
     def create_session(self, dev=None, port=None, target='map'):
         """ Create session on DBus client
@@ -279,8 +804,9 @@ class BTPhone:
         The device address to use
 
         port: int or None (default None)
-        The RFCOMM port to use, if None the device is scanned to retrieve
-        the service.
+        The RFCOMM port to use, if None the port is taken from self.ports,
+        the device being scanned when unknown. When the session cannot
+        be created on a cached port, the port is discovered again.
 
         target: str (default 'map')
         The target service name
@@ -291,26 +817,470 @@ class BTPhone:
         The path to the created session
         """
         # FIXME: What happens when dev is None ?
+        service_id = TARGETS.get(target, MAP_SERVICE)
+        cached = port is None and self.ports.get(dev, service_id) is not None
         if port is None:
-            print('Scanning device')
-            self.get_device_port(dev)
-            print('port:', self.port)
+            self.port = self.lookup_port(dev, service_id)
         else:
-            print('Using already known port', port)
             self.port = port
         if self.port is None:
             return None
-        args = GLib.Variant('(sa{sv})', (dev,
-                                         {'Target': GLib.Variant('s', target),
-                                          'Channel': GLib.Variant('y', self.port),}))
         self.path = self.bus_call_sync('org.bluez.obex.Client1',
                                        'CreateSession',
                                        path=self.bus_path,
-                                       args=args)
-        
-        print('path:', self.path)
+                                       args=self.session_args(dev, self.port, target))
+        if self.path is None and cached:
+            # The channel may have changed, scan the device again
+            old = self.port
+            self.ports.invalidate(dev, service_id)
+            self.port = self.lookup_port(dev, service_id)
+            if self.port is not None and self.port != old:
+                self.path = self.bus_call_sync('org.bluez.obex.Client1',
+                                               'CreateSession',
+                                               path=self.bus_path,
+                                               args=self.session_args(dev, self.port, target))
         return self.path
 
+    def create_session_async(self, dev=None, port=None, target='map'):
+        """ Create session on DBus client without blocking
+
+        Contrary to create_session(), neither self.path nor self.port
+        are modified, the session path is returned instead.
+
+        Parameters
+        ----------
+        dev: str or None (default None)
+        The device address to use
+
+        port: int or None (default None)
+        The RFCOMM port to use, if None the port is taken from self.ports,
+        the device being scanned when unknown. When the session cannot
+        be created on a cached port, the port is discovered again.
+
+        target: str (default 'map')
+        The target service name
+
+        Returns
+        -------
+        Future
+        Resolved with a tuple containing the session objectpath, None on
+        failure
+        """
+        service_id = TARGETS.get(target, MAP_SERVICE)
+        def op(port):
+            cached = port is None and self.ports.get(dev, service_id) is not None
+            if port is None:
+                port = yield self.lookup_port_async(dev, service_id)
+            if port is None:
+                return None
+            path = yield self.bus_call('org.bluez.obex.Client1',
+                                       'CreateSession',
+                                       path=self.bus_path,
+                                       args=self.session_args(dev, port, target))
+            if path is None and cached:
+                # The channel may have changed, scan the device again
+                self.ports.invalidate(dev, service_id)
+                new_port = yield self.lookup_port_async(dev, service_id)
+                if new_port is not None and new_port != port:
+                    path = yield self.bus_call('org.bluez.obex.Client1',
+                                               'CreateSession',
+                                               path=self.bus_path,
+                                               args=self.session_args(dev, new_port, target))
+            return path
+        return run_task(op(port))
+
+    def session_args(self, dev, port, target):
+        """ Return the CreateSession arguments
+        """
+        return GLib.Variant('(sa{sv})', (dev,
+                                         {'Target': GLib.Variant('s', target),
+                                          'Channel': GLib.Variant('y', port),}))
+
+    def lookup_port(self, devad, service_id=MAP_SERVICE):
+        """ Return the port of service_id on devad from self.ports, scan the
+        device if unknown
+
+        Parameters
+        ----------
+        devad: str
+        The device address
+
+        service_id: str (default MAP_SERVICE)
+        The service ID to lookup, in hex format
+
+        Returns
+        -------
+        int or None
+        The port, None if the service was not found
+        """
+        port = self.ports.get(devad, service_id)
+        if port is None:
+            # Fill the cache for all the services in the same browse
+            ports = self.get_device_ports(devad, self.browsed_services(service_id))
+            self.ports.update({(devad, s): p for s, p in ports.items()})
+            port = ports.get(service_id, None)
+        return port
+
+    def lookup_port_async(self, devad, service_id=MAP_SERVICE):
+        """ Same as lookup_port() without blocking
+
+        Returns
+        -------
+        Future
+        Resolved with the port, None if the service was not found
+        """
+        port = self.ports.get(devad, service_id)
+        if port is not None:
+            return resolved(port)
+        def op():
+            # Fill the cache for all the services in the same browse
+            ports = yield self.get_device_ports_async(devad, self.browsed_services(service_id))
+            self.ports.update({(devad, s): p for s, p in ports.items()})
+            return ports.get(service_id, None)
+        return run_task(op())
+
+    def browsed_services(self, service_id):
+        """ Return the services looked up when service_id is browsed
+        """
+        services = set(TARGETS.values())
+        services.add(service_id)
+        return services
+
+    def remove_session_async(self, session=None):
+        """ Remove session from DBus client without blocking
+
+        Parameters
+        ----------
+        session: tuple or None (default None)
+        The session path as returned by create_session_async(),
+        self.path if None
+
+        Returns
+        -------
+        Future
+        Resolved when the session is removed
+        """
+        if session is None:
+            session = self.path
+        if session is None:
+            return resolved(None)
+        return self.bus_call('org.bluez.obex.Client1',
+                             'RemoveSession',
+                             args=GLib.Variant('(o)', (session[0],)),
+                             name=self.bus_name,
+                             path=self.bus_path)
+
+    def push_message_async(self, filename, session=None):
+        """ Push message to phone for transmission without blocking
+
+        Parameters
+        ----------
+        filename: str
+        The file containing the message in bMessage format
+
+        session: tuple or None (default None)
+        The session path as returned by create_session_async(),
+        self.path if None
+
+        Returns
+        -------
+        Future
+        Resolved with True if the message was queued, the transfer is not
+        followed, see deliver_async()
+        """
+        if session is None:
+            session = self.path
+        if session is None:
+            return resolved(False)
+        def op():
+            transfer = yield self.push_file_async(filename, session)
+            return transfer is not None and transfer.status == 'queued'
+        return run_task(op())
+
+    def push_file_async(self, filename, session):
+        """ Push message to phone and track the resulting transfer
+
+        Parameters
+        ----------
+        filename: str
+        The file containing the message in bMessage format
+
+        session: tuple
+        The session path as returned by create_session_async()
+
+        Returns
+        -------
+        Future
+        Resolved with the transfer.Transfer tracking the push, None if
+        the push was refused
+        """
+        def op():
+            args = GLib.Variant('(ssa{sv})', (filename, '/telecom/msg/outbox', {},))
+            res = yield self.bus_call('org.bluez.obex.MessageAccess1',
+                                      'PushMessage',
+                                      args=args, path=session[0])
+            if res is None:
+                return None
+            return self.transfers.track(res[0], res[1]['Status'],
+                                        res[1].get('Size', None))
+        return run_task(op())
+
+    def send_group_async(self, dev, nums, t, result_cb=None):
+        """ Send the same message to several recipients in one push
+
+        A single bMessage with all the recipients is pushed. When the phone
+        rejects it, the message is sent to each recipient separately with
+        send_bulk_async(). If these pushes succeed, the group message was
+        refused rather than lost with the link, and the device is
+        remembered for GROUP_RETRY_AFTER so that the next group sends go
+        straight to individual pushes.
+
+        Parameters
+        ----------
+        dev: str
+        The device address to use
+
+        nums: list of str
+        The destination phone numbers
+
+        t: str
+        The text of the message
+
+        result_cb: callable(MessageResult) or None (default None)
+        Called after each recipient outcome
+
+        Returns
+        -------
+        Future
+        Resolved with the list of MessageResult, one per recipient
+        """
+        nums = list(nums)
+        def op():
+            grouped = len(nums) > 1 and self.group_supported(dev)
+            if grouped:
+                start = time.monotonic()
+                filename = self.write_message(self.prepare_group_message(nums, t))
+                session = None
+                status = None
+                try:
+                    session = yield self.sessions.acquire_async(dev)
+                    if session is not None:
+                        transfer = yield self.push_file_async(filename, session)
+                        if transfer is not None:
+                            status = yield transfer.future
+                        else:
+                            status = 'error'
+                finally:
+                    os.unlink(filename)
+                    self.sessions.release(dev)
+                if session is None or status != 'error':
+                    sent = session is not None
+                    results = [MessageResult(num, sent, 1, time.monotonic() - start, status)
+                               for num in nums]
+                    if result_cb is not None:
+                        for result in results:
+                            result_cb(result)
+                    return results
+            # Multiple recipients may not be supported, send individually
+            report = yield self.send_bulk_async(dev, [(num, t) for num in nums],
+                                                result_cb=result_cb)
+            if grouped and any(r.sent for r in report.results):
+                self.group_unsupported[dev] = time.monotonic()
+            return report.results
+        return run_task(op())
+
+    def group_supported(self, dev):
+        """ Whether messages with several recipients may be pushed to dev,
+        False during GROUP_RETRY_AFTER after dev refused one
+        """
+        refused = self.group_unsupported.get(dev, None)
+        if refused is None:
+            return True
+        if time.monotonic() - refused < GROUP_RETRY_AFTER:
+            return False
+        del self.group_unsupported[dev]
+        return True
+
+    def send_template_async(self, dev, template, rows, result_cb=None, **kwargs):
+        """ Send a personalised message to each recipient
+
+        Parameters
+        ----------
+        dev: str
+        The device address to use
+
+        template: template.MessageTemplate
+        The compiled message
+
+        rows: iterable of (str, dict) tuples
+        The number and field values of each recipient
+
+        result_cb: callable(MessageResult) or None (default None)
+        Called after each message outcome
+
+        kwargs:
+        Passed to bulk.BulkSender: queue_size, max_attempts, backoff
+
+        Returns
+        -------
+        Future
+        Resolved with the bulk.BulkReport
+        """
+        return BulkSender(self, dev, render=template.render, **kwargs).send_async(rows, result_cb)
+
+    def send_bulk_async(self, dev, jobs, port=None, result_cb=None, **kwargs):
+        """ Send many messages through one session
+
+        Parameters
+        ----------
+        dev: str
+        The device address to use
+
+        jobs: iterable of (str, str) tuples
+        The (number, text) of the messages
+
+        port: int or None (default None)
+        The RFCOMM port to use, if None the device is scanned
+
+        result_cb: callable(MessageResult) or None (default None)
+        Called after each message outcome
+
+        kwargs:
+        Passed to bulk.BulkSender: queue_size, max_attempts, backoff
+
+        Returns
+        -------
+        Future
+        Resolved with the bulk.BulkReport
+        """
+        return BulkSender(self, dev, port, **kwargs).send_async(jobs, result_cb)
+
+    def deliver_async(self, dev, num, t, follow=False, status_cb=None):
+        """ Send a message and follow it until it is transferred
+
+        The message is pushed on the pooled session of dev, retried once
+        on a new session if refused, and its transfer followed through
+        signals. With follow, a status reported later by the phone is
+        passed to status_cb, see delivery.DeliveryTracker.
+
+        Parameters
+        ----------
+        dev: str
+        The device address to use
+
+        num: str
+        The destination phone number
+
+        t: str
+        The text of the message
+
+        follow: bool (default False)
+        Listen for the phone reporting the message sent, once transferred
+
+        status_cb: callable(Delivery, str) or None (default None)
+        Called on each status change
+
+        Returns
+        -------
+        delivery.Delivery
+        The handle, its future is resolved with a bulk.MessageResult
+        """
+        delivery = Delivery(num, status_cb)
+        filename = self.write_message(self.prepare_message(num, t))
+        def op():
+            transfer = None
+            try:
+                while transfer is None and delivery.attempts < 2:
+                    delivery.set_status('connecting')
+                    session = yield self.sessions.acquire_async(dev)
+                    if session is None:
+                        delivery.resolve(False, None)
+                        return
+                    delivery.attempts += 1
+                    delivery.set_status('pushing')
+                    transfer = yield self.push_file_async(filename, session)
+                    if transfer is None:
+                        # The session may be stale, start again with a new one
+                        yield self.sessions.invalidate_async(dev)
+                if transfer is None:
+                    delivery.resolve(False, 'error')
+                    return
+                delivery.set_status(transfer.status)
+                status = yield transfer.future
+                delivery.set_status(status)
+                if status == 'error':
+                    delivery.resolve(False, status)
+                    return
+                delivery.resolve(True, status)
+                if follow:
+                    self.deliveries.follow(delivery, session[0])
+            finally:
+                os.unlink(filename)
+                self.sessions.release(dev)
+
+        def done(future):
+            if future.exception() is not None:
+                print('Unable to send message to {}: {}'.format(num, future.exception()))
+                delivery.resolve(False, None)
+        run_task(op()).add_done_callback(done)
+        return delivery
+
+    def prewarm_session(self, dev):
+        """ Open the MAP session on dev in the background, so that the next
+        send_message_async() only pushes the message. Nothing is done when
+        the port is not in self.ports, to avoid a device scan.
+
+        Parameters
+        ----------
+        dev: str
+        The device address to use
+        """
+        if self.ports.get(dev, MAP_SERVICE) is not None:
+            self.sessions.prewarm(dev)
+
+    def send_message_async(self, dev, port, filename):
+        """ Push the message using the pooled session of dev
+
+        The session is kept open in self.sessions for the next messages.
+        When the push fails, the session is reopened and the push retried
+        once.
+
+        Parameters
+        ----------
+        dev: str
+        The device address to use
+
+        port: int or None
+        The RFCOMM port to use, if None the port is taken from self.ports
+
+        filename: str
+        The file containing the message in bMessage format
+
+        Returns
+        -------
+        Future
+        Resolved with a tuple (port, sent). port is None when no session
+        could be created, sent is True if the message was queued
+        """
+        if port is not None:
+            self.ports.set(dev, MAP_SERVICE, port)
+        def op():
+            res = None
+            try:
+                for attempt in range(2):
+                    session = yield self.sessions.acquire_async(dev)
+                    if session is None:
+                        return None, False
+                    res = yield self.push_message_async(filename, session)
+                    if res:
+                        break
+                    # The session may be stale, start again with a new one
+                    yield self.sessions.invalidate_async(dev)
+            finally:
+                self.sessions.release(dev)
+            return self.ports.get(dev, MAP_SERVICE), res
+        return run_task(op())
+
     def remove_session(self):
         """ Remove session from DBus client
         """
@@ -341,12 +1311,33 @@ class BTPhone:
     def pullall_pb(self):
         """ Retrieve contacts from Phonebook
         """
-        args = GLib.Variant('(sa{sv})', ('', {},))
+        args = GLib.Variant('(sa{sv})', ('', self.pull_filters()))
         res = self.bus_call_sync('org.bluez.obex.PhonebookAccess1',
                                  'PullAll',
                                  args=args)
         return res
 
+    def get_size_pb(self):
+        """ Return the number of entries in the selected phonebook
+        """
+        res = self.bus_call_sync('org.bluez.obex.PhonebookAccess1',
+                                 'GetSize')
+        return res
+
+    def pull_pb(self, vcard):
+        """ Retrieve one contact from Phonebook
+
+        Parameters
+        ----------
+        vcard: str
+        The vcard handle as returned by list_pb()
+        """
+        args = GLib.Variant('(ssa{sv})', (vcard, '', self.pull_filters()))
+        res = self.bus_call_sync('org.bluez.obex.PhonebookAccess1',
+                                 'Pull',
+                                 args=args)
+        return res
+
     def list_pb(self):
         """ List Phonebook directories
         """
@@ -420,9 +1411,9 @@ class BTPhone:
         Returns
         -------
         res: tuple or None
-        The result from method call. None if GLib.Error or TypeError were raised
+        The result from method call. None if GLib.Error or TypeError were
+        raised, the error message being recorded in self.metrics
         """
-        print('bus_call_sync', iface, method)
         if name is None:
             name = self.bus_name
         if path is None:
@@ -432,6 +1423,8 @@ class BTPhone:
                 path = self.path[0]
         if bus is None:
             bus = self.bus
+        start = time.monotonic()
+        error = None
         try:
             res = bus.call_sync(name,
                                      path,
@@ -444,13 +1437,81 @@ class BTPhone:
                                      None, # Cancellable
                                      )
         except GLib.Error as e:
-            print(e.message)
+            error = e.message
             res = None
         except TypeError as e:
-            print(e.message)
+            error = str(e)
             res = None
-        finally:
-            return res
+        # The error is kept in the statistics, see stats()
+        self.metrics.record_call(iface, method, time.monotonic() - start, error)
+        return res
+
+    def bus_call(self, iface, method, args=None, timeout=240000,
+                 flags=Gio.DBusCallFlags.NONE,
+                 name=None,
+                 path=None,
+                 reply=None,
+                 bus=None,
+                 ):
+        """ Make an asynchronous call to DBus object with call(), same
+        arguments as bus_call_sync()
+
+        Returns
+        -------
+        Future
+        Resolved with the result from method call, None if GLib.Error or
+        TypeError were raised
+        """
+        future = Future()
+        if name is None:
+            name = self.bus_name
+        if path is None:
+            if self.path is None:
+                future.set_result(None)
+                return future
+            else:
+                path = self.path[0]
+        if bus is None:
+            bus = self.bus
+        start = time.monotonic()
+
+        def on_done(bus, result, future):
+            error = None
+            try:
+                res = bus.call_finish(result)
+            except GLib.Error as e:
+                error = e.message
+                res = None
+            self.metrics.record_call(iface, method, time.monotonic() - start, error)
+            future.set_result(res)
+        try:
+            bus.call(name,
+                     path,
+                     iface,
+                     method,
+                     args,
+                     reply, # Reply type
+                     flags,
+                     timeout,
+                     None, # Cancellable
+                     on_done,
+                     future,
+                     )
+        except TypeError as e:
+            self.metrics.record_call(iface, method, 0.0, str(e))
+            future.set_result(None)
+        return future
+
+    def stats(self):
+        """ Return the statistics of the D-Bus calls, SDP browses and
+        transfers, see metrics.Metrics.stats()
+
+        Returns
+        -------
+        dict
+        The statistics
+        """
+        return self.metrics.stats()
 
     def prepare_message(self, num, t):
         """ Prepare a message as bMessage format
@@ -470,10 +1531,49 @@ class BTPhone:
         m: str
         The message in bMessage format
         """
-        my_msg = msg_header + t.replace('\n', '\r\n') + msg_footer
-        my_msg_l = msg_length.format(len(my_msg)) + my_msg
-        m = header + vcard2.format(num) + my_msg_l + footer
-        return m
+        return template.prepare_message(num, t)
+
+    def prepare_group_message(self, nums, t):
+        """ Prepare a message to several recipients as bMessage format
+
+        The envelope holds one recipient vCard per number.
+
+        Parameters
+        ----------
+        nums: list of str
+        The destination phone numbers
+
+        t: str
+        The text of the message to prepare
+
+        Returns
+        -------
+        m: str
+        The message in bMessage format
+        """
+        return template.prepare_group_message(nums, t)
+
+    def write_message(self, m):
+        """ Write the message to a temporary file readable by obexd
+
+        Parameters
+        ----------
+        m: str or bytes
+        The message in bMessage format, bytes are written as is, str is
+        encoded in UTF-8
+
+        Returns
+        -------
+        str
+        The file name
+        """
+        if isinstance(m, str):
+            m = m.encode('utf-8')
+        fp = tempfile.NamedTemporaryFile(mode='w+b', delete=False, prefix='textoter-', dir='/tmp')
+        os.chmod(fp.name, stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO)
+        fp.write(m)
+        fp.close()
+        return fp.name
 
     def set_iface_added_callback(self, callback):
         """ Set the callback to use when an interface is added
@@ -498,7 +1598,7 @@ class BTPhone:
         self.iface_removed_cb = callback
 
     def interfaces_added(self, bus, name, path, iface, signal_name, args, user_args):
-        """ When a device is added, update self.paths2dev, call the callback
+        """ When a device is added, update self.devices
 
         Parameters
         ----------
@@ -523,16 +1623,72 @@ class BTPhone:
         user_args: 
         Not used
         """
-        opath, dev = args
-        mydev = dev.get('org.bluez.Device1', None)
-        if mydev is not None:
-            if self.iface_added_cb is not None:
-                self.iface_added_cb(mydev.get('Address', None),
-                                    mydev.get('Name', None))
-            self.paths2dev[str(opath)] = mydev.get('Address', None)
+        opath, ifaces = args
+        self.devices.interfaces_added(str(opath), ifaces)
+
+    def device_added(self, device):
+        """ Registry callback, call the callback and probe the device
+        """
+        if self.iface_added_cb is not None:
+            self.iface_added_cb(device.address, device.name)
+        if self.probing:
+            self.prober.probe(device.address)
+
+    def device_removed(self, device):
+        """ Registry callback, call the callback
+        """
+        if self.iface_removed_cb is not None:
+            self.iface_removed_cb(device.address)
+
+    def device_changed(self, device, changed):
+        """ Registry callback, report name changes as an update
+        """
+        if 'name' in changed and self.iface_added_cb is not None:
+            self.iface_added_cb(device.address, device.name)
+
+    def device_properties_changed(self, bus, name, path, iface, signal_name, args, user_args):
+        """ Apply the Device1 property changes to self.devices
+        """
+        self.devices.properties_changed(path, args[0], args[1])
+
+    def best_device(self, preferred=None):
+        """ Return the address of the device to use by default, see
+        devices.DeviceRegistry.best()
+
+        Parameters
+        ----------
+        preferred: str or None (default None)
+        The address of the device used last
+
+        Returns
+        -------
+        str or None
+        The device address, None if no device is known
+        """
+        device = self.devices.best(preferred)
+        return device.address if device is not None else None
+
+    def probe_devices(self, callback=None):
+        """ Discover the ports of all the known devices in the background
+
+        The devices from get_devices() and the devices added later are
+        browsed in a bounded thread pool, see probe.DeviceProber. The port
+        cache is filled for MAP and PBAP before the first operation.
+
+        Parameters
+        ----------
+        callback: callable(str, dict) or None (default None)
+        Called from the main loop with the device address and the ports
+        found, after each device
+        """
+        self.probing = True
+        self.prober.set_done_callback(callback)
+        for device in self.devices:
+            self.prober.probe(device.address)
 
     def interfaces_removed(self, bus, name, path, iface, signal_name, args, user_args):
-        """ When a device is removed, update self.paths2dev, call the callback
+        """ When a device is removed, update self.devices, unknown devices
+        are ignored
 
         Parameters
         ----------
@@ -558,15 +1714,13 @@ class BTPhone:
         Not used
         """
         opath, ifaces = args[0], args[1]
-        if 'org.bluez.Device1' in ifaces:
-            if self.iface_removed_cb is not None:
-                self.iface_removed_cb(self.paths2dev.get(str(opath), None))
-            del self.paths2dev[str(opath)]
+        self.devices.interfaces_removed(str(opath), ifaces)
     
     def signal_subscribe(self, iface, signal_name, callback, args,
                        name=None,
                        path=None,
                        bus=None,
+                       flags=Gio.DBusSignalFlags.NONE,
                       ):
         """ Call signal_subscribe on bus
 
@@ -581,8 +1735,8 @@ class BTPhone:
         callback: callable
         The callback to use
 
-        args: GLib.Variant or None (default None)
-        The arguments to pass to called method
+        args: str or None
+        The first argument to match, None for any
 
         name: str or None (default None)
         The name of the bus to use, self.bus_name if None
@@ -593,6 +1747,9 @@ class BTPhone:
         bus: Gio.DBusConnection or None (default None)
         The bus to use, self.bus if None
 
+        flags: Gio.DBusSignalFlags (default Gio.DBusSignalFlags.NONE)
+        MATCH_ARG0_PATH to match args as a path prefix
+
         Returns
         -------
         int
@@ -608,8 +1765,8 @@ class BTPhone:
                                     iface,   # interface name
                                     signal_name,
                                     path,  # object path
-                                    None,  # arg0
-                                    Gio.DBusSignalFlags.NONE, # flags
+                                    args,  # arg0
+                                    flags,
                                     callback,  # callback
                                     None,  # user data
                                     )
@@ -0,0 +1,207 @@
+# bulk.py: Send many messages through one session
+# Copyright (C) 2018 - 2021 Arnaud Gardelein <arnaud@oscopy.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+from collections import deque, namedtuple
+import os
+import time
+from .gasync import run_task, sleep
+from .ports import MAP_SERVICE
+
+# Number of messages prepared in advance
+QUEUE_SIZE = 16
+MAX_ATTEMPTS = 3
+# First retry delay in ms, doubled on each attempt
+BACKOFF = 1000
+
+MessageResult = namedtuple('MessageResult',
+                           ['number', 'sent', 'attempts', 'latency', 'status'])
+MessageResult.__doc__ = """ The outcome of one message of a bulk send
+
+number: str
+The destination phone number
+
+sent: bool
+True if the message was transferred to the phone
+
+attempts: int
+The number of pushes made
+
+latency: float
+The time in s from the first push to the final outcome
+
+status: str or None
+The final transfer status, or None if no transfer could be made
+"""
+
+
+def percentile(values, p):
+    """ Return the p-th percentile of sorted values, nearest rank
+    """
+    if not values:
+        return None
+    k = max(0, min(len(values) - 1, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[k]
+
+
+class BulkReport:
+    """ Per-message outcome and aggregate statistics of a bulk send
+
+    Attributes
+    ----------
+    results: list of MessageResult
+    The outcome of each message, in job order
+
+    started, finished: float
+    time.monotonic() at start and end of the send
+    """
+    def __init__(self):
+        self.results = []
+        self.started = time.monotonic()
+        self.finished = None
+
+    @property
+    def sent(self):
+        return sum(1 for r in self.results if r.sent)
+
+    @property
+    def failed(self):
+        return len(self.results) - self.sent
+
+    @property
+    def elapsed(self):
+        end = self.finished if self.finished is not None else time.monotonic()
+        return end - self.started
+
+    def stats(self):
+        """ Return aggregate statistics
+
+        Returns
+        -------
+        dict
+        count, sent, failed, retries, elapsed (s), throughput (sent
+        messages per s) and latency min, mean, p50, p95, max (s)
+        """
+        latencies = sorted(r.latency for r in self.results)
+        elapsed = self.elapsed
+        return {'count': len(self.results),
+                'sent': self.sent,
+                'failed': self.failed,
+                'retries': sum(r.attempts - 1 for r in self.results if r.attempts),
+                'elapsed': elapsed,
+                'throughput': self.sent / elapsed if elapsed > 0 else 0.0,
+                'latency_min': latencies[0] if latencies else None,
+                'latency_mean': sum(latencies) / len(latencies) if latencies else None,
+                'latency_p50': percentile(latencies, 50),
+                'latency_p95': percentile(latencies, 95),
+                'latency_max': latencies[-1] if latencies else None,
+                }
+
+
+class BulkSender:
+    """ Send an iterable of (number, text) jobs through one MAP session
+
+    Jobs are consumed lazily, at most queue_size messages are prepared
+    ahead of the push. Each message is pushed and its transfer followed
+    to completion. Failed pushes are retried after a delay doubling from
+    backoff ms, the session being reopened in between.
+    """
+    def __init__(self, phone, devad, port=None,
+                 queue_size=QUEUE_SIZE,
+                 max_attempts=MAX_ATTEMPTS,
+                 backoff=BACKOFF,
+                 render=None):
+        self.phone = phone
+        # Build the message of a job, phone.prepare_message() by default
+        self.render = render if render is not None else phone.prepare_message
+        self.devad = devad
+        self.port = port
+        self.queue_size = queue_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+    def send_async(self, jobs, result_cb=None):
+        """ Send all the jobs
+
+        Parameters
+        ----------
+        jobs: iterable of (str, object) tuples
+        The number and the content of the messages, the text by default,
+        the field values when a template is used
+
+        result_cb: callable(MessageResult) or None (default None)
+        Called after each message outcome
+
+        Returns
+        -------
+        Future
+        Resolved with the BulkReport
+        """
+        if self.port is not None:
+            self.phone.ports.set(self.devad, MAP_SERVICE, self.port)
+        def op():
+            report = BulkReport()
+            queue = deque()
+            jobs_it = iter(jobs)
+            try:
+                while True:
+                    # Prepare the next messages
+                    for num, t in jobs_it:
+                        m = self.render(num, t)
+                        queue.append((num, self.phone.write_message(m)))
+                        if len(queue) >= self.queue_size:
+                            break
+                    if not queue:
+                        break
+                    num, filename = queue.popleft()
+                    try:
+                        result = yield from self.send_one(num, filename)
+                    finally:
+                        os.unlink(filename)
+                    report.results.append(result)
+                    if result_cb is not None:
+                        result_cb(result)
+            finally:
+                # The messages prepared ahead when a send raised
+                while queue:
+                    num, filename = queue.popleft()
+                    os.unlink(filename)
+                self.phone.sessions.release(self.devad)
+            report.finished = time.monotonic()
+            return report
+        return run_task(op())
+
+    def send_one(self, num, filename):
+        """ Generator pushing one message with retries, returns its
+        MessageResult
+        """
+        start = time.monotonic()
+        status = None
+        attempt = 0
+        while attempt < self.max_attempts:
+            if attempt:
+                yield sleep(self.backoff * 2 ** (attempt - 1))
+            attempt += 1
+            session = yield self.phone.sessions.acquire_async(self.devad)
+            if session is None:
+                continue
+            transfer = yield self.phone.push_file_async(filename, session)
+            if transfer is not None:
+                status = yield transfer.future
+                # None means the transfer vanished without reporting an
+                # error, do not push it again to avoid duplicates
+                if status != 'error':
+                    return MessageResult(num, True, attempt,
+                                         time.monotonic() - start, status)
+            yield self.phone.sessions.invalidate_async(self.devad)
+        return MessageResult(num, False, attempt, time.monotonic() - start, status)
@@ -0,0 +1,186 @@
+# contacts.py: Index of the contacts for recipient resolution
+# Copyright (C) 2018 - 2021 Arnaud Gardelein <arnaud@oscopy.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+from collections import namedtuple
+from .numbers import canonical
+
+Entry = namedtuple('Entry', ['name', 'number', 'kind', 'display', 'canonical'])
+Entry.__doc__ = """ One phone number of a contact, as shown in the address book,
+and the number in canonical form, see numbers.canonical()
+"""
+
+# Key of the entries list in trie nodes, cannot collide with a character
+ENTRIES = None
+
+
+def display(name, number):
+    """ Return the text shown for a contact number
+    """
+    return '{} ({})'.format(name, number)
+
+
+class ContactIndex:
+    """ Hash maps and name prefix trie over the address book entries
+
+    Attributes
+    ----------
+    entries: list of Entry
+    The entries in insertion order
+
+    by_display: dict of str:Entry
+    Entries by displayed text
+
+    by_number: dict of str:list of Entry
+    Entries by canonical number, see numbers.canonical()
+
+    by_name: dict of str:list of Entry
+    Entries by lower case name
+
+    trie: dict
+    Prefix tree of lower case names, each node maps a character to the
+    next node, and ENTRIES to the entries whose name ends there
+    """
+    def __init__(self, region=None):
+        self.region = region
+        self.clear()
+
+    def clear(self):
+        """ Remove all the entries
+        """
+        self.entries = []
+        self.keys = set()
+        self.by_display = {}
+        self.by_number = {}
+        self.by_name = {}
+        self.trie = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, i):
+        return self.entries[i]
+
+    def add(self, name, number, kind=''):
+        """ Add a contact number to the index, unless the contact already
+        has this number, possibly written differently
+
+        The number is put in canonical form once, here.
+
+        Parameters
+        ----------
+        name: str
+        The contact name
+
+        number: str
+        The phone number
+
+        kind: str (default '')
+        The number type
+
+        Returns
+        -------
+        Entry or None
+        The entry added, None if it is a duplicate
+        """
+        normalized = canonical(number, self.region)
+        if (name, normalized) in self.keys:
+            return None
+        self.keys.add((name, normalized))
+        entry = Entry(name, number, kind, display(name, number), normalized)
+        self.entries.append(entry)
+        self.by_display[entry.display] = entry
+        self.by_number.setdefault(normalized, []).append(entry)
+        key = name.lower()
+        self.by_name.setdefault(key, []).append(entry)
+        node = self.trie
+        for c in key:
+            node = node.setdefault(c, {})
+        node.setdefault(ENTRIES, []).append(entry)
+        return entry
+
+    def lookup(self, text):
+        """ Resolve the text typed as recipient
+
+        Tried in order: the displayed text, the number, the name.
+
+        Parameters
+        ----------
+        text: str
+        The text typed
+
+        Returns
+        -------
+        Entry or None
+        The first matching entry, None if not found
+        """
+        entry = self.by_display.get(text, None)
+        if entry is not None:
+            return entry
+        entry = self.who(text)
+        if entry is not None:
+            return entry
+        entries = self.by_name.get(text.strip().lower(), None)
+        if entries:
+            return entries[0]
+        return None
+
+    def who(self, number):
+        """ Return the first entry with number, however it is written
+
+        Parameters
+        ----------
+        number: str
+        The phone number
+
+        Returns
+        -------
+        Entry or None
+        The entry, None if the number is unknown
+        """
+        entries = self.by_number.get(canonical(number, self.region), None)
+        return entries[0] if entries else None
+
+    def complete(self, prefix, limit=None):
+        """ Return the entries whose name starts with prefix
+
+        Reaching the prefix node costs O(len(prefix)), the entries below
+        it are then walked until limit is reached.
+
+        Parameters
+        ----------
+        prefix: str
+        The beginning of the name, case insensitive
+
+        limit: int or None (default None)
+        The maximum number of entries to return
+
+        Returns
+        -------
+        list of Entry
+        The matching entries
+        """
+        node = self.trie
+        for c in prefix.lower():
+            node = node.get(c, None)
+            if node is None:
+                return []
+        res = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            res.extend(node.get(ENTRIES, []))
+            if limit is not None and len(res) >= limit:
+                return res[:limit]
+            stack.extend(v for k, v in node.items() if k is not ENTRIES)
+        return res
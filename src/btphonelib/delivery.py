@@ -0,0 +1,185 @@
+# delivery.py: Follow a pushed message until it is sent
+# Copyright (C) 2018 - 2021 Arnaud Gardelein <arnaud@oscopy.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+""" Delivery handles returned by BTPhone.deliver_async()
+
+A message is first pushed to the phone, the OBEX transfer being followed
+by transfer.TransferTracker. Once transferred, the phone sends the SMS on
+its own and the delivery is resolved. obexd does not expose Message1
+objects for pushed messages, but when some status is reported anyway
+(MAP notifications), DeliveryTracker passes it on as extra information.
+"""
+
+from gi.repository import GLib
+from gi.repository import Gio
+from concurrent.futures import Future
+import time
+from .bulk import MessageResult
+from .numbers import canonical
+
+MESSAGE_IFACE = 'org.bluez.obex.Message1'
+SENT_STATUS = ('sending-success', 'delivery-success')
+FAILED_STATUS = ('sending-failure', 'delivery-failure')
+# Time to wait for the phone to report the message status, in seconds
+FOLLOW_TIMEOUT = 60
+
+
+class Delivery:
+    """ The state of one message being sent
+
+    Attributes
+    ----------
+    number: str
+    The destination phone number
+
+    status: str or None
+    The last known status: connecting, pushing, the transfer status
+    (queued, active, complete, error), then the message status
+    (sending-success, sending-failure...) if the phone reports it
+
+    attempts: int
+    The number of pushes made
+
+    future: Future
+    Resolved with the bulk.MessageResult once transferred. Its status is
+    None when the phone could not be reached
+    """
+    def __init__(self, number, status_cb=None):
+        self.number = number
+        self.status = None
+        self.status_cb = status_cb
+        self.attempts = 0
+        self.started = time.monotonic()
+        self.future = Future()
+
+    def set_status(self, status):
+        """ Update the status, call the status callback
+        """
+        self.status = status
+        if self.status_cb is not None:
+            self.status_cb(self, status)
+
+    def resolve(self, sent, status):
+        """ Resolve the future, once
+        """
+        if self.future.done():
+            return
+        self.future.set_result(MessageResult(self.number, sent, self.attempts,
+                                             time.monotonic() - self.started, status))
+
+    def done(self):
+        return self.future.done()
+
+    def add_done_callback(self, callback):
+        """ Call callback with the MessageResult when the outcome is known
+        """
+        self.future.add_done_callback(lambda f: callback(f.result()))
+
+
+class DeliveryTracker:
+    """ Follow the status of the pushed messages with a single
+    PropertiesChanged subscription on Message1
+
+    Deliveries are matched with the messages of their session by
+    recipient number, those that cannot be matched are left pending. The
+    deliveries are already resolved, the status only updates them, and
+    they are forgotten after the timeout.
+    """
+    def __init__(self, phone):
+        self.phone = phone
+        # Deliveries waiting for a message status, by session path
+        self.pending = {}
+        # Timeout source of each pending delivery
+        self.sources = {}
+        self.sub_id = phone.bus.signal_subscribe(phone.bus_name,  # sender
+                                                 'org.freedesktop.DBus.Properties',
+                                                 'PropertiesChanged',
+                                                 None,  # any object path
+                                                 MESSAGE_IFACE,  # arg0
+                                                 Gio.DBusSignalFlags.NONE,
+                                                 self.properties_changed,
+                                                 None,  # user data
+                                                 )
+
+    def follow(self, delivery, session, timeout=FOLLOW_TIMEOUT):
+        """ Report the status of the message of delivery, if any
+
+        Parameters
+        ----------
+        delivery: Delivery
+        The delivery, its message transferred
+
+        session: str
+        The path of the session the message was pushed on
+
+        timeout: int (default FOLLOW_TIMEOUT)
+        Time to wait for the status, in seconds
+        """
+        pending = self.pending.setdefault(session, [])
+        pending.append(delivery)
+        self.sources[delivery] = GLib.timeout_add_seconds(timeout, self.expired,
+                                                          delivery, session)
+
+    def forget(self, delivery, session):
+        """ Stop following delivery
+        """
+        source = self.sources.pop(delivery, None)
+        if source is not None:
+            GLib.source_remove(source)
+        pending = self.pending.get(session, [])
+        if delivery in pending:
+            pending.remove(delivery)
+        if not pending:
+            self.pending.pop(session, None)
+
+    def expired(self, delivery, session):
+        """ GLib timeout callback, the phone did not report the status
+        """
+        self.sources.pop(delivery, None)
+        self.forget(delivery, session)
+        return False
+
+    def properties_changed(self, bus, name, path, iface, signal_name, args, user_args):
+        """ Read the recipient of messages reaching a final status
+        """
+        status = args[1].get('Status', None)
+        if status not in SENT_STATUS and status not in FAILED_STATUS:
+            return
+        session = path.rsplit('/', 1)[0]
+        if not self.pending.get(session, None):
+            return
+        future = self.phone.bus_call('org.freedesktop.DBus.Properties',
+                                     'Get',
+                                     args=GLib.Variant('(ss)', (MESSAGE_IFACE, 'RecipientAddress')),
+                                     path=path)
+        future.add_done_callback(lambda f: self.message_status(session, status, f))
+
+    def message_status(self, session, status, future):
+        """ Update the first delivery of session sent to the recipient
+        """
+        res = future.result()
+        if res is None:
+            # Cannot tell which message it is
+            return
+        recipient = canonical(str(res[0]))
+        for delivery in list(self.pending.get(session, ())):
+            if canonical(delivery.number) == recipient:
+                self.forget(delivery, session)
+                delivery.set_status(status)
+                break
+
+    def close(self):
+        """ Unsubscribe from the signal
+        """
+        self.phone.bus.signal_unsubscribe(self.sub_id)
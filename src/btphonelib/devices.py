@@ -0,0 +1,205 @@
+# devices.py: The Bluetooth devices known by bluetoothd
+# Copyright (C) 2018 - 2021 Arnaud Gardelein <arnaud@oscopy.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+""" Registry of the Bluetooth devices
+
+The registry is filled once from GetManagedObjects, then kept up to date
+with the InterfacesAdded, InterfacesRemoved and PropertiesChanged signals
+of bluetoothd. BTPhone does the D-Bus part and passes the unpacked
+arguments, so this module does not depend on Gio.
+"""
+
+DEVICE_IFACE = 'org.bluez.Device1'
+
+
+class Device:
+    """ One org.bluez.Device1 object
+
+    Attributes
+    ----------
+    path: str
+    The DBus object path
+
+    address: str or None
+    The device address
+
+    name: str or None
+    The device name, its alias if it has no name
+
+    connected, paired: bool
+    The connection and pairing state
+    """
+    def __init__(self, path, props):
+        self.path = path
+        self.address = props.get('Address', None)
+        self.name = None
+        self.connected = False
+        self.paired = False
+        self.update(props)
+
+    def update(self, props):
+        """ Apply Device1 properties
+
+        Parameters
+        ----------
+        props: dict
+        The changed properties
+
+        Returns
+        -------
+        set of str
+        The attributes that changed
+        """
+        changed = set()
+        name = props.get('Name', props.get('Alias', None))
+        if name is not None and name != self.name:
+            self.name = name
+            changed.add('name')
+        for attr, prop in (('connected', 'Connected'), ('paired', 'Paired')):
+            if prop in props and bool(props[prop]) != getattr(self, attr):
+                setattr(self, attr, bool(props[prop]))
+                changed.add(attr)
+        return changed
+
+    def rank(self, preferred=None):
+        """ Sort key, the best device to use is the largest
+        """
+        return (self.connected, self.address == preferred, self.paired)
+
+
+class DeviceRegistry:
+    """ The devices indexed by object path and by address
+
+    Callbacks are called with the Device on addition and removal, and
+    with the Device and the set of changed attributes on changes.
+    """
+    def __init__(self):
+        self.by_path = {}
+        self.by_address = {}
+        self.added_cb = None
+        self.removed_cb = None
+        self.changed_cb = None
+
+    def __len__(self):
+        return len(self.by_path)
+
+    def __iter__(self):
+        return iter(list(self.by_path.values()))
+
+    def __contains__(self, address):
+        return address in self.by_address
+
+    def get(self, address):
+        """ Return the Device with address, None if unknown
+        """
+        return self.by_address.get(address, None)
+
+    def names(self):
+        """ Return a dict associating the addresses with the names
+        """
+        return {address: device.name for address, device in self.by_address.items()}
+
+    def load(self, objects):
+        """ Add the devices of a GetManagedObjects result
+
+        Parameters
+        ----------
+        objects: dict of str:dict
+        The interfaces and their properties of each object path
+        """
+        for path, ifaces in objects.items():
+            self.interfaces_added(path, ifaces)
+
+    def interfaces_added(self, path, ifaces):
+        """ Add or update the device on path
+
+        Parameters
+        ----------
+        path: str
+        The object path
+
+        ifaces: dict of str:dict
+        The properties of each interface added
+
+        Returns
+        -------
+        Device or None
+        The device, None if path is not a device
+        """
+        props = ifaces.get(DEVICE_IFACE, None)
+        if props is None:
+            return None
+        path = str(path)
+        device = self.by_path.get(path, None)
+        if device is None:
+            device = Device(path, props)
+            self.by_path[path] = device
+        else:
+            device.update(props)
+        if device.address is not None:
+            self.by_address[device.address] = device
+        if self.added_cb is not None:
+            self.added_cb(device)
+        return device
+
+    def interfaces_removed(self, path, ifaces):
+        """ Remove the device on path, unknown paths are ignored
+
+        Returns
+        -------
+        Device or None
+        The device removed
+        """
+        if DEVICE_IFACE not in ifaces:
+            return None
+        device = self.by_path.pop(str(path), None)
+        if device is None:
+            return None
+        if self.by_address.get(device.address, None) is device:
+            del self.by_address[device.address]
+        if self.removed_cb is not None:
+            self.removed_cb(device)
+        return device
+
+    def properties_changed(self, path, iface, props):
+        """ Apply a PropertiesChanged signal of the device on path
+        """
+        if iface != DEVICE_IFACE:
+            return
+        device = self.by_path.get(str(path), None)
+        if device is None:
+            return
+        changed = device.update(props)
+        if changed and self.changed_cb is not None:
+            self.changed_cb(device, changed)
+
+    def best(self, preferred=None):
+        """ Return the device to use by default
+
+        Connected devices come first, then preferred, then the paired
+        ones.
+
+        Parameters
+        ----------
+        preferred: str or None (default None)
+        The address of the device used last
+
+        Returns
+        -------
+        Device or None
+        The best device, None if there is none
+        """
+        if not self.by_path:
+            return None
+        return max(self.by_path.values(), key=lambda d: d.rank(preferred))
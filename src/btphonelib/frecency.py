@@ -0,0 +1,108 @@
+# frecency.py: Usual recipients from the phone call history
+# Copyright (C) 2018 - 2021 Arnaud Gardelein <arnaud@oscopy.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+""" Frecency of the phone numbers
+
+Each call of the PBAP call history (X-IRMC-CALL-DATETIME of the ich, och,
+mch and cch folders) adds to the score of its number a weight depending
+on the call direction, halved every HALF_LIFE. Numbers often and recently
+called come first in the recipient suggestions. The call history is read
+with the phonebook, so the scores cost no Bluetooth round trip.
+"""
+
+import calendar
+import time
+from .numbers import canonical
+
+# Weight of a call by direction, as in the X-IRMC-CALL-DATETIME parameter
+WEIGHTS = {'dialed': 1.0, 'received': 0.7, 'missed': 0.3}
+# Calls without direction, from the combined history of some phones
+DEFAULT_WEIGHT = 0.5
+# Age of a call halving its weight, in seconds
+HALF_LIFE = 14 * 86400
+
+
+def call_time(stamp):
+    """ Return the time of a call as seconds since the epoch
+
+    Parameters
+    ----------
+    stamp: str
+    The value of X-IRMC-CALL-DATETIME, 20210320T100000 in local time
+    or 20210320T090000Z in UTC
+
+    Returns
+    -------
+    float or None
+    The time, None if stamp cannot be parsed
+    """
+    stamp = stamp.strip()
+    utc = stamp.endswith('Z')
+    try:
+        t = time.strptime(stamp.rstrip('Z'), '%Y%m%dT%H%M%S')
+    except ValueError:
+        return None
+    return float(calendar.timegm(t) if utc else time.mktime(t))
+
+
+class Frecency:
+    """ The frecency score of each canonical number
+
+    Attributes
+    ----------
+    scores: dict of str:float
+    The score of each canonical number
+    """
+    def __init__(self, now=None):
+        self.now = now if now is not None else time.time()
+        self.scores = {}
+
+    def add(self, number, kind, stamp):
+        """ Add one call to the score of number
+
+        Parameters
+        ----------
+        number: str
+        The phone number
+
+        kind: str
+        The call direction: dialed, received, missed, or ''
+
+        stamp: str
+        The value of X-IRMC-CALL-DATETIME
+        """
+        when = call_time(stamp)
+        if when is None:
+            return
+        age = max(0.0, self.now - when)
+        weight = WEIGHTS.get(kind, DEFAULT_WEIGHT) * 0.5 ** (age / HALF_LIFE)
+        key = canonical(number)
+        self.scores[key] = self.scores.get(key, 0.0) + weight
+
+    def add_contacts(self, contacts):
+        """ Add the calls of contacts, each call counted for the number
+        called, see vcard.Contact
+        """
+        for contact in contacts:
+            for kind, stamp, number in contact.calls:
+                if number:
+                    self.add(number, kind, stamp)
+
+    def get(self, number, default=0.0):
+        """ Return the score of number
+        """
+        return self.scores.get(canonical(number), default)
+
+    def __len__(self):
+        return len(self.scores)
@@ -0,0 +1,156 @@
+# gasync.py: Run asynchronous operations on the GLib main loop
+# Copyright (C) 2018 - 2021 Arnaud Gardelein <arnaud@oscopy.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+""" Small helpers to chain Gio asynchronous calls
+
+Asynchronous operations return concurrent.futures.Future objects. They are
+resolved from the GLib main loop, so a GLib main loop (Gtk.Application,
+GLib.MainLoop or an asyncio loop using PyGObject's GLib event loop policy)
+must be running.
+
+From asyncio, wrap the future with asyncio.wrap_future() or use
+as_asyncio().
+"""
+
+from concurrent.futures import Future
+from gi.repository import GLib
+
+
+def resolved(value):
+    """ Return a future already resolved with value
+
+    Parameters
+    ----------
+    value: object
+    The result of the future
+
+    Returns
+    -------
+    Future
+    The resolved future
+    """
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+def sleep(interval):
+    """ Return a future resolved after interval ms on the main loop
+
+    Parameters
+    ----------
+    interval: int
+    The delay in ms
+
+    Returns
+    -------
+    Future
+    Resolved with None
+    """
+    future = Future()
+    def on_timeout():
+        future.set_result(None)
+        return False
+    GLib.timeout_add(interval, on_timeout)
+    return future
+
+
+def as_asyncio(future, loop=None):
+    """ Wrap future to be awaited from asyncio
+
+    Parameters
+    ----------
+    future: concurrent.futures.Future
+    The future returned by an asynchronous operation
+
+    loop: asyncio.AbstractEventLoop or None (default None)
+    The loop to use, the running loop if None
+
+    Returns
+    -------
+    asyncio.Future
+    An awaitable future
+    """
+    # Not needed by the GLib applications
+    import asyncio
+    return asyncio.wrap_future(future, loop=loop)
+
+
+class Task:
+    """ Drive a generator yielding futures on the GLib main loop
+
+    Each future yielded by the generator is waited for, and its result is
+    sent back into the generator, or its exception thrown in it. The value
+    returned by the generator resolves self.future.
+
+    This allows to write a sequence of asynchronous DBus calls as a
+    plain function:
+
+        def op(self):
+            path = yield self.create_session_async(dev, port)
+            res = yield self.push_message_async(fn, path)
+            return res
+
+    Generators are always resumed from the GLib main loop.
+    """
+    def __init__(self, gen):
+        self.gen = gen
+        self.future = Future()
+        GLib.idle_add(self.step, None, None)
+
+    def step(self, value, exc):
+        """ Resume the generator with value or exc
+
+        Returns
+        -------
+        bool
+        False, so that it can be used as a GLib idle callback
+        """
+        try:
+            if exc is not None:
+                yielded = self.gen.throw(exc)
+            else:
+                yielded = self.gen.send(value)
+        except StopIteration as e:
+            self.future.set_result(e.value)
+            return False
+        except Exception as e:
+            self.future.set_exception(e)
+            return False
+        yielded.add_done_callback(self.wakeup)
+        return False
+
+    def wakeup(self, future):
+        """ Called when the yielded future is done, possibly from another
+        thread, schedule the generator resume on the main loop
+        """
+        exc = future.exception()
+        value = None if exc is not None else future.result()
+        GLib.idle_add(self.step, value, exc)
+
+
+def run_task(gen):
+    """ Start a Task on gen and return its future
+
+    Parameters
+    ----------
+    gen: generator
+    The generator yielding futures
+
+    Returns
+    -------
+    Future
+    Resolved by the value returned by gen
+    """
+    return Task(gen).future
@@ -0,0 +1,317 @@
+# messages.py: Local store of the messages read from the phone
+# Copyright (C) 2018 - 2021 Arnaud Gardelein <arnaud@oscopy.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+""" Messages synchronized with BTPhone.sync_messages_async()
+
+The messages of the MAP inbox and sent folders are kept in a SQLite
+database, keyed by device and message handle, so that each message is
+transferred once. An FTS5 index on the text allows searching the
+conversations, when SQLite is built without FTS5 a LIKE query is used
+instead.
+"""
+
+from collections import namedtuple
+import sqlite3
+from .numbers import canonical
+
+Message = namedtuple('Message', ['handle', 'folder', 'peer', 'name', 'incoming',
+                                 'timestamp', 'read', 'body'])
+Message.__doc__ = """ One SMS of a conversation
+
+handle: str
+The MAP message handle
+
+folder: str
+The MAP folder, 'inbox' or 'sent'
+
+peer: str
+The canonical number of the other party
+
+name: str
+The name of the other party, as known by the phone, may be ''
+
+incoming: bool
+Whether the message was received
+
+timestamp: str
+The MAP timestamp, 20210320T100000, sorts in time order
+
+read: bool
+Whether the message was read on the phone
+
+body: str
+The text
+"""
+
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    devad TEXT NOT NULL,
+    handle TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    peer TEXT NOT NULL,
+    name TEXT NOT NULL,
+    incoming INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    read INTEGER NOT NULL,
+    body TEXT NOT NULL,
+    UNIQUE (devad, handle)
+);
+CREATE INDEX IF NOT EXISTS messages_peer ON messages (devad, peer, timestamp);
+CREATE TABLE IF NOT EXISTS folders (
+    devad TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    complete INTEGER NOT NULL,
+    PRIMARY KEY (devad, folder)
+);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    body, name, content='messages', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, body, name) VALUES (new.id, new.body, new.name);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, body, name)
+    VALUES ('delete', old.id, old.body, old.name);
+END;
+"""
+
+COLUMNS = 'handle, folder, peer, name, incoming, timestamp, read, body'
+
+
+def parse_bmessage(data):
+    """ Return the originator, recipients and text of a bMessage
+
+    Parameters
+    ----------
+    data: str
+    The bMessage, as returned by Message1.Get
+
+    Returns
+    -------
+    originator: str
+    The TEL of the originator vCard, '' if there is none
+
+    recipients: list of str
+    The TEL of the vCards of the envelope
+
+    text: str
+    The text of the message
+    """
+    originator = ''
+    recipients = []
+    text = []
+    in_env = False
+    in_msg = False
+    for line in data.splitlines():
+        if in_msg:
+            if line == 'END:MSG':
+                in_msg = False
+            else:
+                text.append(line)
+            continue
+        upper = line.upper()
+        if upper == 'BEGIN:MSG':
+            in_msg = True
+        elif upper == 'BEGIN:BENV':
+            in_env = True
+        elif upper.startswith('TEL') and ':' in line:
+            number = line.split(':', 1)[1].strip()
+            if in_env:
+                recipients.append(number)
+            elif not originator:
+                originator = number
+    return originator, recipients, '\n'.join(text)
+
+
+def message_handle(path):
+    """ Return the handle of the MAP message object path, '0400000A' for
+    /org/bluez/obex/client/session0/message0400000A
+    """
+    return path.rsplit('/', 1)[-1][len('message'):]
+
+
+def message_from_map(handle, folder, props, data):
+    """ Build a Message from the MAP listing properties and the bMessage
+
+    Parameters
+    ----------
+    handle: str
+    The message handle
+
+    folder: str
+    The folder listed
+
+    props: dict
+    The properties of the message in the ListMessages result
+
+    data: str
+    The bMessage
+
+    Returns
+    -------
+    Message
+    The message
+    """
+    originator, recipients, body = parse_bmessage(data)
+    incoming = folder != 'sent'
+    if incoming:
+        number = props.get('SenderAddress', '') or originator
+        name = props.get('Sender', '')
+    else:
+        number = props.get('RecipientAddress', '') or (recipients[0] if recipients else '')
+        name = props.get('Recipient', '')
+    return Message(handle, folder, canonical(number), name, incoming,
+                   props.get('Timestamp', ''), bool(props.get('Read', False)), body)
+
+
+class MessageStore:
+    """ SQLite database of the messages of all the devices
+
+    Attributes
+    ----------
+    fts: bool
+    Whether the full text index is available
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.executescript(SCHEMA)
+        try:
+            self.db.executescript(FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError as e:
+            print('Full text search not available:', e)
+            self.fts = False
+        self.db.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+        self.db.commit()
+
+    def handles(self, devad, folder=None):
+        """ Return the set of the message handles stored for devad
+        """
+        if folder is None:
+            rows = self.db.execute('SELECT handle FROM messages WHERE devad = ?', (devad,))
+        else:
+            rows = self.db.execute('SELECT handle FROM messages WHERE devad = ? AND folder = ?',
+                                   (devad, folder))
+        return set(h for h, in rows)
+
+    def complete(self, devad, folder):
+        """ Whether a sync of folder listed all its messages, so that the
+        next one may stop at the first page without new message
+        """
+        row = self.db.execute('SELECT complete FROM folders WHERE devad = ? AND folder = ?',
+                              (devad, folder)).fetchone()
+        return row is not None and bool(row[0])
+
+    def set_complete(self, devad, folder, complete):
+        """ Record whether a sync of folder listed all its messages
+        """
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO folders (devad, folder, complete) '
+                            'VALUES (?, ?, ?)', (devad, folder, int(complete)))
+
+    def add(self, devad, messages):
+        """ Store messages, the ones already stored are ignored
+
+        Parameters
+        ----------
+        devad: str
+        The device address
+
+        messages: iterable of Message
+        The messages
+
+        Returns
+        -------
+        int
+        The number of messages added
+        """
+        with self.db:
+            cursor = self.db.executemany('INSERT OR IGNORE INTO messages (devad, {}) '
+                                         'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'.format(COLUMNS),
+                                         ((devad,) + tuple(m) for m in messages))
+        # Without the rows of the index, added by the triggers
+        return cursor.rowcount
+
+    def to_message(self, row):
+        handle, folder, peer, name, incoming, timestamp, read, body = row
+        return Message(handle, folder, peer, name, bool(incoming), timestamp, bool(read), body)
+
+    def conversation(self, devad, number, limit=200):
+        """ Return the last messages exchanged with number, oldest first
+
+        Parameters
+        ----------
+        devad: str
+        The device address
+
+        number: str
+        The phone number, in any form
+
+        limit: int (default 200)
+        The maximum number of messages
+
+        Returns
+        -------
+        list of Message
+        The messages
+        """
+        rows = self.db.execute('SELECT {} FROM messages WHERE devad = ? AND peer = ? '
+                               'ORDER BY timestamp DESC LIMIT ?'.format(COLUMNS),
+                               (devad, canonical(number), limit))
+        return [self.to_message(r) for r in reversed(rows.fetchall())]
+
+    def conversations(self, devad):
+        """ Return the last message of each conversation, most recent first
+        """
+        rows = self.db.execute('SELECT {0} FROM messages m WHERE devad = ? AND timestamp = '
+                               '(SELECT MAX(timestamp) FROM messages WHERE devad = m.devad '
+                               'AND peer = m.peer) GROUP BY peer '
+                               'ORDER BY timestamp DESC'.format(COLUMNS),
+                               (devad,))
+        return [self.to_message(r) for r in rows]
+
+    def search(self, text, devad=None, limit=50):
+        """ Return the messages containing the words of text, most recent first
+
+        Each word matches as a prefix, case and accent insensitive when
+        the full text index is available.
+        """
+        words = text.split()
+        if not words:
+            return []
+        if self.fts:
+            query = ' '.join('"{}"*'.format(w.replace('"', '""')) for w in words)
+            sql = ('SELECT {} FROM messages WHERE id IN '
+                   '(SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?)'
+                   .format(COLUMNS))
+            args = [query]
+        else:
+            sql = 'SELECT {} FROM messages WHERE {}'.format(
+                COLUMNS, ' AND '.join(['body LIKE ?'] * len(words)))
+            args = ['%{}%'.format(w) for w in words]
+        if devad is not None:
+            sql += ' AND devad = ?'
+            args.append(devad)
+        sql += ' ORDER BY timestamp DESC LIMIT ?'
+        args.append(limit)
+        return [self.to_message(r) for r in self.db.execute(sql, args)]
+
+    def close(self):
+        self.db.close()
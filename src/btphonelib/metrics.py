@@ -0,0 +1,210 @@
+# metrics.py: Latency and volume statistics of the phone operations
+# Copyright (C) 2018 - 2021 Arnaud Gardelein <arnaud@oscopy.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+""" Statistics collected by BTPhone
+
+Every D-Bus call is counted with its errors and its latency, keyed by
+interface and method. SDP browses and OBEX transfers are timed too.
+Recording only updates a few counters, BTPhone.stats() returns the
+aggregates as a dict which can be dumped as JSON.
+
+Set BTPHONELIB_STATS to a file name, or to - for stderr, to dump the
+statistics when the program exits.
+"""
+
+import bisect
+import json
+import sys
+import threading
+
+STATS_ENV = 'BTPHONELIB_STATS'
+# Upper bounds of the latency buckets, in ms
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+
+class Histogram:
+    """ Latencies counted in fixed buckets
+
+    Attributes
+    ----------
+    counts: list of int
+    The number of values in each bucket of BUCKETS, the last one
+    counting the values above the largest bound
+
+    count, total, min, max: int, float
+    The number, sum, min and max of the values, in seconds
+    """
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, elapsed):
+        """ Count one value, in seconds
+        """
+        self.counts[bisect.bisect_left(BUCKETS, elapsed * 1000)] += 1
+        self.count += 1
+        self.total += elapsed
+        if self.min is None or elapsed < self.min:
+            self.min = elapsed
+        if self.max is None or elapsed > self.max:
+            self.max = elapsed
+
+    def percentile(self, p):
+        """ Return the upper bound of the bucket holding the p-th
+        percentile, in seconds, the max for the last bucket
+        """
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                if i == len(BUCKETS):
+                    return self.max
+                return min(BUCKETS[i] / 1000, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {'count': self.count,
+                'mean': self.total / self.count if self.count else None,
+                'min': self.min,
+                'p50': self.percentile(50),
+                'p95': self.percentile(95),
+                'max': self.max,
+                'buckets': {('<={}ms'.format(b) if i < len(BUCKETS) else '>{}ms'.format(BUCKETS[-1])): n
+                            for i, (b, n) in enumerate(zip(BUCKETS + (BUCKETS[-1],), self.counts))
+                            if n},
+                }
+
+
+class CallStats:
+    """ Count, errors and latency of one D-Bus method
+    """
+    def __init__(self):
+        self.errors = 0
+        self.last_error = None
+        self.latency = Histogram()
+
+    def to_dict(self):
+        res = self.latency.to_dict()
+        res['errors'] = self.errors
+        if self.last_error is not None:
+            res['last_error'] = self.last_error
+        return res
+
+
+class Metrics:
+    """ The statistics of a BTPhone
+
+    SDP browses may be recorded from the probe threads, so updates are
+    done under a lock.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Forget everything recorded
+        """
+        with self.lock:
+            self.calls = {}
+            self.browses = Histogram()
+            self.browse_failures = 0
+            self.transfers = {}
+            self.transfer_bytes = 0
+
+    def record_call(self, iface, method, elapsed, error=None):
+        """ Record a D-Bus call
+
+        Parameters
+        ----------
+        iface: str
+        The interface called
+
+        method: str
+        The method called
+
+        elapsed: float
+        The time until the reply, in seconds
+
+        error: str or None (default None)
+        The error message if the call failed
+        """
+        with self.lock:
+            stats = self.calls.get((iface, method), None)
+            if stats is None:
+                stats = self.calls[(iface, method)] = CallStats()
+            stats.latency.add(elapsed)
+            if error is not None:
+                stats.errors += 1
+                stats.last_error = error
+
+    def record_browse(self, elapsed, found):
+        """ Record an SDP browse which lasted elapsed seconds, found is
+        False when none of the services were found
+        """
+        with self.lock:
+            self.browses.add(elapsed)
+            if not found:
+                self.browse_failures += 1
+
+    def record_transfer(self, transfer):
+        """ Record a finished transfer.Transfer
+        """
+        if transfer.finished is None:
+            return
+        with self.lock:
+            status = str(transfer.status)
+            histogram = self.transfers.get(status, None)
+            if histogram is None:
+                histogram = self.transfers[status] = Histogram()
+            histogram.add(transfer.finished - transfer.started)
+            self.transfer_bytes += transfer.transferred or 0
+
+    def stats(self):
+        """ Return the statistics
+
+        Returns
+        -------
+        dict
+        calls: {'interface.method': latency dict with count, errors, mean,
+        min, p50, p95, max in seconds and the bucket counts}, sdp: browse
+        latency dict with failures, transfers: {status: duration dict},
+        transfer_bytes: total bytes transferred
+        """
+        with self.lock:
+            sdp = self.browses.to_dict()
+            sdp['failures'] = self.browse_failures
+            return {'calls': {'{}.{}'.format(*k): v.to_dict() for k, v in sorted(self.calls.items())},
+                    'sdp': sdp,
+                    'transfers': {k: v.to_dict() for k, v in sorted(self.transfers.items())},
+                    'transfer_bytes': self.transfer_bytes,
+                    }
+
+    def dump(self, fn='-'):
+        """ Write the statistics as JSON to fn, - for stderr
+        """
+        if fn == '-':
+            json.dump(self.stats(), sys.stderr, indent=1)
+            sys.stderr.write('\n')
+            return
+        try:
+            with open(fn, 'w') as f:
+                json.dump(self.stats(), f, indent=1)
+        except OSError as e:
+            print('Unable to write statistics:', e)
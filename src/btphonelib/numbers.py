@@ -0,0 +1,152 @@
+# numbers.py: Phone number normalization
+# Copyright (C) 2018 - 2021 Arnaud Gardelein <arnaud@oscopy.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+""" Canonical form of the phone numbers
+
+The same number may be written 06 12 34 56 78, +33 6 12 34 56 78 or
+0033 6 12 34 56 78. canonical() rewrites them as +33612345678, using the
+dialing rules of the region, set by set_default_region(), by default the
+one of the locale. Only the numbers having the length of the national
+numbers of the region are rewritten, the others, such as short codes or
+numbers of another country, are kept as digits.
+"""
+
+from collections import namedtuple
+from functools import lru_cache
+import locale
+import re
+
+Region = namedtuple('Region', ['code', 'trunk', 'international', 'lengths', 'bare'],
+                    defaults=[False])
+Region.__doc__ = """ Dialing rules of a region: country code, national trunk prefix
+removed after the country code ('' when kept, as in Italy), international
+call prefix, lengths of the national numbers without the trunk prefix, and
+whether they may be dialed without it
+"""
+
+REGIONS = {
+    'AT': Region('43', '0', '00', range(7, 14)),
+    'AU': Region('61', '0', '0011', (9,)),
+    'BE': Region('32', '0', '00', (8, 9)),
+    'BR': Region('55', '0', '00', (10, 11)),
+    'CA': Region('1', '1', '011', (10,), True),
+    'CH': Region('41', '0', '00', (9,)),
+    'CZ': Region('420', '', '00', (9,)),
+    'DE': Region('49', '0', '00', range(6, 12)),
+    'DK': Region('45', '', '00', (8,)),
+    'ES': Region('34', '', '00', (9,)),
+    'FI': Region('358', '0', '00', range(6, 11)),
+    'FR': Region('33', '0', '00', (9,)),
+    'GB': Region('44', '0', '00', (9, 10)),
+    'GR': Region('30', '', '00', (10,)),
+    'IE': Region('353', '0', '00', (7, 8, 9)),
+    'IN': Region('91', '0', '00', (10,)),
+    'IT': Region('39', '', '00', range(6, 12)),
+    'JP': Region('81', '0', '010', (9, 10)),
+    'LU': Region('352', '', '00', range(6, 12)),
+    'MA': Region('212', '0', '00', (9,)),
+    'NL': Region('31', '0', '00', (9,)),
+    'NO': Region('47', '', '00', (8,)),
+    'NZ': Region('64', '0', '00', (8, 9, 10)),
+    'PL': Region('48', '', '00', (9,)),
+    'PT': Region('351', '', '00', (9,)),
+    'SE': Region('46', '0', '00', range(7, 10)),
+    'US': Region('1', '1', '011', (10,), True),
+}
+
+# Shorter numbers are short codes, never rewritten
+MIN_SUBSCRIBER_DIGITS = 6
+# A phone number as typed: digits with separators, an optional leading +,
+# beginning with a digit or an area code in parentheses, ending with a digit
+NUMBER_RE = re.compile(r'^\+?[\d(][\d\s./()-]*\d$')
+
+# None until set_default_region() or the first default_region()
+_default_region = None
+
+
+def set_default_region(region):
+    """ Use the dialing rules of region, 'FR' for instance, rather than the
+    one of the locale, numbers are kept as typed if None or unknown
+    """
+    global _default_region
+    region = (region or '').strip().upper()
+    _default_region = region if region in REGIONS else ''
+
+
+def default_region():
+    """ Return the region set by set_default_region(), or the one of the
+    locale, 'FR' for fr_FR, None if unknown
+    """
+    if _default_region is None:
+        lang = locale.getlocale()[0] or ''
+        set_default_region(lang.partition('_')[2])
+    return _default_region or None
+
+
+def is_number(text):
+    """ Whether text is a phone number rather than a name
+    """
+    text = text.strip()
+    return (NUMBER_RE.match(text) is not None
+            and text.count('(') == text.count(')'))
+
+
+def canonical(number, region=None):
+    """ Return the canonical form of a phone number
+
+    Parameters
+    ----------
+    number: str
+    The number as typed or stored
+
+    region: str or None (default None)
+    The region whose dialing rules apply, default_region() if None
+
+    Returns
+    -------
+    str
+    The number as '+' followed by the country code and the subscriber
+    number when it can be determined, the digits otherwise
+    """
+    return _canonical(number, region or default_region())
+
+
+@lru_cache(maxsize=65536)
+def _canonical(number, region):
+    # The same numbers come from the phonebook, the call history, the
+    # index and the search, the rules are applied once to each
+    number = number.strip()
+    if number.startswith('+'):
+        # +33 (0)6 12 34 56 78, the trunk prefix is not dialed
+        return '+' + ''.join(c for c in number.replace('(0)', '') if c.isdigit())
+    digits = ''.join(c for c in number if c.isdigit())
+    rules = REGIONS.get(region, None)
+    if rules is None or len(digits) < MIN_SUBSCRIBER_DIGITS:
+        return digits
+    if digits.startswith(rules.international):
+        return '+' + digits[len(rules.international):]
+    trunked = bool(rules.trunk) and digits.startswith(rules.trunk)
+    national = digits[len(rules.trunk):] if trunked else digits
+    if rules.trunk and not trunked and (not rules.bare or digits[0] == '0'):
+        # Not a national number dialed without the trunk prefix
+        return digits
+    if len(national) not in rules.lengths:
+        return digits
+    return '+' + rules.code + national
+
+
+def same_number(a, b, region=None):
+    """ Whether a and b are the same number written differently
+    """
+    return canonical(a, region) == canonical(b, region)
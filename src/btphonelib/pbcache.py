@@ -0,0 +1,299 @@
+# pbcache.py: On-disk cache of the phonebooks read from the phones
+# Copyright (C) 2018 - 2021 Arnaud Gardelein <arnaud@oscopy.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+import os
+import json
+from .vcard import Contact
+from .numbers import canonical
+
+# PBAP 1.2 properties of PhonebookAccess1 telling whether the phonebook
+# changed
+COUNTERS = ('DatabaseIdentifier', 'PrimaryCounter')
+# The phone phonebook, synchronized incrementally
+MAIN_FOLDER = 'int/pb'
+# Phonebooks read with the main one by default: SIM contacts and call history
+FOLDERS = ('sim1/pb', 'int/cch')
+# Call history phonebooks, merged with the contacts
+CALL_HISTORY = ('ich', 'och', 'mch', 'cch')
+
+
+def merge_contacts(contacts, folders):
+    """ Merge the contacts of several phonebooks
+
+    The contacts of the other phonebooks, such as the SIM, are appended.
+    The calls of the call history are added to the contact having the
+    number called, or appended as new contacts when the number is unknown.
+
+    Parameters
+    ----------
+    contacts: list of Contact
+    The contacts of the main phonebook
+
+    folders: dict of str:list of Contact
+    The contacts of each other phonebook, keyed by 'location/name'
+
+    Returns
+    -------
+    list of Contact
+    The merged contacts
+    """
+    merged = list(contacts)
+    history = []
+    for folder, folder_contacts in folders.items():
+        if folder.rsplit('/', 1)[-1] in CALL_HISTORY:
+            history.extend(folder_contacts)
+        else:
+            merged.extend(folder_contacts)
+    if not history:
+        return merged
+    # Position in merged of each canonical number
+    owner = {}
+    for i, contact in enumerate(merged):
+        for number, kind in contact.tels:
+            owner.setdefault(canonical(number), i)
+    for call in history:
+        if not call.tels:
+            continue
+        number = canonical(call.tels[0][0])
+        i = owner.get(number, None)
+        if i is None:
+            owner[number] = len(merged)
+            merged.append(call)
+        else:
+            contact = merged[i]
+            merged[i] = contact._replace(calls=list(contact.calls) + list(call.calls))
+    return merged
+
+
+class CachedPhonebook:
+    """ The phonebook of one device as last read
+
+    Attributes
+    ----------
+    devad: str
+    The device address
+
+    listing: list of (str, str) tuples
+    The (vcard handle, name) pairs returned by PBAP List
+
+    contacts: dict of str:Contact
+    The contacts, keyed by vcard handle
+
+    counters: dict of str:str
+    The PBAP version counters, empty if the phone does not provide them
+
+    folders: dict of str:list of Contact
+    The contacts of the other phonebooks and call history, keyed by
+    'location/name' such as 'sim1/pb'
+
+    folder_counters: dict of str:dict of str:str
+    The PBAP version counters of each other phonebook, when provided
+    """
+    def __init__(self, devad, listing=None, contacts=None, counters=None, folders=None,
+                 folder_counters=None):
+        self.devad = devad
+        self.listing = listing if listing is not None else []
+        self.contacts = contacts if contacts is not None else {}
+        self.counters = counters if counters is not None else {}
+        self.folders = folders if folders is not None else {}
+        self.folder_counters = folder_counters if folder_counters is not None else {}
+
+    def get_contacts(self):
+        """ Return the list of contacts, in listing order when known,
+        merged with the other phonebooks
+        """
+        order = {h: i for i, (h, n) in enumerate(self.listing)}
+        handles = sorted(self.contacts, key=lambda h: order.get(h, len(order)))
+        return merge_contacts([self.contacts[h] for h in handles], self.folders)
+
+    def set_folder(self, folder, contacts, counters=None):
+        """ Replace the contacts of folder, return whether they changed
+        """
+        self.folder_counters[folder] = dict(counters) if counters else {}
+        if self.folders.get(folder, None) == contacts:
+            return False
+        self.folders[folder] = contacts
+        return True
+
+    def unchanged(self, counters, listing=None):
+        """ Whether the phonebook on the phone is the same as the cached one
+
+        The PBAP counters are used when the phone provides them, otherwise
+        the listing is compared.
+
+        Parameters
+        ----------
+        counters: dict of str:str
+        The counters read from the phone
+
+        listing: list of (str, str) tuples or None (default None)
+        The listing read from the phone, None if not read yet
+
+        Returns
+        -------
+        bool or None
+        None when listing is required to decide
+        """
+        if not self.contacts:
+            return False
+        if counters and self.counters:
+            return counters == self.counters
+        if listing is None:
+            return None
+        return listing == self.listing
+
+    def delta(self, listing):
+        """ Compare listing with the cached one
+
+        Parameters
+        ----------
+        listing: list of (str, str) tuples
+        The listing read from the phone
+
+        Returns
+        -------
+        list of str
+        The handles which are new or whose name changed
+        """
+        old = dict(self.listing)
+        return [h for h, n in listing if h not in self.contacts or old.get(h) != n]
+
+    def replace(self, listing, contacts, counters):
+        """ Replace the whole phonebook with the result of a PullAll
+
+        Cards are returned in handle order, so contacts are associated to
+        the listing when both have the same length. Otherwise nothing is
+        stored, as contacts without handles would never match a later
+        listing, and the cards have to be pulled by handle.
+
+        Returns
+        -------
+        bool
+        Whether the phonebook was replaced
+        """
+        if len(listing) != len(contacts):
+            return False
+        self.listing = list(listing)
+        self.contacts = {h: c for (h, n), c in zip(listing, contacts)}
+        self.counters = dict(counters)
+        return True
+
+    def update(self, listing, pulled, counters):
+        """ Apply a delta refresh
+
+        Parameters
+        ----------
+        listing: list of (str, str) tuples
+        The listing read from the phone
+
+        pulled: dict of str:Contact
+        The contacts pulled individually, keyed by handle
+
+        counters: dict of str:str
+        The counters read from the phone
+        """
+        handles = set(h for h, n in listing)
+        contacts = {h: c for h, c in self.contacts.items() if h in handles}
+        contacts.update(pulled)
+        self.listing = list(listing)
+        self.contacts = contacts
+        self.counters = dict(counters)
+
+    def to_dict(self):
+        """ Return a representation suitable for json
+        """
+        return {'devad': self.devad,
+                'listing': self.listing,
+                'counters': self.counters,
+                'contacts': [[h, c.fn, c.tels, c.calls] for h, c in self.contacts.items()],
+                'folders': {f: [[c.fn, c.tels, c.calls] for c in contacts]
+                            for f, contacts in self.folders.items()},
+                'folder_counters': self.folder_counters,
+                }
+
+    @classmethod
+    def from_dict(cls, d):
+        """ Build a CachedPhonebook from to_dict() output
+        """
+        def contact(fn, tels, calls=()):
+            tels = [tuple(t) for t in tels]
+            # Calls cached without the number called
+            number = tels[0][0] if tels else ''
+            return Contact(fn, tels, [tuple(c) if len(c) > 2 else tuple(c) + (number,)
+                                      for c in calls])
+        contacts = {c[0]: contact(*c[1:]) for c in d.get('contacts', [])}
+        folders = {f: [contact(*c) for c in contacts]
+                   for f, contacts in d.get('folders', {}).items()}
+        return cls(d['devad'],
+                   [tuple(x) for x in d.get('listing', [])],
+                   contacts,
+                   d.get('counters', {}),
+                   folders,
+                   d.get('folder_counters', {}))
+
+
+class PhonebookCache:
+    """ Store one CachedPhonebook per device in directory
+    """
+    VERSION = 1
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def filename(self, devad):
+        """ Return the cache file name for devad
+        """
+        return os.path.join(self.directory,
+                            'phonebook-{}.json'.format(devad.replace(':', '')))
+
+    def load(self, devad):
+        """ Load the phonebook of devad
+
+        Parameters
+        ----------
+        devad: str
+        The device address
+
+        Returns
+        -------
+        CachedPhonebook
+        The cached phonebook, empty if not cached or unreadable
+        """
+        try:
+            with open(self.filename(devad), 'r', encoding='utf-8') as f:
+                d = json.load(f)
+        except FileNotFoundError:
+            return CachedPhonebook(devad)
+        except (OSError, ValueError) as e:
+            print('Unable to read phonebook cache:', e)
+            return CachedPhonebook(devad)
+        if d.get('version') != PhonebookCache.VERSION:
+            return CachedPhonebook(devad)
+        return CachedPhonebook.from_dict(d)
+
+    def save(self, phonebook):
+        """ Write phonebook to disk, replacing the previous file atomically
+
+        Parameters
+        ----------
+        phonebook: CachedPhonebook
+        The phonebook to save
+        """
+        d = phonebook.to_dict()
+        d['version'] = PhonebookCache.VERSION
+        fn = self.filename(phonebook.devad)
+        tmp = fn + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(d, f)
+        os.replace(tmp, fn)
@@ -0,0 +1,63 @@
+# ports.py: Cache of the RFCOMM channels of the phone services
+# Copyright (C) 2018 - 2021 Arnaud Gardelein <arnaud@oscopy.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+# Service class IDs, as found in SDP records
+MAP_SERVICE = '0x1132'
+PBAP_SERVICE = '0x112f'
+
+# OBEX session target of each service
+TARGETS = {'map': MAP_SERVICE,
+           'pbap': PBAP_SERVICE,
+           }
+
+
+class PortCache:
+    """ The RFCOMM channel of each (device address, service ID) pair
+
+    Filled by SDP browses, entries are only invalidated when a session
+    cannot be created on the cached channel.
+    """
+    def __init__(self, ports=None):
+        self.ports = dict(ports) if ports is not None else {}
+
+    def get(self, devad, service_id=MAP_SERVICE):
+        """ Return the cached port, None if unknown
+        """
+        return self.ports.get((devad, service_id), None)
+
+    def set(self, devad, service_id, port):
+        """ Store the port of service_id on devad, None removes the entry
+        """
+        if port is None:
+            self.invalidate(devad, service_id)
+        else:
+            self.ports[(devad, service_id)] = port
+
+    def invalidate(self, devad, service_id):
+        """ Forget the port of service_id on devad
+        """
+        self.ports.pop((devad, service_id), None)
+
+    def update(self, ports):
+        """ Add the entries of a {(devad, service_id): port} dict
+        """
+        self.ports.update(ports)
+
+    def items(self):
+        """ Return the ((devad, service_id), port) pairs
+        """
+        return self.ports.items()
+
+    def __contains__(self, key):
+        return key in self.ports
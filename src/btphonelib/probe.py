@@ -0,0 +1,98 @@
+# probe.py: Discover the services of the devices in the background
+# Copyright (C) 2018 - 2021 Arnaud Gardelein <arnaud@oscopy.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+from concurrent.futures import ThreadPoolExecutor
+from gi.repository import GLib
+from .ports import TARGETS
+
+# Number of devices browsed at the same time
+MAX_WORKERS = 3
+
+
+class DeviceProber:
+    """ Browse the devices in a bounded thread pool to fill the port cache
+
+    Each device is browsed once for the services in TARGETS which are not
+    cached yet, again later when the browse failed or found nothing. The browses run in worker threads, results are stored in
+    the port cache from the GLib main loop.
+    """
+    def __init__(self, phone, max_workers=MAX_WORKERS):
+        self.phone = phone
+        self.max_workers = max_workers
+        self.executor = None
+        self.probed = set()
+        self.done_cb = None
+
+    def set_done_callback(self, callback):
+        """ Set the callback to use when a device was probed
+
+        Parameter
+        ---------
+        callback: callable(str, dict)
+        Called from the main loop with the device address and the dict
+        of the ports found
+        """
+        self.done_cb = callback
+
+    def probe(self, devad):
+        """ Browse devad in the background, unless already done
+
+        Parameters
+        ----------
+        devad: str
+        The device address
+
+        Returns
+        -------
+        bool
+        True if a browse was started
+        """
+        if devad is None or devad in self.probed:
+            return False
+        missing = [s for s in TARGETS.values() if self.phone.ports.get(devad, s) is None]
+        if not missing:
+            return False
+        self.probed.add(devad)
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                               thread_name_prefix='sdp-probe')
+        future = self.executor.submit(self.phone.get_device_ports, devad, missing)
+        future.add_done_callback(lambda f: GLib.idle_add(self.probed_cb, devad, f))
+        return True
+
+    def probed_cb(self, devad, future):
+        """ Store the ports found for devad, from the main loop
+        """
+        try:
+            ports = future.result()
+        except Exception as e:
+            print('Unable to probe {}: {}'.format(devad, e))
+            ports = {}
+        if not ports:
+            # Out of range or not answering, probe it again next time
+            self.probed.discard(devad)
+        for service_id, port in ports.items():
+            # Do not overwrite a port found meanwhile
+            if self.phone.ports.get(devad, service_id) is None:
+                self.phone.ports.set(devad, service_id, port)
+        if self.done_cb is not None:
+            self.done_cb(devad, ports)
+        return False
+
+    def shutdown(self):
+        """ Stop the workers, pending browses are cancelled
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
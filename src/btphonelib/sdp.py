@@ -0,0 +1,147 @@
+# sdp.py: Incremental parser for sdptool XML output
+# Copyright (C) 2018 - 2021 Arnaud Gardelein <arnaud@oscopy.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+""" Incremental parser for sdptool browse --xml output
+
+sdptool prints one XML document per service record. The output is fed
+line by line, each record goes through an XMLPullParser, and the port of
+a service is known as soon as both its service class ID list (attribute
+0x0001) and its protocol descriptor list (attribute 0x0004) were read.
+The caller can then stop sdptool without waiting for the other records.
+"""
+
+import xml.etree.ElementTree as ET
+
+SDPTOOL = '/usr/bin/sdptool'
+# Service class ID list and protocol descriptor list attributes
+SERVICE_CLASS_ID_LIST = '0x0001'
+PROTOCOL_DESCRIPTOR_LIST = '0x0004'
+# RFCOMM protocol UUID
+RFCOMM = '0x0003'
+
+
+def sdptool_args(devad):
+    """ Return the command line browsing devad
+    """
+    return [SDPTOOL, 'browse', '--xml', devad]
+
+
+class SDPParser:
+    """ Find the RFCOMM channel of several services in one browse
+
+    Attributes
+    ----------
+    wanted: set of str
+    The service IDs looked up, in hex format
+
+    ports: dict of str:int
+    The ports found so far
+    """
+    def __init__(self, service_ids):
+        self.wanted = set(service_ids)
+        self.ports = {}
+        self.parser = None
+        self.services = None
+        self.channel = None
+
+    def done(self):
+        """ Whether all the wanted services were found
+        """
+        return len(self.ports) == len(self.wanted)
+
+    def feed(self, line):
+        """ Parse one line of sdptool output
+
+        Parameters
+        ----------
+        line: str
+        The line
+
+        Returns
+        -------
+        bool
+        True when all the wanted services were found
+        """
+        stripped = line.strip()
+        if not stripped.startswith('<'):
+            # sdptool comments between records
+            return self.done()
+        if stripped.startswith('<?xml'):
+            # New record
+            self.parser = ET.XMLPullParser(events=('end',))
+            self.services = None
+            self.channel = None
+        if self.parser is None:
+            return self.done()
+        try:
+            self.parser.feed(line)
+            for event, elem in self.parser.read_events():
+                self.element(elem)
+        except ET.ParseError as e:
+            print('Invalid SDP record:', e)
+            self.parser = None
+        return self.done()
+
+    def element(self, elem):
+        """ Process a completed element
+        """
+        if elem.tag == 'record':
+            self.parser = None
+            return
+        if elem.tag != 'attribute':
+            return
+        attr_id = elem.get('id')
+        if attr_id == SERVICE_CLASS_ID_LIST:
+            self.services = [u.get('value') for u in elem.iterfind('./sequence/uuid')]
+        elif attr_id == PROTOCOL_DESCRIPTOR_LIST:
+            for seq in elem.iterfind('./sequence/sequence'):
+                uuid = seq.find('./uuid')
+                port = seq.find('./uint8')
+                if uuid is not None and uuid.get('value') == RFCOMM and port is not None:
+                    self.channel = int(port.get('value'), 16)
+                    break
+        else:
+            elem.clear()
+            return
+        elem.clear()
+        if self.services is not None and self.channel is not None:
+            for service_id in self.services:
+                if service_id in self.wanted and service_id not in self.ports:
+                    self.ports[service_id] = self.channel
+            # Nothing more to learn from this record
+            self.parser = None
+
+
+def parse_output(output, service_ids):
+    """ Parse a complete sdptool output
+
+    Parameters
+    ----------
+    output: str or iterable of str
+    The output or its lines
+
+    service_ids: iterable of str
+    The service IDs looked up
+
+    Returns
+    -------
+    dict of str:int
+    The port of each service found
+    """
+    parser = SDPParser(service_ids)
+    lines = output.splitlines(True) if isinstance(output, str) else output
+    for line in lines:
+        if parser.feed(line):
+            break
+    return parser.ports
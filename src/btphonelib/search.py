@@ -0,0 +1,285 @@
+# search.py: Ranked fuzzy search of the contacts
+# Copyright (C) 2018 - 2021 Arnaud Gardelein <arnaud@oscopy.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+""" Search the contacts as the recipient is typed
+
+Names are matched token by token, ignoring case and accents: "dupont",
+"jean dup" and "DUPONT J" all find "Jean Dupont". Digits are matched
+anywhere in the number, ignoring separators, a leading 0 also matching
+the international form.
+
+Results are ranked by match quality, then by how recently the number was
+used to send a message, then by its frecency in the call history. When
+the query extends the previous one, only the previous matches are
+examined again.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import re
+import threading
+import unicodedata
+from .numbers import canonical
+
+# Phonebooks larger than this are searched in a worker thread
+ASYNC_THRESHOLD = 2000
+# Match quality of a query token against a name token
+EXACT, PREFIX, SUBSTRING = 3, 2, 1
+
+SEPARATORS = re.compile(r"[\s,;:.()'\"-]+")
+
+
+def fold(text):
+    """ Return text in lower case without accents
+    """
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def tokens(text):
+    """ Return the folded words of text
+    """
+    return [t for t in SEPARATORS.split(fold(text)) if t]
+
+
+def token_score(query, name_tokens):
+    """ Return the best quality of query against the name tokens, 0 if
+    none matches
+    """
+    best = 0
+    for t in name_tokens:
+        if t == query:
+            return EXACT
+        if t.startswith(query):
+            best = PREFIX
+        elif best < SUBSTRING and query in t:
+            best = SUBSTRING
+    return best
+
+
+class Query:
+    """ A parsed query
+
+    Attributes
+    ----------
+    text: str
+    The folded text
+
+    words: list of str
+    The words containing letters
+
+    digits: str
+    The digits, '' if there are none
+
+    kinds: list of bool
+    Whether each token is matched against the number rather than the name
+    """
+    def __init__(self, text):
+        self.text = fold(text).strip()
+        words = tokens(text)
+        self.kinds = [w.lstrip('+').isdigit() for w in words]
+        self.words = [w for w, digits in zip(words, self.kinds) if not digits]
+        self.digits = ''.join(c for w, digits in zip(words, self.kinds) if digits
+                              for c in w if c.isdigit())
+
+    def extends(self, other):
+        """ Whether the matches of self are a subset of the matches of other
+
+        The text must extend the other one with each token keeping its
+        kind: 12 then 12a searches the name instead of the number.
+        """
+        return (other is not None and bool(other.text) and self.text.startswith(other.text)
+                and self.kinds[:len(other.kinds)] == other.kinds)
+
+
+class ContactSearch:
+    """ Search engine over a list of contacts.Entry
+
+    Attributes
+    ----------
+    entries: list of Entry
+    The entries searched, replaced by set_entries()
+
+    recent: dict of str:int
+    The recency weight of each canonical number, higher is more recent
+
+    frecency: frecency.Frecency or None
+    The call history scores
+    """
+    def __init__(self, entries=(), recent=(), frecency=None):
+        self.set_entries(entries, frecency)
+        self.set_recent(recent)
+
+    def set_entries(self, entries, frecency=None):
+        """ Replace the entries searched
+
+        Parameters
+        ----------
+        entries: iterable of contacts.Entry
+        The entries
+
+        frecency: frecency.Frecency or None (default None)
+        The call history scores of the entries
+        """
+        entries = list(entries)
+        self.frecency = frecency
+        # Computed once, the queries only compare strings
+        self.prepared = [(tokens(e.name), ''.join(c for c in e.number if c.isdigit()))
+                         for e in entries]
+        self.numbers = [e.canonical for e in entries]
+        scores = frecency.scores if frecency is not None else {}
+        self.scores = [scores.get(n, 0.0) for n in self.numbers]
+        self.entries = entries
+        self.last = None
+        self.last_matches = None
+
+    def set_recent(self, numbers):
+        """ Set the numbers used recently
+
+        Parameters
+        ----------
+        numbers: list of str
+        The numbers, most recent first
+        """
+        n = len(numbers)
+        self.recent = {canonical(num): n - i for i, num in enumerate(numbers)}
+
+    def use(self, number):
+        """ Make number the most recently used
+        """
+        self.recent[canonical(number)] = max(self.recent.values(), default=0) + 1
+
+    def __len__(self):
+        return len(self.entries)
+
+    def score(self, query, i):
+        """ Return the match quality of the entry i, 0 if it does not match
+        """
+        name_tokens, digits = self.prepared[i]
+        score = 0
+        if query.digits:
+            if digits.startswith(query.digits):
+                score += PREFIX
+            elif query.digits in digits:
+                score += SUBSTRING
+            elif query.digits[0] == '0' and query.digits[1:] and query.digits[1:] in digits:
+                # National form of an international number
+                score += SUBSTRING
+            else:
+                return 0
+        for word in query.words:
+            s = token_score(word, name_tokens)
+            if not s:
+                return 0
+            score += s
+        return score
+
+    def search(self, text, limit=None):
+        """ Return the entries matching text, best first
+
+        Parameters
+        ----------
+        text: str
+        The text typed
+
+        limit: int or None (default None)
+        The maximum number of entries to return
+
+        Returns
+        -------
+        list of Entry
+        The matching entries
+        """
+        query = Query(text)
+        if not query.words and not query.digits:
+            self.last = None
+            self.last_matches = None
+            return []
+        if query.extends(self.last) and self.last_matches is not None:
+            candidates = self.last_matches
+        else:
+            candidates = range(len(self.entries))
+        scored = []
+        for i in candidates:
+            s = self.score(query, i)
+            if s:
+                scored.append((s, i))
+        self.last = query
+        self.last_matches = [i for s, i in scored]
+        entries = self.entries
+        numbers = self.numbers
+        scores = self.scores
+        recent = self.recent
+        scored.sort(key=lambda si: (-si[0], -recent.get(numbers[si[1]], 0),
+                                    -scores[si[1]], entries[si[1]].name))
+        if limit is not None:
+            scored = scored[:limit]
+        return [entries[i] for s, i in scored]
+
+
+class SearchWorker:
+    """ Run the searches of a ContactSearch in a thread when it is large
+
+    Results are passed to callback through dispatch, GLib.idle_add() in
+    the GTK application, so that they are handled in the main loop. The
+    results of a query are dropped when a newer query was submitted.
+    """
+    def __init__(self, engine, dispatch, threshold=ASYNC_THRESHOLD):
+        self.engine = engine
+        self.dispatch = dispatch
+        self.threshold = threshold
+        self.executor = None
+        self.lock = threading.Lock()
+        self.generation = 0
+
+    def search(self, text, limit, callback):
+        """ Search text, call callback(text, entries) with the results
+
+        Small phonebooks are searched immediately.
+        """
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+        if len(self.engine) < self.threshold:
+            callback(text, self.engine.search(text, limit))
+            return
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='contact-search')
+
+        def work():
+            if generation != self.generation:
+                # Already outdated
+                return
+            res = self.engine.search(text, limit)
+            self.dispatch(self.deliver, generation, callback, text, res)
+        self.executor.submit(work)
+
+    def deliver(self, generation, callback, text, res):
+        """ Call callback with the results, unless outdated
+        """
+        if generation == self.generation:
+            callback(text, res)
+        return False
+
+    def set_entries(self, entries, frecency=None):
+        """ Replace the entries searched, after the pending searches
+        """
+        if self.executor is None:
+            self.engine.set_entries(entries, frecency)
+        else:
+            self.executor.submit(self.engine.set_entries, entries, frecency)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
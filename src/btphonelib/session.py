@@ -0,0 +1,187 @@
+# session.py: Pool of OBEX sessions kept open between operations
+# Copyright (C) 2018 - 2021 Arnaud Gardelein <arnaud@oscopy.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+from gi.repository import GLib
+import time
+from .gasync import run_task, resolved
+
+# Close a session unused for this long, in seconds
+IDLE_TIMEOUT = 120
+# Check a session is still alive when unused for this long, in seconds
+HEALTH_CHECK_AFTER = 10
+
+
+class PooledSession:
+    """ An open session on a device
+
+    Attributes
+    ----------
+    devad: str
+    The device address
+
+    path: tuple
+    The session path as returned by create_session_async()
+
+    last_used: float
+    time.monotonic() of the last release
+
+    timeout_id: int or None
+    The GLib source closing the session when idle
+    """
+    def __init__(self, devad, path):
+        self.devad = devad
+        self.path = path
+        self.last_used = time.monotonic()
+        self.timeout_id = None
+
+
+class SessionPool:
+    """ Keep one session per device and target open between operations
+
+    Sessions are opened on first acquire_async() or by prewarm(), reused
+    by the following operations, checked when they were idle for a while,
+    and removed after idle_timeout seconds without use.
+    """
+    def __init__(self, phone, target='map', idle_timeout=IDLE_TIMEOUT):
+        self.phone = phone
+        self.target = target
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+        self.pending = {}
+
+    def acquire_async(self, devad):
+        """ Return a session on devad, opening it if needed
+
+        The RFCOMM channel is taken from the port cache of the phone.
+
+        Parameters
+        ----------
+        devad: str
+        The device address
+
+        Returns
+        -------
+        Future
+        Resolved with the session path, None if it could not be opened
+        """
+        pending = self.pending.get(devad, None)
+        if pending is not None:
+            return pending
+
+        def op():
+            session = self.sessions.get(devad, None)
+            if session is not None:
+                self.cancel_timeout(session)
+                if time.monotonic() - session.last_used < HEALTH_CHECK_AFTER:
+                    return session.path
+                alive = yield self.check_async(session)
+                if alive:
+                    return session.path
+                self.sessions.pop(devad, None)
+            path = yield self.phone.create_session_async(devad, target=self.target)
+            if path is None:
+                return None
+            self.sessions[devad] = PooledSession(devad, path)
+            return path
+        future = run_task(op())
+        self.pending[devad] = future
+        future.add_done_callback(lambda f: self.pending.pop(devad, None))
+        return future
+
+    def release(self, devad):
+        """ Mark the session of devad as unused, start the idle timer
+        """
+        session = self.sessions.get(devad, None)
+        if session is None:
+            return
+        session.last_used = time.monotonic()
+        self.cancel_timeout(session)
+        session.timeout_id = GLib.timeout_add_seconds(self.idle_timeout,
+                                                      self.idle_expired,
+                                                      devad)
+
+    def prewarm(self, devad):
+        """ Open the session on devad in the background, if not already
+
+        Parameters
+        ----------
+        devad: str
+        The device address
+        """
+        if devad in self.sessions or devad in self.pending:
+            return
+        future = self.acquire_async(devad)
+        future.add_done_callback(lambda f: self.release(devad))
+
+    def invalidate_async(self, devad):
+        """ Forget the session of devad after a failure, and remove it
+
+        Returns
+        -------
+        Future
+        Resolved when the session is removed
+        """
+        return self.close_async(devad)
+
+    def close_async(self, devad):
+        """ Remove the session of devad
+
+        Returns
+        -------
+        Future
+        Resolved when the session is removed
+        """
+        session = self.sessions.pop(devad, None)
+        if session is None:
+            return resolved(None)
+        self.cancel_timeout(session)
+        return self.phone.remove_session_async(session.path)
+
+    def close_all(self):
+        """ Remove all the sessions
+        """
+        for devad in list(self.sessions):
+            self.close_async(devad)
+
+    def check_async(self, session):
+        """ Check that session still exists on obexd
+
+        Returns
+        -------
+        Future
+        Resolved with True if the session is alive
+        """
+        def op():
+            res = yield self.phone.bus_call('org.freedesktop.DBus.Properties',
+                                            'Get',
+                                            args=GLib.Variant('(ss)', ('org.bluez.obex.Session1', 'Destination')),
+                                            path=session.path[0])
+            return res is not None
+        return run_task(op())
+
+    def idle_expired(self, devad):
+        """ GLib timeout callback, remove the idle session
+        """
+        session = self.sessions.get(devad, None)
+        if session is not None:
+            session.timeout_id = None
+            self.close_async(devad)
+        return False
+
+    def cancel_timeout(self, session):
+        """ Stop the idle timer of session
+        """
+        if session.timeout_id is not None:
+            GLib.source_remove(session.timeout_id)
+            session.timeout_id = None
@@ -0,0 +1,754 @@
+# simulated.py: In-process emulation of bluetoothd, obexd and phones
+# Copyright (C) 2018 - 2021 Arnaud Gardelein <arnaud@oscopy.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+""" A backend emulating phones, to run BTPhone without Bluetooth
+
+    backend = SimulatedBackend([SimulatedDevice('00:11:22:33:44:55',
+                                                contacts=[('Jean Martin', [('+33612345678', 'CELL')])])],
+                               latency=20, bandwidth=100000, failure_rate=0.01)
+    phone = BTPhone(backend=backend)
+
+The buses answer the D-Bus calls used by BTPhone the way bluetoothd and
+obexd do, from the GLib main loop: device objects, OBEX sessions, MAP
+pushes and PBAP pulls, with transfers signalled by PropertiesChanged.
+SDP browses return sdptool-like XML records.
+
+Each call is answered after latency ms, transfers last size / bandwidth
+seconds, and session creations and transfers fail with probability
+failure_rate. Pushed messages are stored in SimulatedDevice.messages, the
+phone then reports them sent, or failed with probability failure_rate,
+through the Status of a Message1 object.
+"""
+
+import base64
+import os
+import random
+import tempfile
+import time
+import zlib
+from concurrent.futures import Future
+from gi.repository import GLib
+from gi.repository import Gio
+from .ports import MAP_SERVICE, PBAP_SERVICE, TARGETS
+from .messages import parse_bmessage
+
+OBEX_NAME = 'org.bluez.obex'
+OBEX_PATH = '/org/bluez/obex'
+BLUEZ_NAME = 'org.bluez'
+PROPERTIES = 'org.freedesktop.DBus.Properties'
+OBJECT_MANAGER = 'org.freedesktop.DBus.ObjectManager'
+DEVICE_IFACE = 'org.bluez.Device1'
+SESSION_IFACE = 'org.bluez.obex.Session1'
+TRANSFER_IFACE = 'org.bluez.obex.Transfer1'
+PBAP_IFACE = 'org.bluez.obex.PhonebookAccess1'
+MESSAGE_IFACE = 'org.bluez.obex.Message1'
+# Transfer progress is signalled in this many steps
+PROGRESS_STEPS = 4
+
+
+def error(name, message):
+    """ Return the GLib.Error a D-Bus call would raise
+    """
+    return GLib.Error('GDBus.Error:{}: {}'.format(name, message))
+
+
+def vcard(name, tels, photo=None, calls=()):
+    """ Return one vCard 2.1 as sent over PBAP
+
+    Parameters
+    ----------
+    name: str
+    The formatted name
+
+    tels: list of (str, str)
+    The number and type of each phone number
+
+    photo: str or None (default None)
+    A base64 encoded photo
+
+    calls: list of (str, str) (default ())
+    The direction and time of each call, for the call history
+
+    Returns
+    -------
+    str
+    The vCard
+    """
+    lines = ['BEGIN:VCARD', 'VERSION:2.1',
+             'N;CHARSET=UTF-8:{};;;;'.format(name),
+             'FN;CHARSET=UTF-8:{}'.format(name)]
+    lines += ['TEL;{}:{}'.format(t, num) for num, t in tels]
+    lines += ['X-IRMC-CALL-DATETIME;{}:{}'.format(kind.upper(), stamp) for kind, stamp in calls]
+    if photo is not None:
+        lines.append('PHOTO;ENCODING=BASE64;JPEG:' + photo[:64])
+        lines += ['  ' + photo[i:i + 72] for i in range(64, len(photo), 72)]
+        lines.append('')
+    lines.append('END:VCARD')
+    return '\r\n'.join(lines) + '\r\n'
+
+
+def sdp_record(service_id, channel, handle):
+    """ Return a service record as printed by sdptool browse --xml
+    """
+    return ('<?xml version="1.0" encoding="UTF-8" ?>\n\n'
+            '<record>\n'
+            '\t<attribute id="0x0000">\n'
+            '\t\t<uint32 value="0x{:08x}" />\n'
+            '\t</attribute>\n'
+            '\t<attribute id="0x0001">\n'
+            '\t\t<sequence>\n'
+            '\t\t\t<uuid value="{}" />\n'
+            '\t\t</sequence>\n'
+            '\t</attribute>\n'
+            '\t<attribute id="0x0004">\n'
+            '\t\t<sequence>\n'
+            '\t\t\t<sequence>\n'
+            '\t\t\t\t<uuid value="0x0100" />\n'
+            '\t\t\t</sequence>\n'
+            '\t\t\t<sequence>\n'
+            '\t\t\t\t<uuid value="0x0003" />\n'
+            '\t\t\t\t<uint8 value="0x{:02x}" />\n'
+            '\t\t\t</sequence>\n'
+            '\t\t</sequence>\n'
+            '\t</attribute>\n'
+            '</record>\n\n').format(handle, service_id, channel)
+
+
+class SimulatedDevice:
+    """ A paired phone
+
+    Attributes
+    ----------
+    address: str
+    The device address
+
+    name: str
+    The device name
+
+    ports: dict of str:int
+    The RFCOMM channel of each service
+
+    contacts: list of (str, list of (str, str))
+    The phonebook, name and (number, type) of each entry
+
+    messages: list of bytes
+    The bMessages received
+
+    group_messages: bool
+    Whether bMessages with several recipients are accepted
+
+    sim_contacts: list of (str, list of (str, str)) or None
+    The SIM phonebook, None if there is no SIM
+
+    calls: list of (str, str, str, str)
+    The call history, name, number, direction and time of each call,
+    most recent first
+
+    inbox, sent: list of (str, str, str)
+    The number, MAP timestamp and text of the messages received and sent,
+    oldest first. The messages pushed are added to sent
+    """
+    def __init__(self, address, name=None, contacts=(), ports=None,
+                 extra_records=0, photo_size=0, group_messages=True,
+                 sim_contacts=None, calls=(), inbox=()):
+        self.address = address
+        self.name = name if name is not None else 'Phone ' + address
+        self.ports = dict(ports) if ports is not None else {MAP_SERVICE: 16, PBAP_SERVICE: 19}
+        # Other services listed before MAP and PBAP in SDP browses
+        self.extra_records = extra_records
+        self.photo = None
+        if photo_size:
+            self.photo = base64.b64encode(os.urandom(photo_size)).decode('ascii')
+        self.group_messages = group_messages
+        self.sim_contacts = list(sim_contacts) if sim_contacts is not None else None
+        self.calls = list(calls)
+        self.inbox = list(inbox)
+        self.sent = []
+        self.connected = False
+        self.messages = []
+        self.database_id = '{:032x}'.format(zlib.crc32(address.encode('ascii')))
+        self.counter = 0
+        self.set_contacts(contacts)
+
+    @property
+    def path(self):
+        return '/org/bluez/hci0/dev_' + self.address.replace(':', '_')
+
+    def set_contacts(self, contacts):
+        """ Replace the phonebook, the PBAP counter is incremented
+        """
+        self.contacts = list(contacts)
+        self.counter += 1
+
+    def properties(self):
+        """ Return the org.bluez.Device1 properties
+        """
+        return {'Address': GLib.Variant('s', self.address),
+                'Name': GLib.Variant('s', self.name),
+                'Paired': GLib.Variant('b', True),
+                'Connected': GLib.Variant('b', self.connected),
+                }
+
+    def counters(self, folder=None):
+        """ Return the PBAP 1.2 version counters of folder, the main
+        phonebook if None
+        """
+        counter = self.counter
+        if folder is not None and folder != ('int', 'pb'):
+            # Changes with the content of the folder
+            counter = zlib.crc32(''.join(self.folder_vcards(*folder) or ()).encode('utf-8'))
+        return {'DatabaseIdentifier': GLib.Variant('s', self.database_id),
+                'PrimaryCounter': GLib.Variant('s', str(counter)),
+                }
+
+    def sdp_records(self):
+        """ Return the output of sdptool browse --xml on the device
+        """
+        out = ['Browsing {} ...\n'.format(self.address)]
+        for i in range(self.extra_records):
+            out.append(sdp_record('0x{:04x}'.format(0x1101 + i % 16), 1 + i % 30, 0x10000 + i))
+        for i, (service_id, channel) in enumerate(self.ports.items()):
+            out.append(sdp_record(service_id, channel, 0x20000 + i))
+        return ''.join(out)
+
+    def vcard(self, index, fields=None):
+        """ Return the vCard of the entry index, with the photo unless
+        fields, the PBAP Fields filter, excludes it
+        """
+        name, tels = self.contacts[index]
+        photo = self.photo if not fields or 'PHOTO' in fields else None
+        return vcard(name, tels, photo)
+
+    def folder_vcards(self, location, name, fields=None):
+        """ Return the vCards of a phonebook folder, None if there is none
+        """
+        if location == 'int' and name == 'pb':
+            return [self.vcard(i, fields) for i in range(len(self.contacts))]
+        if location == 'sim1' and name == 'pb' and self.sim_contacts is not None:
+            return [vcard(n, tels) for n, tels in self.sim_contacts]
+        kinds = {'ich': ('received',), 'och': ('dialed',), 'mch': ('missed',),
+                 'cch': ('received', 'dialed', 'missed')}
+        if location == 'int' and name in kinds:
+            return [vcard(n, [(number, 'CELL')], calls=[(kind, stamp)])
+                    for n, number, kind, stamp in self.calls if kind in kinds[name]]
+        return None
+
+    def listing(self):
+        """ Return the (handle, name) pairs of the phonebook
+        """
+        return [('{}.vcf'.format(i), name) for i, (name, tels) in enumerate(self.contacts)]
+
+    def receive(self, data):
+        """ Store a pushed bMessage, return False if it is refused
+        """
+        if not self.group_messages and data.count(b'BEGIN:VCARD') > 1:
+            return False
+        self.messages.append(data)
+        originator, recipients, text = parse_bmessage(data.decode('utf-8', 'replace'))
+        stamp = time.strftime('%Y%m%dT%H%M%S')
+        self.sent.extend((number, stamp, text) for number in recipients)
+        return True
+
+    def map_listing(self, folder):
+        """ Return the (handle, properties, bMessage) of the messages of a
+        MAP folder, newest first, None if there is no such folder
+        """
+        if folder == 'inbox':
+            messages, base = self.inbox, 0x1000000
+        elif folder == 'sent':
+            messages, base = self.sent, 0x2000000
+        elif folder in ('outbox', 'draft', 'deleted'):
+            return []
+        else:
+            return None
+        res = []
+        for i, (number, stamp, text) in reversed(list(enumerate(messages))):
+            incoming = folder == 'inbox'
+            props = {'Folder': GLib.Variant('s', '/telecom/msg/' + folder),
+                     'Timestamp': GLib.Variant('s', stamp),
+                     'SenderAddress': GLib.Variant('s', number if incoming else ''),
+                     'RecipientAddress': GLib.Variant('s', '' if incoming else number),
+                     'Type': GLib.Variant('s', 'sms-gsm'),
+                     'Read': GLib.Variant('b', True),
+                     }
+            card = 'BEGIN:VCARD\r\nVERSION:2.1\r\nTEL:{}\r\nEND:VCARD\r\n'
+            data = ('BEGIN:BMSG\r\nVERSION:1.0\r\nSTATUS:READ\r\nTYPE:SMS_GSM\r\n'
+                    'FOLDER:TELECOM/MSG/{}\r\n'.format(folder.upper())
+                    + (card.format(number) if incoming else '')
+                    + 'BEGIN:BENV\r\n' + ('' if incoming else card.format(number))
+                    + 'BEGIN:BBODY\r\nCHARSET:UTF-8\r\nBEGIN:MSG\r\n'
+                    + text.replace('\n', '\r\n')
+                    + '\r\nEND:MSG\r\nEND:BBODY\r\nEND:BENV\r\nEND:BMSG\r\n')
+            res.append(('{:016x}'.format(base + i), props, data))
+        return res
+
+
+class SimulatedSession:
+    """ An OBEX session opened by CreateSession
+    """
+    def __init__(self, path, device, target, channel):
+        self.path = path
+        self.device = device
+        self.target = target
+        self.channel = channel
+        self.folder = None
+        # Files of the PBAP pulls, removed with the session
+        self.files = []
+
+    def properties(self):
+        return {'Destination': GLib.Variant('s', self.device.address),
+                'Target': GLib.Variant('s', self.target),
+                'Channel': GLib.Variant('y', self.channel),
+                }
+
+
+class SimulatedTransfer:
+    """ An OBEX transfer, progressing from the main loop
+
+    data is sent to the device with on_complete(data) for a push, or
+    written to filename for a pull.
+    """
+    def __init__(self, backend, path, session, data, filename=None, on_complete=None):
+        self.backend = backend
+        self.path = path
+        self.session = session
+        self.data = data
+        self.filename = filename
+        self.on_complete = on_complete
+        self.status = 'queued'
+        self.transferred = 0
+        self.step = 1
+
+    def properties(self):
+        props = {'Status': GLib.Variant('s', self.status),
+                 'Size': GLib.Variant('t', len(self.data)),
+                 'Transferred': GLib.Variant('t', self.transferred),
+                 'Session': GLib.Variant('o', self.session.path),
+                 }
+        if self.filename is not None:
+            props['Filename'] = GLib.Variant('s', self.filename)
+        return props
+
+    def start(self):
+        """ Start after the reply to the call creating the transfer
+        """
+        size = len(self.data)
+        duration = size * 1000 // max(self.backend.bandwidth, 1)
+        self.step = max(1, -(-size // PROGRESS_STEPS))
+        GLib.timeout_add(self.backend.latency, self.progress, max(1, duration // PROGRESS_STEPS))
+
+    def progress(self, interval):
+        """ Move the transfer one step forward
+        """
+        if self.status == 'queued':
+            self.status = 'active'
+            self.emit({'Status': GLib.Variant('s', self.status)})
+            GLib.timeout_add(interval, self.progress, interval)
+            return False
+        self.transferred = min(self.transferred + self.step, len(self.data))
+        if self.transferred < len(self.data):
+            self.emit({'Transferred': GLib.Variant('t', self.transferred)})
+            return True
+        self.finish()
+        return False
+
+    def finish(self):
+        ok = not self.backend.fails()
+        if ok and self.on_complete is not None:
+            ok = self.on_complete(self.data)
+        if ok and self.filename is not None:
+            with open(self.filename, 'wb') as f:
+                f.write(self.data)
+        self.status = 'complete' if ok else 'error'
+        # obexd removes the object once finished
+        self.backend.transfers.pop(self.path, None)
+        self.emit({'Status': GLib.Variant('s', self.status),
+                   'Transferred': GLib.Variant('t', self.transferred)})
+
+    def emit(self, changed):
+        self.backend.bus.emit(self.path, PROPERTIES, 'PropertiesChanged',
+                              GLib.Variant('(sa{sv}as)', (TRANSFER_IFACE, changed, [])))
+
+
+class SimulatedResult:
+    """ The result of an asynchronous call, for call_finish()
+    """
+    def __init__(self, value=None, error=None):
+        self.value = value
+        self.error = error
+
+
+class SimulatedBus:
+    """ Stand-in for the Gio.DBusConnection methods used by BTPhone
+
+    Calls are dispatched to the handlers of the backend, replies and
+    signals are delivered from the GLib main loop.
+    """
+    def __init__(self, backend, name):
+        self.backend = backend
+        self.name = name
+        self.subscriptions = {}
+        self.next_id = 1
+
+    def dispatch(self, name, path, iface, method, args):
+        handler = self.backend.handlers.get((self.name, iface, method), None)
+        if name != self.name or handler is None:
+            raise error('org.freedesktop.DBus.Error.UnknownMethod',
+                        'No such method {}.{}'.format(iface, method))
+        self.backend.calls += 1
+        return handler(path, args.unpack() if args is not None else ())
+
+    def call_sync(self, name, path, iface, method, args, reply, flags, timeout, cancellable):
+        time.sleep(self.backend.latency / 1000)
+        return self.dispatch(name, path, iface, method, args)
+
+    def call(self, name, path, iface, method, args, reply, flags, timeout, cancellable,
+             callback, user_data):
+        try:
+            result = SimulatedResult(self.dispatch(name, path, iface, method, args))
+        except GLib.Error as e:
+            result = SimulatedResult(error=e)
+        GLib.timeout_add(self.backend.latency, self.reply, callback, result, user_data)
+
+    def reply(self, callback, result, user_data):
+        callback(self, result, user_data)
+        return False
+
+    def call_finish(self, result):
+        if result.error is not None:
+            raise result.error
+        return result.value
+
+    def signal_subscribe(self, sender, iface, member, path, arg0, flags, callback, user_data):
+        sub_id = self.next_id
+        self.next_id += 1
+        arg0_path = bool(flags & Gio.DBusSignalFlags.MATCH_ARG0_PATH)
+        self.subscriptions[sub_id] = (iface, member, path, arg0, arg0_path, callback, user_data)
+        return sub_id
+
+    def signal_unsubscribe(self, sub_id):
+        self.subscriptions.pop(sub_id, None)
+
+    def emit(self, path, iface, member, params):
+        """ Deliver a signal to the matching subscriptions
+        """
+        first = params.get_child_value(0).unpack() if params.n_children() else None
+        for s_iface, s_member, s_path, arg0, arg0_path, callback, user_data in list(self.subscriptions.values()):
+            if s_iface not in (None, iface) or s_member not in (None, member):
+                continue
+            if s_path not in (None, path):
+                continue
+            if arg0_path:
+                if not str(first).startswith(arg0):
+                    continue
+            elif arg0 not in (None, first):
+                continue
+            callback(self, self.name, path, iface, member, params, user_data)
+
+
+class SimulatedBackend:
+    """ Emulate bluetoothd, obexd and sdptool for a set of devices
+
+    Parameters
+    ----------
+    devices: iterable of SimulatedDevice (default ())
+    The paired devices
+
+    latency: int (default 10)
+    Delay of each D-Bus reply and before each transfer, in ms
+
+    bandwidth: int (default 100000)
+    Transfer speed, in bytes per second
+
+    failure_rate: float (default 0.0)
+    Probability that a session creation or a transfer fails
+
+    sdp_latency: int (default 500)
+    Duration of an SDP browse, in ms
+
+    seed: int or None (default None)
+    Seed of the failures
+    """
+    def __init__(self, devices=(), latency=10, bandwidth=100000, failure_rate=0.0,
+                 sdp_latency=500, seed=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.failure_rate = failure_rate
+        self.sdp_latency = sdp_latency
+        self.random = random.Random(seed)
+        self.devices = {d.address: d for d in devices}
+        self.sessions = {}
+        self.transfers = {}
+        # Message1 properties of the pushed messages, by path
+        self.messages = {}
+        # Session and bMessage of the listed messages, by path
+        self.map_objects = {}
+        self.next_object = 0
+        # Number of D-Bus calls answered
+        self.calls = 0
+        self.bus = SimulatedBus(self, OBEX_NAME)
+        self.sysbus = SimulatedBus(self, BLUEZ_NAME)
+        self.handlers = {
+            (BLUEZ_NAME, OBJECT_MANAGER, 'GetManagedObjects'): self.get_managed_objects,
+            (BLUEZ_NAME, PROPERTIES, 'GetAll'): self.device_get_all,
+            (OBEX_NAME, PROPERTIES, 'Get'): self.obex_get,
+            (OBEX_NAME, PROPERTIES, 'GetAll'): self.obex_get_all,
+            (OBEX_NAME, 'org.bluez.obex.Client1', 'CreateSession'): self.create_session,
+            (OBEX_NAME, 'org.bluez.obex.Client1', 'RemoveSession'): self.remove_session,
+            (OBEX_NAME, 'org.bluez.obex.MessageAccess1', 'PushMessage'): self.push_message,
+            (OBEX_NAME, 'org.bluez.obex.MessageAccess1', 'SetFolder'): self.set_folder,
+            (OBEX_NAME, 'org.bluez.obex.MessageAccess1', 'ListMessages'): self.list_messages,
+            (OBEX_NAME, MESSAGE_IFACE, 'Get'): self.get_message,
+            (OBEX_NAME, PBAP_IFACE, 'Select'): self.select,
+            (OBEX_NAME, PBAP_IFACE, 'PullAll'): self.pull_all,
+            (OBEX_NAME, PBAP_IFACE, 'Pull'): self.pull,
+            (OBEX_NAME, PBAP_IFACE, 'List'): self.list,
+            (OBEX_NAME, PBAP_IFACE, 'GetSize'): self.get_size,
+        }
+
+    def fails(self):
+        """ Draw whether an operation fails
+        """
+        return self.failure_rate > 0 and self.random.random() < self.failure_rate
+
+    def add_device(self, device):
+        """ Pair a device, InterfacesAdded is emitted
+        """
+        self.devices[device.address] = device
+        self.sysbus.emit('/', OBJECT_MANAGER, 'InterfacesAdded',
+                         GLib.Variant('(oa{sa{sv}})', (device.path, {DEVICE_IFACE: device.properties()})))
+
+    def remove_device(self, address):
+        """ Remove a device, InterfacesRemoved is emitted
+        """
+        device = self.devices.pop(address)
+        self.sysbus.emit('/', OBJECT_MANAGER, 'InterfacesRemoved',
+                         GLib.Variant('(oas)', (device.path, [DEVICE_IFACE])))
+
+    def set_connected(self, address, connected=True):
+        """ Change the connection state of a device, PropertiesChanged is
+        emitted
+        """
+        device = self.devices[address]
+        device.connected = connected
+        self.sysbus.emit(device.path, PROPERTIES, 'PropertiesChanged',
+                         GLib.Variant('(sa{sv}as)', (DEVICE_IFACE, {'Connected': GLib.Variant('b', connected)}, [])))
+
+    def browse(self, devad, parser):
+        """ Feed the SDP records of devad to parser, see
+        backend.BlueZBackend.browse()
+        """
+        time.sleep(self.sdp_latency / 1000)
+        return self.feed(devad, parser)
+
+    def browse_async(self, devad, parser):
+        """ Same as browse() without blocking
+        """
+        future = Future()
+
+        def done():
+            future.set_result(self.feed(devad, parser))
+            return False
+        GLib.timeout_add(self.sdp_latency, done)
+        return future
+
+    def feed(self, devad, parser):
+        device = self.devices.get(devad, None)
+        if device is None:
+            return {}
+        for line in device.sdp_records().splitlines(True):
+            if parser.feed(line):
+                break
+        return parser.ports
+
+    def new_path(self, kind):
+        self.next_object += 1
+        return '{}/client/{}{}'.format(OBEX_PATH, kind, self.next_object)
+
+    def session(self, path, target):
+        session = self.sessions.get(path, None)
+        if session is None or session.target != target:
+            raise error('org.freedesktop.DBus.Error.UnknownObject',
+                        'No {} session at {}'.format(target, path))
+        return session
+
+    def new_transfer(self, session, data, filename=None, on_complete=None):
+        transfer = SimulatedTransfer(self, self.new_path('transfer'), session, data,
+                                     filename, on_complete)
+        self.transfers[transfer.path] = transfer
+        transfer.start()
+        return GLib.Variant('(oa{sv})', (transfer.path, transfer.properties()))
+
+    # bluetoothd
+
+    def get_managed_objects(self, path, args):
+        objects = {d.path: {DEVICE_IFACE: d.properties()} for d in self.devices.values()}
+        return GLib.Variant('(a{oa{sa{sv}}})', (objects,))
+
+    def device_get_all(self, path, args):
+        for device in self.devices.values():
+            if device.path == path and args[0] == DEVICE_IFACE:
+                return GLib.Variant('(a{sv})', (device.properties(),))
+        raise error('org.freedesktop.DBus.Error.UnknownObject', path)
+
+    # obexd
+
+    def obex_get(self, path, args):
+        iface, name = args
+        props = self.obex_properties(path, iface)
+        if name not in props:
+            raise error('org.freedesktop.DBus.Error.InvalidArgs', name)
+        return GLib.Variant('(v)', (props[name],))
+
+    def obex_get_all(self, path, args):
+        return GLib.Variant('(a{sv})', (self.obex_properties(path, args[0]),))
+
+    def obex_properties(self, path, iface):
+        if iface == TRANSFER_IFACE and path in self.transfers:
+            return self.transfers[path].properties()
+        if iface == SESSION_IFACE and path in self.sessions:
+            return self.sessions[path].properties()
+        if iface == MESSAGE_IFACE and path in self.messages:
+            return self.messages[path]
+        if iface == PBAP_IFACE:
+            session = self.session(path, 'pbap')
+            return session.device.counters(session.folder)
+        raise error('org.freedesktop.DBus.Error.UnknownObject', path)
+
+    def create_session(self, path, args):
+        dest, options = args
+        device = self.devices.get(dest, None)
+        target = options.get('Target', '').lower()
+        channel = options.get('Channel', None)
+        if device is None or channel != device.ports.get(TARGETS.get(target, None), None) \
+           or self.fails():
+            raise error('org.bluez.obex.Error.Failed', 'Unable to connect')
+        session = SimulatedSession(self.new_path('session'), device, target, channel)
+        self.sessions[session.path] = session
+        return GLib.Variant('(o)', (session.path,))
+
+    def remove_session(self, path, args):
+        session = self.sessions.pop(args[0], None)
+        if session is None:
+            raise error('org.bluez.obex.Error.NotAuthorized', 'Not Authorized')
+        for fn in session.files:
+            if os.path.exists(fn):
+                os.unlink(fn)
+        # The message objects are removed with their session
+        self.map_objects = {m: v for m, v in self.map_objects.items() if v[0] is not session}
+        return GLib.Variant('()', ())
+
+    def push_message(self, path, args):
+        session = self.session(path, 'map')
+        filename, folder, props = args
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            raise error('org.bluez.obex.Error.InvalidArguments', str(e))
+        return self.new_transfer(session, data,
+                                 on_complete=lambda data: self.message_pushed(session, data))
+
+    def message_pushed(self, session, data):
+        """ Store the message on the device, report its status later
+        """
+        if not session.device.receive(data):
+            return False
+        recipient = ''
+        for line in data.decode('utf-8', 'replace').splitlines():
+            if line.startswith('TEL:'):
+                recipient = line[4:]
+                break
+        path = '{}/message{}'.format(session.path, len(session.device.messages))
+        self.messages[path] = {'RecipientAddress': GLib.Variant('s', recipient),
+                               'Folder': GLib.Variant('s', '/telecom/msg/outbox'),
+                               'Status': GLib.Variant('s', 'sending'),
+                               }
+
+        def report():
+            status = 'sending-failure' if self.fails() else 'sending-success'
+            self.messages[path]['Status'] = GLib.Variant('s', status)
+            self.bus.emit(path, PROPERTIES, 'PropertiesChanged',
+                          GLib.Variant('(sa{sv}as)', (MESSAGE_IFACE, {'Status': GLib.Variant('s', status)}, [])))
+            return False
+        GLib.timeout_add(self.latency, report)
+        return True
+
+    def set_folder(self, path, args):
+        session = self.session(path, 'map')
+        if args[0].strip('/') != 'telecom/msg':
+            raise error('org.bluez.obex.Error.Failed', 'Not Found')
+        session.folder = args[0]
+        return GLib.Variant('()', ())
+
+    def list_messages(self, path, args):
+        session = self.session(path, 'map')
+        folder, filters = args
+        listing = session.device.map_listing(folder)
+        if listing is None or session.folder is None:
+            raise error('org.bluez.obex.Error.Failed', 'Not Found')
+        offset = filters.get('Offset', 0)
+        listing = listing[offset:offset + filters.get('MaxCount', 1024)]
+        objects = []
+        for handle, props, data in listing:
+            message = '{}/message{}'.format(session.path, handle)
+            self.map_objects[message] = (session, data)
+            objects.append((message, props))
+        return GLib.Variant('(a{oa{sv}})', (dict(objects),))
+
+    def get_message(self, path, args):
+        if path not in self.map_objects:
+            raise error('org.freedesktop.DBus.Error.UnknownObject', path)
+        session, data = self.map_objects[path]
+        return self.pull_file(session, args[0], data.encode('utf-8'))
+
+    def select(self, path, args):
+        session = self.session(path, 'pbap')
+        if session.device.folder_vcards(*args) is None:
+            raise error('org.bluez.obex.Error.Failed', 'Not Found')
+        session.folder = tuple(args)
+        return GLib.Variant('()', ())
+
+    def pull_file(self, session, target, data):
+        if not target:
+            fd, target = tempfile.mkstemp(prefix='textoter-sim-', suffix='.vcf')
+            os.close(fd)
+            session.files.append(target)
+        return self.new_transfer(session, data, filename=target)
+
+    def pull_all(self, path, args):
+        session = self.session(path, 'pbap')
+        folder = session.folder if session.folder is not None else ('int', 'pb')
+        filters = args[1]
+        vcards = session.device.folder_vcards(*folder, fields=filters.get('Fields', None))
+        offset = filters.get('Offset', 0)
+        vcards = vcards[offset:offset + filters.get('MaxCount', 65535)]
+        data = ''.join(vcards)
+        return self.pull_file(session, args[0], data.encode('utf-8'))
+
+    def pull(self, path, args):
+        session = self.session(path, 'pbap')
+        handle, target, filters = args
+        try:
+            index = int(handle.split('.')[0])
+            data = session.device.vcard(index, filters.get('Fields', None))
+        except (ValueError, IndexError):
+            raise error('org.bluez.obex.Error.Failed', 'Not Found')
+        return self.pull_file(session, target, data.encode('utf-8'))
+
+    def list(self, path, args):
+        return GLib.Variant('(a(ss))', (self.session(path, 'pbap').device.listing(),))
+
+    def get_size(self, path, args):
+        return GLib.Variant('(q)', (len(self.session(path, 'pbap').device.contacts),))
@@ -0,0 +1,146 @@
+# template.py: Precompiled bMessage templates for mail-merge sends
+# Copyright (C) 2018 - 2021 Arnaud Gardelein <arnaud@oscopy.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+""" Message templates compiled once and rendered for each recipient
+
+The text uses str.format() fields:
+
+    t = MessageTemplate('Hello {name}, your appointment is at {time}')
+    m = t.render('+33612345678', {'name': 'Jean', 'time': '10:00'})
+
+The bMessage envelope and the literal parts of the text are encoded once,
+rendering only encodes the number and the field values, and computes the
+LENGTH of the body in bytes.
+"""
+
+from string import Formatter
+
+ENCODING = 'utf-8'
+
+# Layout of the bMessage built by prepare_message() and MessageTemplate
+HEADER = 'BEGIN:BMSG\r\nVERSION:1.0\r\nSTATUS:READ\r\nTYPE:MMS\r\nFOLDER:null\r\nBEGIN:BENV\r\n'
+VCARD_START = 'BEGIN:VCARD\r\nVERSION:2.1\r\nN:null;;;;\r\nTEL:'
+VCARD_END = '\r\nEND:VCARD\r\n'
+LENGTH = 'BEGIN:BBODY\r\nLENGTH:'
+MSG_START = '\r\nBEGIN:MSG\r\n'
+MSG_END = '\r\nEND:MSG\r\n'
+FOOTER = 'END:BENV\r\nEND:BMSG\r\n'
+
+
+def crlf(s):
+    """ Use CRLF line endings as required in bMessage
+    """
+    return s.replace('\r\n', '\n').replace('\n', '\r\n')
+
+
+def prepare_message(num, t):
+    """ Prepare a message as bMessage format, see BTPhone.prepare_message()
+    """
+    return prepare_group_message([num], t)
+
+
+def prepare_group_message(nums, t):
+    """ Prepare a message to several recipients as bMessage format, see
+    BTPhone.prepare_group_message()
+    """
+    my_msg = 'BEGIN:MSG\r\n' + crlf(t) + MSG_END
+    # LENGTH is in bytes
+    return ''.join([HEADER]
+                   + [VCARD_START + num + VCARD_END for num in nums]
+                   + [LENGTH, str(len(my_msg.encode(ENCODING))), '\r\n', my_msg, FOOTER])
+
+
+class MessageTemplate:
+    """ A bMessage with variable recipient and text fields
+
+    Attributes
+    ----------
+    parts: list of bytes or str
+    The text, literal parts are encoded bytes, fields are their names
+
+    fields: list of str
+    The names of the fields used by the text
+    """
+    header = (HEADER + VCARD_START).encode(ENCODING)
+    after_num = (VCARD_END + LENGTH).encode(ENCODING)
+    msg_start = MSG_START.encode(ENCODING)
+    trailer = (MSG_END + FOOTER).encode(ENCODING)
+    # BEGIN:MSG and END:MSG lines are counted in LENGTH
+    overhead = len(('BEGIN:MSG\r\n' + MSG_END).encode(ENCODING))
+
+    def __init__(self, text):
+        self.parts = []
+        self.fields = []
+        for literal, field, spec, conversion in Formatter().parse(text):
+            if literal:
+                self.parts.append(crlf(literal).encode(ENCODING))
+            if field is not None:
+                if spec or conversion:
+                    raise ValueError('Format specifications are not supported: {{{}}}'.format(field))
+                self.parts.append(field)
+                self.fields.append(field)
+
+    def render_text(self, values):
+        """ Return the encoded text with the fields replaced by values
+
+        Parameters
+        ----------
+        values: dict of str:object
+        The value of each field
+
+        Returns
+        -------
+        list of bytes
+        The encoded pieces of the text
+        """
+        return [p if isinstance(p, bytes) else crlf(str(values[p])).encode(ENCODING)
+                for p in self.parts]
+
+    def render(self, num, values=None):
+        """ Render the bMessage for one recipient
+
+        Parameters
+        ----------
+        num: str
+        The destination phone number
+
+        values: dict of str:object or None (default None)
+        The value of each field
+
+        Returns
+        -------
+        bytes
+        The message in bMessage format
+        """
+        text = self.render_text(values or {})
+        length = self.overhead + sum(len(p) for p in text)
+        return b''.join([self.header, num.encode(ENCODING), self.after_num,
+                         str(length).encode('ascii'), self.msg_start]
+                        + text + [self.trailer])
+
+    def render_many(self, rows):
+        """ Render the messages of several recipients
+
+        Parameters
+        ----------
+        rows: iterable of (str, dict) tuples
+        The number and field values of each recipient
+
+        Yields
+        ------
+        (str, bytes) tuples
+        The number and the rendered message
+        """
+        for num, values in rows:
+            yield num, self.render(num, values)
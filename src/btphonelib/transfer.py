@@ -0,0 +1,243 @@
+# transfer.py: Track OBEX transfers from DBus signals
+# Copyright (C) 2018 - 2021 Arnaud Gardelein <arnaud@oscopy.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+from gi.repository import GLib
+from gi.repository import Gio
+from concurrent.futures import Future
+from collections import OrderedDict
+import time
+
+TRANSFER_IFACE = 'org.bluez.obex.Transfer1'
+FINAL_STATUS = ('complete', 'error')
+# Number of final statuses kept for transfers not tracked yet
+FINISHED_SIZE = 64
+
+
+class Transfer:
+    """ The state of one OBEX transfer
+
+    Attributes
+    ----------
+    path: str
+    The DBus path of the transfer
+
+    status: str
+    The Transfer1 Status: queued, active, suspended, complete or error
+
+    size: int or None
+    The size of the transfer in bytes, when known
+
+    transferred: int
+    The number of bytes transferred so far
+
+    future: Future
+    Resolved with the final status, complete or error, or None when the
+    transfer vanished before its final status could be read
+
+    started, finished: float or None
+    time.monotonic() when tracking started and ended
+    """
+    def __init__(self, path, status='queued', size=None, progress_cb=None):
+        self.path = path
+        self.status = status
+        self.size = size
+        self.transferred = 0
+        self.progress_cb = progress_cb
+        self.future = Future()
+        self.started = time.monotonic()
+        self.finished = None
+
+    def update(self, props):
+        """ Update the state from Transfer1 properties
+
+        Parameters
+        ----------
+        props: dict
+        The changed properties
+
+        Returns
+        -------
+        bool
+        True when the transfer reached its final status
+        """
+        if 'Size' in props:
+            self.size = props['Size']
+        if 'Transferred' in props:
+            self.transferred = props['Transferred']
+            if self.progress_cb is not None:
+                self.progress_cb(self.transferred, self.size)
+        if 'Status' in props:
+            self.status = props['Status']
+        if self.status in FINAL_STATUS:
+            self.finish(self.status)
+            return True
+        return False
+
+    def finish(self, status):
+        """ Resolve the future with status, once
+        """
+        if self.future.done():
+            return
+        self.finished = time.monotonic()
+        self.future.set_result(status)
+
+
+class TransferTracker:
+    """ Follow every OBEX transfer with a single PropertiesChanged
+    subscription
+
+    Transfers are registered with track() and resolved when the signal
+    carries a final Status, so no polling is needed and any number of
+    transfers can run concurrently.
+    """
+    def __init__(self, phone):
+        self.phone = phone
+        self.transfers = {}
+        # Transfers which finished before being tracked
+        self.finished = OrderedDict()
+        self.sub_id = phone.bus.signal_subscribe(phone.bus_name,  # sender
+                                                 'org.freedesktop.DBus.Properties',
+                                                 'PropertiesChanged',
+                                                 None,  # any object path
+                                                 TRANSFER_IFACE,  # arg0
+                                                 Gio.DBusSignalFlags.NONE,
+                                                 self.properties_changed,
+                                                 None,  # user data
+                                                 )
+
+    def track(self, path, status='queued', size=None, progress_cb=None):
+        """ Start tracking the transfer on path
+
+        As the transfer may have progressed before the registration, its
+        properties are read once.
+
+        Parameters
+        ----------
+        path: str
+        The path to the transfer
+
+        status: str (default 'queued')
+        The status returned when the transfer was created
+
+        size: int or None (default None)
+        The size returned when the transfer was created
+
+        progress_cb: callable(int, int or None) or None (default None)
+        Called with transferred bytes and size on progress
+
+        Returns
+        -------
+        Transfer
+        The tracked transfer, its future is resolved on completion
+        """
+        path = str(path)
+        transfer = Transfer(path, status, size, progress_cb)
+        transfer.future.add_done_callback(lambda f: self.phone.metrics.record_transfer(transfer))
+        status = self.finished.pop(path, status)
+        if status in FINAL_STATUS:
+            transfer.finish(status)
+            return transfer
+        self.transfers[path] = transfer
+        transfer.future.add_done_callback(lambda f: self.transfers.pop(path, None))
+
+        args = GLib.Variant('(s)', (TRANSFER_IFACE,))
+        future = self.phone.bus_call('org.freedesktop.DBus.Properties',
+                                     'GetAll',
+                                     args=args, path=path,
+                                     reply=GLib.VariantType('(a{sv})'))
+        future.add_done_callback(lambda f: self.initial_properties(transfer, f))
+        return transfer
+
+    def initial_properties(self, transfer, future):
+        """ Apply the properties read after registration
+        """
+        res = future.result()
+        if res is None:
+            # Transfer object already removed by obexd
+            transfer.finish(None)
+        else:
+            transfer.update(res[0])
+
+    def properties_changed(self, bus, name, path, iface, signal_name, args, user_args):
+        """ Dispatch Transfer1 property changes to the relevant transfer
+
+        Parameters
+        ----------
+        bus: Gio.DBusConnection
+        The bus the signal was received on
+
+        name: str
+        The sender name
+
+        path: str
+        The path of the transfer
+
+        iface: str
+        org.freedesktop.DBus.Properties
+
+        signal_name: str
+        PropertiesChanged
+
+        args: GLib.Variant
+        The interface, changed and invalidated properties
+
+        user_args:
+        Not used
+        """
+        transfer = self.transfers.get(path, None)
+        if transfer is None:
+            # The signal may arrive before track() is called
+            status = args[1].get('Status', None)
+            if status in FINAL_STATUS:
+                self.finished[path] = status
+                if len(self.finished) > FINISHED_SIZE:
+                    self.finished.popitem(last=False)
+            return
+        transfer.update(args[1])
+
+    def wait(self, transfer):
+        """ Block until transfer is finished, while dispatching the main
+        loop events
+
+        For scripts without a main loop only. Called from a main loop
+        callback, such as a GTK handler, the other callbacks would run
+        inside it, so the Future of the transfer must be used instead.
+
+        Parameters
+        ----------
+        transfer: Transfer
+        The transfer returned by track()
+
+        Returns
+        -------
+        str or None
+        The final status
+
+        Raises
+        ------
+        RuntimeError
+        When called while the main loop dispatches a callback
+        """
+        if GLib.main_depth() > 0:
+            raise RuntimeError('TransferTracker.wait() called from the main loop, '
+                               'use transfer.future')
+        context = GLib.MainContext.default()
+        while not transfer.future.done():
+            context.iteration(True)
+        return transfer.future.result()
+
+    def close(self):
+        """ Unsubscribe from the signal
+        """
+        self.phone.bus.signal_unsubscribe(self.sub_id)
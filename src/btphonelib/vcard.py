@@ -0,0 +1,322 @@
+# vcard.py: Streaming parser for phonebooks pulled from the phone
+# Copyright (C) 2018 - 2021 Arnaud Gardelein <arnaud@oscopy.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+""" Streaming vCard parser
+
+The phonebook file is read line by line through a large buffer. Only the
+properties textoter uses (FN, N, TEL, and X-IRMC-CALL-DATETIME in the call
+history) are decoded, the others, and
+especially the base64 blocks of PHOTO or LOGO, are skipped without being
+kept in memory. Each card is yielded as a compact Contact record.
+
+Cards that cannot be understood are read again from the file and parsed
+by vobject.
+"""
+
+from collections import namedtuple
+import quopri
+
+BUFSIZE = 1 << 16
+
+# Properties decoded, all the others are skipped
+KEPT = (b'BEGIN', b'END', b'FN', b'N', b'TEL', b'X-IRMC-CALL-DATETIME')
+
+# Parameters that are not a phone number type
+NOT_TYPES = ('PREF', 'VOICE', 'X-INTERNET')
+
+Contact = namedtuple('Contact', ['fn', 'tels', 'calls'], defaults=[()])
+Contact.__doc__ = """ A contact from the phonebook
+
+fn: str
+The formatted name
+
+tels: list of (str, str) tuples
+The phone numbers with their type ('cell', 'home'...), type may be ''
+
+calls: list of (str, str, str) tuples
+The calls of the call history cards: direction ('dialed', 'received',
+'missed' or ''), X-IRMC-CALL-DATETIME value and number called, the first
+TEL of the card
+"""
+
+
+class MalformedCard(Exception):
+    """ Raised when a card cannot be parsed by the streaming parser
+    """
+    pass
+
+
+def unescape(value):
+    """ Remove vCard 3.0 escapes from a text value
+    """
+    if '\\' not in value:
+        return value
+    return value.replace('\\n', '\n').replace('\\N', '\n')\
+                .replace('\\,', ',').replace('\\;', ';').replace('\\\\', '\\')
+
+
+def decode_property(line):
+    """ Split a logical line in name, parameters and decoded value
+
+    Parameters
+    ----------
+    line: bytes
+    The unfolded content line
+
+    Returns
+    -------
+    name: bytes
+    The property name, upper case, without group
+
+    params: list of str
+    The parameters, upper case
+
+    value: str
+    The decoded value
+    """
+    colon = line.find(b':')
+    if colon < 0:
+        raise MalformedCard(line)
+    head = line[:colon].split(b';')
+    name = head[0].upper()
+    if b'.' in name:
+        # Remove group
+        name = name.rsplit(b'.', 1)[1]
+    params = [p.decode('ascii', 'replace').upper() for p in head[1:]]
+    value = line[colon + 1:]
+    charset = 'utf-8'
+    for p in params:
+        if p == 'QUOTED-PRINTABLE' or p == 'ENCODING=QUOTED-PRINTABLE':
+            value = quopri.decodestring(value)
+        elif p.startswith('CHARSET='):
+            charset = p[8:]
+    try:
+        value = value.decode(charset, 'replace')
+    except LookupError:
+        value = value.decode('utf-8', 'replace')
+    return name, params, value
+
+
+def call_type(params):
+    """ Return the direction from X-IRMC-CALL-DATETIME parameters
+    """
+    for p in params:
+        if p.startswith('TYPE='):
+            p = p[5:]
+        if p in ('DIALED', 'RECEIVED', 'MISSED'):
+            return p.lower()
+    return ''
+
+
+def tel_type(params):
+    """ Return the first meaningful type from TEL parameters
+    """
+    for p in params:
+        if p.startswith('TYPE='):
+            p = p[5:]
+        for t in p.split(','):
+            if t and '=' not in t and t not in NOT_TYPES:
+                return t.lower()
+    return ''
+
+
+def call_numbers(calls, tels):
+    """ Return the (direction, datetime) calls of a card with the number
+    called, the first of tels
+    """
+    number = tels[0][0] if tels else ''
+    return [(kind, stamp, number) for kind, stamp in calls]
+
+
+class CardBuilder:
+    """ Collect the properties of one card
+    """
+    def __init__(self, start):
+        self.start = start
+        self.fn = None
+        self.n = None
+        self.tels = []
+        self.calls = []
+
+    def add(self, line):
+        """ Decode one logical line
+        """
+        name, params, value = decode_property(line)
+        if name == b'FN':
+            self.fn = unescape(value.strip())
+        elif name == b'N':
+            parts = [unescape(x.strip()) for x in value.split(';')]
+            self.n = ' '.join(x for x in (parts[1:2] + parts[0:1]) if x)
+        elif name == b'TEL':
+            number = value.strip()
+            if number:
+                self.tels.append((number, tel_type(params)))
+        elif name == b'X-IRMC-CALL-DATETIME':
+            self.calls.append((call_type(params), value.strip()))
+
+    def contact(self):
+        """ Return the Contact record
+        """
+        fn = self.fn or self.n
+        if not fn and self.tels:
+            fn = self.tels[0][0]
+        return Contact(fn or '', self.tels, call_numbers(self.calls, self.tels))
+
+
+def from_vobject(data):
+    """ Parse one card with vobject, return the Contact record
+
+    Parameters
+    ----------
+    data: str
+    The card
+
+    Returns
+    -------
+    Contact or None
+    The contact, None if vobject could not parse it either
+    """
+    import vobject
+    try:
+        vcard = vobject.readOne(data)
+    except Exception as e:
+        print('Unable to parse vcard:', e)
+        return None
+    tels = []
+    for tel in vcard.contents.get('tel', []):
+        types = tel.params.get('TYPE', [])
+        tels.append((tel.value, tel_type([t.upper() for t in types])))
+    calls = []
+    for call in vcard.contents.get('x-irmc-call-datetime', []):
+        params = [k.upper() for k in call.params] + \
+                 [v.upper() for values in call.params.values() for v in values]
+        calls.append((call_type(params), call.value.strip()))
+    fn = vcard.fn.value if 'fn' in vcard.contents else ''
+    return Contact(fn, tels, call_numbers(calls, tels))
+
+
+def iter_contacts(fn, bufsize=BUFSIZE):
+    """ Parse the vcards file, yielding one Contact per card
+
+    Parameters
+    ----------
+    fn: str
+    The file name of the phonebook transfer
+
+    bufsize: int (default BUFSIZE)
+    The size of the read buffer
+
+    Yields
+    ------
+    Contact
+    The contacts, in file order
+    """
+    with open(fn, 'rb', buffering=bufsize) as f:
+        offset = 0
+        card = None
+        malformed = False
+        pieces = None       # Logical line being unfolded, None if skipped
+        skipping = False    # In a skipped property
+        qp = False          # Current property is quoted-printable
+        soft_break = False  # Quoted-printable soft line break
+        while True:
+            raw = f.readline()
+            if not raw:
+                break
+            line_start = offset
+            offset += len(raw)
+            line = raw.rstrip(b'\r\n')
+
+            # Continuation of the previous property
+            if line[:1] in (b' ', b'\t') or soft_break or \
+               (skipping and b':' not in line):
+                if pieces is not None:
+                    if soft_break:
+                        # Remove the trailing '='
+                        pieces[-1] = pieces[-1][:-1]
+                        pieces.append(line)
+                    else:
+                        pieces.append(line[1:])
+                soft_break = qp and line.endswith(b'=')
+                continue
+            if not line:
+                continue
+
+            # A new property starts, process the previous one
+            if pieces is not None and card is not None and not malformed:
+                try:
+                    card.add(b''.join(pieces))
+                except MalformedCard:
+                    malformed = True
+            pieces = None
+            skipping = False
+            qp = is_qp(line)
+            soft_break = qp and line.endswith(b'=')
+
+            name = property_name(line)
+            if name == b'BEGIN':
+                card = CardBuilder(line_start)
+                malformed = False
+            elif name == b'END':
+                if card is None:
+                    continue
+                if malformed:
+                    contact = reparse(f, card.start, offset)
+                else:
+                    contact = card.contact()
+                card = None
+                if contact is not None:
+                    yield contact
+            elif name in KEPT:
+                pieces = [line]
+            elif name is None:
+                malformed = True
+            else:
+                skipping = True
+
+
+def property_name(line):
+    """ Return the upper case property name of a content line, without
+    group, None if the line is not a property
+    """
+    end = len(line)
+    for sep in (b':', b';'):
+        i = line.find(sep)
+        if 0 <= i < end:
+            end = i
+    if end == len(line):
+        return None
+    name = line[:end].upper()
+    if b'.' in name:
+        name = name.rsplit(b'.', 1)[1]
+    return name
+
+
+def is_qp(line):
+    """ Whether the property on line is quoted-printable encoded
+    """
+    colon = line.find(b':')
+    if colon < 0:
+        return False
+    return b'QUOTED-PRINTABLE' in line[:colon].upper()
+
+
+def reparse(f, start, end):
+    """ Read back the card between start and end and parse it with vobject
+    """
+    pos = f.tell()
+    f.seek(start)
+    data = f.read(end - start)
+    f.seek(pos)
+    return from_vobject(data.decode('utf-8', 'replace'))
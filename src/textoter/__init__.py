@@ -1 +1,9 @@
-from .textoter import main
+# Do not import the GTK application here, textoter.send must start
+# without loading Gtk
+
+
+def main():
+    from .startup import timer
+    from .textoter import main
+    timer.mark('imports')
+    main()
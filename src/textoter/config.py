@@ -0,0 +1,132 @@
+# config.py: Location and layout of the Textoter configuration file
+# Copyright (C) 2018 - 2021 Arnaud Gardelein <arnaud@oscopy.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+# Shared by the GTK application and the command line sender, so it must
+# not import Gtk.
+
+import os
+from xdg import BaseDirectory
+from btphonelib.ports import MAP_SERVICE
+
+SECTION = 'Textoter'
+HISTORY_LIST = 'numbers'
+DEVICE = 'device'
+# PBAP phonebooks read with the main one, 'location/name' separated by ';'
+FOLDERS = 'folders'
+# Country whose dialing rules apply to the numbers, 'FR' for instance,
+# the one of the locale when empty
+REGION = 'region'
+# Name of the device, in its section
+NAME = 'name'
+
+
+def config_file():
+    """ Return the path to the configuration file, create its directory
+    """
+    path = BaseDirectory.save_config_path('textoter')
+    return os.path.join(path, 'textoter')
+
+
+def data_dir():
+    """ Return the directory of the data files, create it
+    """
+    return BaseDirectory.save_data_path('textoter')
+
+
+# The MAP port keeps the historical 'port' key, the other services are
+# stored as 'port_<service id>'
+PORT = 'port'
+
+
+def ports_from_config(config):
+    """ Read the ports of the device sections
+
+    Parameters
+    ----------
+    config: configparser.RawConfigParser
+    The configuration
+
+    Returns
+    -------
+    dict of (str, str):int
+    The port of each (device address, service ID)
+    """
+    ports = {}
+    for s in config.sections():
+        if s == SECTION:
+            continue
+        for key, value in config.items(s):
+            if key == PORT:
+                service_id = MAP_SERVICE
+            elif key.startswith(PORT + '_'):
+                service_id = key[len(PORT) + 1:]
+            else:
+                continue
+            try:
+                ports[(s, service_id)] = int(value)
+            except ValueError:
+                continue
+    return ports
+
+
+def devices_from_config(config):
+    """ Read the names of the devices seen before
+
+    Returns
+    -------
+    dict of str:str
+    The name of each device address
+    """
+    return {s: config.get(s, NAME) for s in config.sections()
+            if s != SECTION and config.has_option(s, NAME)}
+
+
+def devices_to_config(devices, config):
+    """ Write the device names in the device sections
+
+    Parameters
+    ----------
+    devices: dict of str:str
+    The name of each device address
+    """
+    for dev, name in devices.items():
+        if name is None:
+            continue
+        if not config.has_section(dev):
+            config.add_section(dev)
+        config.set(dev, NAME, name)
+
+
+def ports_to_config(ports, config):
+    """ Write the ports in the device sections, replacing the previous ones
+
+    Parameters
+    ----------
+    ports: dict of (str, str):int
+    The port of each (device address, service ID)
+
+    config: configparser.RawConfigParser
+    The configuration
+    """
+    for s in config.sections():
+        if s == SECTION:
+            continue
+        for key in list(config.options(s)):
+            if key == PORT or key.startswith(PORT + '_'):
+                config.remove_option(s, key)
+    for (dev, service_id), port in ports.items():
+        if not config.has_section(dev):
+            config.add_section(dev)
+        key = PORT if service_id == MAP_SERVICE else '{}_{}'.format(PORT, service_id)
+        config.set(dev, key, str(port))
@@ -0,0 +1,121 @@
+# conversation.py: Messages exchanged with one number
+# Copyright (C) 2018 - 2021 Arnaud Gardelein <arnaud@oscopy.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk
+from gi.repository import Pango
+from btphonelib import canonical
+
+# Columns of the message list
+TIME, BODY, XALIGN = range(3)
+
+
+def format_timestamp(stamp):
+    """ Return 2021-03-20 10:00 for the MAP timestamp 20210320T100000
+    """
+    if len(stamp) < 13 or stamp[8] != 'T':
+        return stamp
+    return '{}-{}-{} {}:{}'.format(stamp[0:4], stamp[4:6], stamp[6:8],
+                                   stamp[9:11], stamp[11:13])
+
+
+class ConversationWindow(Gtk.Window):
+    """ Show the conversation with number from the local message store
+
+    The stored messages are shown at once, the ones read from the phone
+    afterwards are added as they arrive. Typing in the search entry
+    searches all the conversations of the device.
+    """
+    def __init__(self, parent, store, devad, number, title):
+        Gtk.Window.__init__(self, title=title, transient_for=parent)
+        self.set_default_size(350, 450)
+        self.store = store
+        self.devad = devad
+        self.number = canonical(number)
+
+        box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=4)
+        self.search_entry = Gtk.SearchEntry()
+        self.search_entry.connect('search-changed', self.search_changed)
+        box.pack_start(self.search_entry, False, True, 0)
+
+        self.list_store = Gtk.ListStore(str, str, float)
+        view = Gtk.TreeView(model=self.list_store, headers_visible=False)
+        r = Gtk.CellRendererText(style=Pango.Style.ITALIC, scale=0.8)
+        view.append_column(Gtk.TreeViewColumn('Time', r, text=TIME, xalign=XALIGN))
+        r = Gtk.CellRendererText(wrap_mode=Pango.WrapMode.WORD_CHAR, wrap_width=250)
+        view.append_column(Gtk.TreeViewColumn('Message', r, text=BODY, xalign=XALIGN))
+        self.view = view
+        sw = Gtk.ScrolledWindow()
+        sw.add(view)
+        box.pack_start(sw, True, True, 0)
+
+        self.status = Gtk.Label(label='Reading new messages...', xalign=0.0)
+        box.pack_start(self.status, False, True, 2)
+        self.add(box)
+        # The sync may end after the window is closed
+        self.closed = False
+        self.connect('destroy', self.destroyed)
+        self.show_conversation()
+
+    def destroyed(self, win):
+        self.closed = True
+
+    def show_messages(self, messages):
+        """ Replace the content of the list by messages
+        """
+        self.list_store.clear()
+        for message in messages:
+            self.append(message)
+
+    def append(self, message):
+        # Received messages on the left, sent ones on the right
+        self.list_store.append([format_timestamp(message.timestamp), message.body,
+                                0.0 if message.incoming else 1.0])
+
+    def show_conversation(self):
+        """ Show the messages exchanged with number, scroll to the last one
+        """
+        self.show_messages(self.store.conversation(self.devad, self.number))
+        n = len(self.list_store)
+        if n:
+            self.view.scroll_to_cell(Gtk.TreePath(n - 1), None, False, 0, 0)
+
+    def search_changed(self, entry):
+        """ Show the messages matching the search, or the conversation
+        """
+        text = entry.get_text()
+        if not text.strip():
+            self.show_conversation()
+            return
+        self.show_messages(self.store.search(text, self.devad))
+
+    def message_added(self, message):
+        """ Show a message read from the phone if it is in the conversation
+        """
+        if self.closed:
+            return
+        if message.peer == self.number and not self.search_entry.get_text().strip():
+            # Messages may arrive out of order, read them back sorted
+            self.show_conversation()
+
+    def synced(self, added):
+        """ Show the outcome of BTPhone.sync_messages_async()
+        """
+        if self.closed:
+            return
+        if added is None:
+            self.status.set_text('No connection with phone')
+        else:
+            self.status.set_text('{} new messages'.format(added))
@@ -0,0 +1,155 @@
+# send.py: Send a SMS from the command line, without the GTK interface
+# Copyright (C) 2018 - 2021 Arnaud Gardelein <arnaud@oscopy.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+""" textoter-send: send a SMS using the phone configured in Textoter
+
+    textoter-send [-d DEVICE] [-p PORT] NUMBER [TEXT ...]
+
+When TEXT is not given, the message is read from stdin. The device and
+its port default to the ones saved by Textoter.
+
+Only Gio and GLib are loaded, no Gtk.
+"""
+
+import os
+import sys
+import configparser
+from . import config
+
+
+def parse_args(argv):
+    """ Parse the command line arguments
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog='textoter-send',
+                                     description='Send a SMS using a phone connected with Bluetooth')
+    parser.add_argument('-d', '--device',
+                        help='Bluetooth address of the phone, the last one used by Textoter by default')
+    parser.add_argument('-p', '--port', type=int,
+                        help='RFCOMM channel of the MAP service, scanned if unknown')
+    parser.add_argument('number', help='The recipient phone number')
+    parser.add_argument('text', nargs='*',
+                        help='The message, read from stdin if not given')
+    return parser.parse_args(argv)
+
+
+def read_config(fn):
+    """ Read the device and ports saved by Textoter
+
+    Returns
+    -------
+    cfg: configparser.RawConfigParser
+    The configuration
+
+    device: str
+    The last device used, '' if none
+
+    ports: dict of (str, str):int
+    The known port of each (device, service ID)
+
+    region: str
+    The region of the dialing rules, '' for the one of the locale
+    """
+    cfg = configparser.RawConfigParser()
+    cfg.read(fn)
+    device = ''
+    region = ''
+    if cfg.has_section(config.SECTION):
+        device = cfg.get(config.SECTION, config.DEVICE, fallback='').strip()
+        region = cfg.get(config.SECTION, config.REGION, fallback='').strip()
+    return cfg, device, config.ports_from_config(cfg), region
+
+
+def send(bt, devad, filename):
+    """ Generator sending the message file, to be run with run_task()
+
+    Returns
+    -------
+    bool
+    False if the phone could not be reached
+
+    status: str or None
+    The final transfer status
+    """
+    session = yield bt.create_session_async(devad)
+    if session is None:
+        return False, None
+    try:
+        transfer = yield bt.push_file_async(filename, session)
+        if transfer is None:
+            return True, 'error'
+        # Keep the session until obexd has read the file
+        status = yield transfer.future
+    finally:
+        yield bt.remove_session_async(session)
+    return True, status
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    from btphonelib.numbers import canonical, is_number, set_default_region
+    if not is_number(args.number):
+        print('textoter-send: invalid number {!r}'.format(args.number), file=sys.stderr)
+        return 2
+    text = ' '.join(args.text) if args.text else sys.stdin.read()
+    if not text.strip():
+        print('textoter-send: empty message', file=sys.stderr)
+        return 2
+
+    fn = config.config_file()
+    cfg, devad, ports, region = read_config(fn)
+    devad = args.device or devad
+    if not devad:
+        print('textoter-send: no device, use --device', file=sys.stderr)
+        return 2
+
+    from gi.repository import GLib
+    from btphonelib.btphone import BTPhone
+    from btphonelib.gasync import run_task
+    if region:
+        set_default_region(region)
+    # Same number as the one Textoter would send to
+    number = canonical(args.number)
+    bt = BTPhone()
+    bt.ports.update(ports)
+    if args.port is not None:
+        bt.ports.set(devad, config.MAP_SERVICE, args.port)
+    filename = bt.write_message(bt.prepare_message(number, text))
+    future = run_task(send(bt, devad, filename))
+    loop = GLib.MainLoop()
+    future.add_done_callback(lambda f: loop.quit())
+    loop.run()
+    os.unlink(filename)
+    connected, status = future.result()
+
+    if dict(bt.ports.items()) != ports:
+        # Save the ports found for the next time
+        config.ports_to_config(dict(bt.ports.items()), cfg)
+        with open(fn, 'w') as f:
+            cfg.write(f)
+    if not connected:
+        print('textoter-send: unable to connect to {}'.format(devad), file=sys.stderr)
+        return 1
+    if status == 'error':
+        print('textoter-send: message to {} failed'.format(number), file=sys.stderr)
+        return 1
+    return 0
+
+
+def run():
+    sys.exit(main())
+
+
+if __name__ == '__main__':
+    run()
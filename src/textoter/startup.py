@@ -0,0 +1,67 @@
+# startup.py: Measure the startup phases of the GTK application
+# Copyright (C) 2018 - 2021 Arnaud Gardelein <arnaud@oscopy.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+""" Startup time report
+
+Run textoter with TEXTOTER_STARTUP_TIMING=1 to print the duration of each
+startup phase on stderr, once the phone is connected:
+
+    imports          85.2 ms   85.2 ms
+    config            1.3 ms   86.5 ms
+    ...
+"""
+
+import os
+import sys
+import time
+
+STARTUP_ENV = 'TEXTOTER_STARTUP_TIMING'
+
+
+class StartupTimer:
+    """ Record the end time of each startup phase
+
+    Attributes
+    ----------
+    phases: list of (str, float)
+    The name and time.perf_counter() at the end of each phase
+    """
+    def __init__(self):
+        self.enabled = bool(os.environ.get(STARTUP_ENV))
+        self.start = time.perf_counter()
+        self.phases = []
+        self.reported = False
+
+    def mark(self, phase):
+        """ Record the end of phase
+        """
+        if self.enabled:
+            self.phases.append((phase, time.perf_counter()))
+
+    def report(self, file=None):
+        """ Print the phases on stderr, once
+        """
+        if not self.enabled or self.reported:
+            return
+        self.reported = True
+        file = file if file is not None else sys.stderr
+        last = self.start
+        for phase, t in self.phases:
+            print('{:16s} {:8.1f} ms {:8.1f} ms'.format(phase, (t - last) * 1000,
+                                                       (t - self.start) * 1000), file=file)
+            last = t
+
+
+# Created when textoter is imported, before Gtk
+timer = StartupTimer()
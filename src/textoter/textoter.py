@@ -17,27 +17,39 @@ import gi
 gi.require_version('Gtk', '3.0')
 gi.require_version('Notify', '0.7')
 from gi.repository import Gtk
-from gi.repository import Notify
 from gi.repository import Pango
-import sys, os, stat
-import tempfile
+from gi.repository import GLib
+import os
+import sys
 import configparser
-from xdg import BaseDirectory
-import locale
-from btphonelib import BTPhone
+import itertools
+from . import config
+from .startup import timer
+from .conversation import ConversationWindow
+# BTPhone is imported when the window is shown, see start_phone()
+from btphonelib import PhonebookCache, ContactIndex, canonical, is_number, set_default_region
+from btphonelib.search import ContactSearch, SearchWorker
+from btphonelib.frecency import Frecency
+from btphonelib.pbcache import FOLDERS
 from importlib.resources import files
 
 UIFILE = 'textoter.glade'
+MESSAGES_DB = 'messages.sqlite'
+COMPLETION_LIMIT = 50
+# Rows added to the address book per idle callback
+AB_BATCH = 500
+AB_COLUMNS = [0, 1, 2, 3]
 
 class TextoterWindow(Gtk.ApplicationWindow):
     # The main window
-    def __init__(self, app, btmessage):
+    def __init__(self, app, btmessage=None):
         Gtk.ApplicationWindow.__init__(self, title='Textoter', application=app)
         self.builder = Gtk.Builder()
         self.app = app
-        self.btmessage = btmessage
-        btmessage.set_iface_added_callback(self.interface_added)
-        btmessage.set_iface_removed_callback(self.interface_removed)
+        # Set by attach_phone(), once the window is shown
+        self.btmessage = None
+        # Whether a message is being sent, see set_sending()
+        self.sending = False
         uifile = files('textoter.data').joinpath(UIFILE)
         try:
             self.builder = Gtk.Builder.new_from_file(str(uifile))
@@ -49,15 +61,28 @@ class TextoterWindow(Gtk.ApplicationWindow):
         handlers = {'OkButton_clicked_cb': self.ok_clicked,
                     'CancelButton_clicked_cb': self.cancel_clicked,
                     'PhoneButton_clicked_cb': self.phone_ab_clicked,
+                    'ConversationButton_clicked_cb': self.conversation_clicked,
         }
         self.builder.connect_signals(handlers)
 
         self.ab_store = self.builder.get_object('ab_store')
+        # The idle source filling ab_store, see fill_ab_store()
+        self.ab_fill_id = None
+        # Call history scores of the contacts shown
+        self.frecency = None
+        self.contact_index = ContactIndex()
+        # Ranked search of the contacts as the number is typed, in a thread
+        # for large phonebooks
+        self.search = SearchWorker(ContactSearch(recent=self.app.actions['history_list'][1]),
+                                   GLib.idle_add)
+        # Only the completions of the current text, filled from the search
+        self.completion_store = Gtk.ListStore(str, str, str, str)
         
         self.add(b)
         self.set_default_size(300, 500)
         self.phone_number_entry = self.builder.get_object('PhoneNumberEntry')
         self.sms_content_text_view = self.builder.get_object('SMSTextView')
+        self.sms_content_text_view.get_buffer().connect('changed', self.prewarm_session)
         self.store = self.builder.get_object('store')
         for num in self.app.actions['history_list'][1]:
             iter = self.store.append([num])
@@ -72,12 +97,38 @@ class TextoterWindow(Gtk.ApplicationWindow):
         cbx.add_attribute(r, 'text', 1)
         self.pn_cbx = cbx
 
+        # Not needed for the first frame
+        GLib.idle_add(self.setup_completion)
+
+        cbx = self.builder.get_object('dev_cbx')
+        self.dev_store = self.builder.get_object('dev_store')
+        r = Gtk.CellRendererText()
+        cbx.pack_start(r, True)
+        cbx.add_attribute(r, 'text', 1)
+        self.dev_cbx = cbx
+        # Row of each device address in dev_store
+        self.dev_rows = {}
+        self.phonebooks = {}
+        cbx.connect('changed', self.device_changed)
+
+        # The devices seen last time, until the phone is attached
+        for dev, name in self.app.actions['devices'].items():
+            self.interface_added(dev, name)
+        self.select_best_device()
+        if btmessage is not None:
+            self.attach_phone(btmessage)
+
+    def setup_completion(self):
+        """ Setup the completion of the phone number entry
+        """
         ec = Gtk.EntryCompletion.new()
         self.phone_number_entry.set_completion(ec)
-        ec.set_model(self.ab_store)
+        ec.set_model(self.completion_store)
         ec.set_text_column(3)
+        # completion_store only holds matches, already ranked
+        ec.set_match_func(lambda *args: True)
         ec.set_inline_selection(True)
-        ec.set_inline_completion(True)
+        ec.set_inline_completion(False)
         ec.set_popup_completion(True)
         # FIXME: Setting CellRenderer appears not to work
         ec.clear()
@@ -87,131 +138,289 @@ class TextoterWindow(Gtk.ApplicationWindow):
         r = Gtk.CellRendererText(style=Pango.Style.ITALIC)
         ec.pack_start(r, False)
         ec.add_attribute(r, 'text', 1)
+        self.phone_number_entry.connect('changed', self.number_entry_changed)
+        self.completion = ec
+        return False
 
-        cbx = self.builder.get_object('dev_cbx')
-        self.dev_store = self.builder.get_object('dev_store')
-        r = Gtk.CellRendererText()
-        cbx.pack_start(r, True)
-        cbx.add_attribute(r, 'text', 1)
-        self.dev_cbx = cbx
-
-        for dev, name in self.btmessage.get_devices().items():
+    def attach_phone(self, btmessage):
+        """ Use btmessage, replace the cached devices by the known ones
+        """
+        self.btmessage = btmessage
+        btmessage.set_iface_added_callback(self.interface_added)
+        btmessage.set_iface_removed_callback(self.interface_removed)
+        devices = btmessage.get_devices()
+        for dev in list(self.dev_rows):
+            if dev not in devices:
+                self.interface_removed(dev)
+        for dev, name in devices.items():
             self.interface_added(dev, name)
+        self.select_best_device()
+        # Refresh the contacts shown from the cache
+        iter = self.dev_cbx.get_active_iter()
+        if iter is not None:
+            devad, name = self.dev_store[iter][0], self.dev_store[iter][1]
+            if self.get_phonebook(devad).contacts:
+                GLib.idle_add(self.refresh_contacts, devad, name, False)
 
     def ok_clicked(self, button):
         # Send message
 
+        if self.btmessage is None or self.sending:
+            # Still starting, or sending the previous message
+            return
+
         # Retrieve device
         iter = self.dev_cbx.get_active_iter()
         if iter is not None:
             model = self.dev_cbx.get_model()
             row = model[iter]
             my_devad = row[0]
-        iter = self.pn_cbx.get_active_iter()
-        num = None
-        if iter is None:
-            # Attemp to retrieve number from entry text
-            print('Iter is None')
-            t = self.phone_number_entry.get_text()
-            for row in self.ab_store:
-                if t == row[3]:
-                    num = row[1]
-            if num is None:
-                # Check whether a bare number has been entered
-                try:
-                    float(t)
-                except ValueError:
-                    num = None
-                else:
-                    num = t
-        else:
-            model = self.pn_cbx.get_model()
-            row = model[iter]
-            num = row[1]
-        print(num)
+        num = self.get_recipient()
         if num is None:
             return
 
-        # Process specific for France
-        if locale.getlocale()[0].startswith('fr') and\
-           (num.startswith('06') or num.startswith('07')):
-            num = '+33' + num[1:]
-
         tb = self.sms_content_text_view.get_buffer()
         t = tb.get_text(tb.get_start_iter(),tb.get_end_iter(), True)
         if not t:
             return
 
-        # Create the file in the outgoing directory
-        content = '\n'.join((' '.join(('To:', num)), '', t))
-        fp = tempfile.NamedTemporaryFile(mode='w+t', delete=False, prefix='arnaud-', dir='/tmp')
-        os.chmod(fp.name, stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO)
-        m = self.btmessage.prepare_message(num, t)
-        print('m <{}>'.format(m))
-        fp.write(m)
-        fp.close()
-        port = self.app.actions['ports'].get(my_devad, None)
-        res = self.btmessage.create_session(my_devad, port)
-        if not res:
-            iter = self.dev_store.get_iter(self.dev_cbx.get_active())
-            self.send_notification('No connection with phone', 'Unable to send message to {} ({})'.format(self.dev_store.get_value(iter, 1), my_devad))
-        else:
-            res = self.btmessage.push_message(fp.name)
-            self.btmessage.remove_session()
-            self.app.actions['ports'] = {my_devad: self.btmessage.port}
-            if res:
-                self.send_notification('Message sent', 'To %s' % num)
-                tb.delete(tb.get_start_iter(),tb.get_end_iter())
-            else:
-                self.send_notification('Message failed', 'To %s' % num)
+        # Do not send it twice while it is transferred
+        self.set_sending(True)
+        delivery = self.btmessage.deliver_async(my_devad, num, t)
+        delivery.add_done_callback(lambda res: self.message_pushed(res, my_devad, t))
 
         # Manage history
-        history_list = self.app.actions['history_list'][1]
-        if num in history_list:
-            history_list.remove(num)
+        # Numbers saved before canonical() may be written differently
         history_list = [num]
-        history_list.extend(self.app.actions['history_list'][1])
+        history_list.extend(n for n in self.app.actions['history_list'][1]
+                            if canonical(n) != num)
         history_list = history_list[0:10]
         self.app.actions['history_list'] = (self.app.actions['history_list'][0],
                                             history_list)
         # Manage history in the store
         def func(model, path, iter, num):
             # Remove the first occurrence of number
-            if model.get_value(iter, 0) == num:
+            if canonical(model.get_value(iter, 0)) == num:
                 model.remove(iter)
                 return True
             else:
                 return False
         self.store.foreach(func, num)
         iter = self.store.prepend([num])
+        self.search.engine.use(num)
 
         # Manage device
         self.app.actions['device'] = (self.app.actions['device'][0], my_devad)
 
+    def get_recipient(self):
+        """ Return the number of the recipient in canonical form, None if
+        the text entered is neither a contact nor a number
+        """
+        iter = self.pn_cbx.get_active_iter()
+        num = None
+        if iter is None:
+            # Attemp to retrieve number from entry text
+            t = self.phone_number_entry.get_text()
+            entry = self.contact_index.lookup(t)
+            if entry is not None:
+                num = entry.number
+            elif is_number(t):
+                # A bare number has been entered
+                num = t
+        else:
+            model = self.pn_cbx.get_model()
+            row = model[iter]
+            num = row[1]
+        if num is None:
+            return None
+        # International form, using the dialing rules of the region
+        return canonical(num)
+
+    def conversation_clicked(self, button):
+        """ Show the messages exchanged with the recipient, then read the
+        new ones from the phone
+        """
+        iter = self.dev_cbx.get_active_iter()
+        num = self.get_recipient()
+        if iter is None or num is None:
+            return
+        devad = self.dev_store[iter][0]
+        entry = self.contact_index.who(num)
+        title = entry.display if entry is not None else num
+        win = ConversationWindow(self, self.app.get_message_store(), devad, num, title)
+        win.show_all()
+        if self.btmessage is None:
+            return
+        future = self.btmessage.sync_messages_async(devad, self.app.get_message_store(),
+                                                    message_cb=win.message_added)
+        future.add_done_callback(lambda f: win.synced(f.result()))
+
+    def set_sending(self, sending):
+        """ Lock the message and the Send button while a message is sent
+        """
+        self.sending = sending
+        self.sms_content_text_view.set_sensitive(not sending)
+        self.builder.get_object('OkButton').set_sensitive(not sending)
+
+    def message_pushed(self, res, my_devad, text):
+        """ Notify the outcome of deliver_async(), clear the message sent
+        """
+        self.set_sending(False)
+        if not res.sent and res.status is None:
+            iter = self.dev_store.get_iter(self.dev_cbx.get_active())
+            self.send_notification('No connection with phone', 'Unable to send message to {} ({})'.format(self.dev_store.get_value(iter, 1), my_devad))
+            return
+        entry = self.contact_index.who(res.number)
+        to = entry.display if entry is not None else res.number
+        if res.sent:
+            self.send_notification('Message sent', 'To %s' % to)
+            tb = self.sms_content_text_view.get_buffer()
+            if tb.get_text(tb.get_start_iter(), tb.get_end_iter(), True) == text:
+                tb.delete(tb.get_start_iter(),tb.get_end_iter())
+        else:
+            self.send_notification('Message failed', 'To %s' % to)
+
     def cancel_clicked(self, button):
         # Quit
         self.app.write_config()
         sys.exit()
 
     def phone_ab_clicked(self, button):
+        if self.btmessage is None:
+            return
         iter = self.dev_store.get_iter(self.dev_cbx.get_active())
         devad = self.dev_store.get_value(iter, 0)
-        vcards = self.btmessage.read_phonebook(devad)
-        if not vcards:
-            self.send_notification('No connection with phone', 'Unable to load contacts from {} ({})'.format(self.dev_store.get_value(iter, 1), devad))
+        self.refresh_contacts(devad, self.dev_store.get_value(iter, 1), full=True)
+
+    def device_changed(self, cbx):
+        """ Show the cached contacts of the selected device, then refresh
+        them in the background
+        """
+        iter = cbx.get_active_iter()
+        if iter is None:
+            return
+        devad, name = self.dev_store[iter][0], self.dev_store[iter][1]
+        self.prewarm_session()
+        # After the next frame, the cache may be large
+        GLib.idle_add(self.show_contacts, devad, name)
+
+    def show_contacts(self, devad, name):
+        """ Show the cached contacts of devad, refresh them the first time
+        """
+        first = devad not in self.phonebooks
+        phonebook = self.get_phonebook(devad)
+        self.fill_ab_store(phonebook.get_contacts())
+        timer.mark('contacts')
+        if first and phonebook.contacts and self.btmessage is not None:
+            GLib.idle_add(self.refresh_contacts, devad, name, False)
+        return False
+
+    def prewarm_session(self, *args):
+        """ Open the session with the selected device before Send is clicked
+        """
+        iter = self.dev_cbx.get_active_iter()
+        if iter is None or self.btmessage is None:
             return
-        for vcard in vcards:
-            for tel in vcard.contents.get('tel', [None]):
-                if tel is None:
-                    continue
-                self.ab_store.append([vcard.fn.value,
-                                      tel.value,
-                                      '', # Type - FIXME TO BE FILLED
-                                      '{} ({})'.format(vcard.fn.value,
-                                                       tel.value)])
+        self.btmessage.prewarm_session(self.dev_store[iter][0])
+
+    def get_phonebook(self, devad):
+        """ Return the phonebook of devad, loaded from the cache first time
+        """
+        phonebook = self.phonebooks.get(devad, None)
+        if phonebook is None:
+            phonebook = self.app.pb_cache.load(devad)
+            self.phonebooks[devad] = phonebook
+        return phonebook
+
+    def refresh_contacts(self, devad, name, notify=True, full=False):
+        """ Synchronize the phonebook of devad with the phone, all the
+        folders when full
+        """
+        phonebook = self.get_phonebook(devad)
+        future = self.btmessage.sync_phonebook_async(devad, phonebook,
+                                                     folders=self.app.actions['folders'][1],
+                                                     full=full)
+        future.add_done_callback(lambda f: self.phonebook_read(f, phonebook, name, notify))
+        return False
+
+    def phonebook_read(self, future, phonebook, name, notify):
+        """ Update the address book with the result of sync_phonebook_async()
+        """
+        changed = future.result()
+        if changed is None:
+            if notify:
+                self.send_notification('No connection with phone', 'Unable to load contacts from {} ({})'.format(name, phonebook.devad))
+            return
+        if not changed:
+            return
+        self.app.pb_cache.save(phonebook)
+        iter = self.dev_cbx.get_active_iter()
+        if iter is not None and self.dev_store[iter][0] == phonebook.devad:
+            self.fill_ab_store(phonebook.get_contacts())
+
+    def fill_ab_store(self, contacts):
+        """ Replace the content of the address book with contacts
+
+        The rows are added by batches from idle callbacks, the store being
+        detached from the combo box meanwhile, so that the window stays
+        responsive with large phonebooks. Duplicate numbers are skipped.
+        """
+        if self.ab_fill_id is not None:
+            # Still filling with a previous list
+            GLib.source_remove(self.ab_fill_id)
+        # Usual recipients first in the completion
+        self.frecency = Frecency()
+        self.frecency.add_contacts(contacts)
+        self.contact_index.clear()
+        self.pn_cbx.set_model(None)
+        self.ab_store.clear()
+        entries = self.new_entries(contacts)
+        self.ab_fill_id = GLib.idle_add(self.fill_ab_batch, entries)
+
+    def new_entries(self, contacts):
+        """ Add contacts to the index, yield the entries not already there
+        """
+        for contact in contacts:
+            for number, kind in contact.tels:
+                entry = self.contact_index.add(contact.fn, number, kind)
+                if entry is not None:
+                    yield entry
+
+    def fill_ab_batch(self, entries):
+        """ Add the next AB_BATCH entries to ab_store, idle callback
+        """
+        batch = list(itertools.islice(entries, AB_BATCH))
+        for entry in batch:
+            self.ab_store.insert_with_valuesv(-1, AB_COLUMNS, list(entry[:len(AB_COLUMNS)]))
+        if len(batch) == AB_BATCH:
+            return True
+        self.pn_cbx.set_model(self.ab_store)
+        self.ab_fill_id = None
+        self.search.set_entries(self.contact_index.entries, self.frecency)
+        return False
+
+    def number_entry_changed(self, entry):
+        """ Search the contacts matching the text
+        """
+        self.prewarm_session()
+        self.search.search(entry.get_text(), COMPLETION_LIMIT, self.show_completions)
+
+    def show_completions(self, text, entries):
+        """ Fill the completion model with the search results
+        """
+        self.completion_store.clear()
+        for e in entries:
+            self.completion_store.insert_with_valuesv(-1, AB_COLUMNS, list(e[:len(AB_COLUMNS)]))
+        if entries and self.phone_number_entry.has_focus():
+            # Results may come after the completion popup was computed
+            self.completion.complete()
 
     def send_notification(self, title, text, file_path_to_icon=''):
         # Used to create and show the notification
+        # Loaded on first use, not at startup
+        from gi.repository import Notify
+        if not Notify.is_initted():
+            Notify.init('Textoter')
         n = Notify.Notification.new(title, text, file_path_to_icon)
         n.set_timeout(5000)
         n.show()
@@ -220,58 +429,100 @@ class TextoterWindow(Gtk.ApplicationWindow):
         """ Update the device list with new device
         """
         store = self.dev_store
-        iter = store.get_iter_first()
-        while iter is not None:
-            if store[iter][0] == dev:
-                # Found item with same address
-                break
-            iter = store.iter_next(iter)
-        if iter is None:
+        row = self.dev_rows.get(dev, None)
+        if row is None:
             iter = store.append([dev, name])
+            self.dev_rows[dev] = Gtk.TreeRowReference.new(store, store.get_path(iter))
         else:
-            store.set_row(iter, [dev, name])
-        if dev == self.app.actions['device'][1]:
-            self.dev_cbx.set_active_iter(iter)
+            store.set_row(store.get_iter(row.get_path()), [dev, name])
+        if dev == self.app.actions['device'][1] or self.dev_cbx.get_active_iter() is None:
+            self.select_best_device()
 
     def interface_removed(self, dev):
         """ Remove device from the device list
         """
-        store = self.dev_store
-        iter = store.get_iter_first()
-        while iter is not None:
-            if store[iter][0] == dev:
-                store.remove(iter)
-                break
-            iter = store.iter_next(iter)
+        row = self.dev_rows.pop(dev, None)
+        if row is not None and row.valid():
+            self.dev_store.remove(self.dev_store.get_iter(row.get_path()))
+
+    def select_best_device(self):
+        """ Select the connected device, or the last one used
+        """
+        dev = self.app.actions['device'][1]
+        if self.btmessage is not None:
+            dev = self.btmessage.best_device(dev)
+        row = self.dev_rows.get(dev, None)
+        if row is not None and row.valid():
+            self.dev_cbx.set_active_iter(self.dev_store.get_iter(row.get_path()))
 
 class TextoterApplication(Gtk.Application):
 
-    SECTION = 'Textoter'
-    HISTORY_LIST = 'numbers'
-    DEVICE = 'device'
+    SECTION = config.SECTION
+    HISTORY_LIST = config.HISTORY_LIST
+    DEVICE = config.DEVICE
+    FOLDERS = config.FOLDERS
+    REGION = config.REGION
     
     def __init__(self):
         Gtk.Application.__init__(self)
-        Notify.init('Textoter')
         self.win = None
-        self.bt = BTPhone()
+        # Created after the first frame, see start_phone()
+        self.bt = None
+        self.pb_cache = PhonebookCache(config.data_dir())
+        # Opened on first use, see get_message_store()
+        self.msg_store = None
+
+    def get_message_store(self):
+        """ Return the local message store, open it the first time
+        """
+        if self.msg_store is None:
+            from btphonelib.messages import MessageStore
+            self.msg_store = MessageStore(os.path.join(config.data_dir(), MESSAGES_DB))
+        return self.msg_store
 
     def do_activate(self):
         # Setup the main window
-        win = TextoterWindow(self, self.bt)
+        win = TextoterWindow(self)
+        timer.mark('window')
+        win.connect_after('draw', self.first_frame)
         win.show_all()
         self.win = win
 
+    def first_frame(self, win, cr):
+        """ Connect to the phone once the window is drawn
+        """
+        win.disconnect_by_func(self.first_frame)
+        timer.mark('first frame')
+        GLib.idle_add(self.start_phone)
+        return False
+
+    def start_phone(self):
+        """ Connect the buses, enumerate the devices
+        """
+        from btphonelib import BTPhone
+        self.bt = BTPhone()
+        self.bt.ports.update(self.actions['ports'])
+        self.win.attach_phone(self.bt)
+        timer.mark('phone')
+        # Find the device ports while the user types the message
+        GLib.idle_add(self.probe_devices)
+        return False
+
+    def probe_devices(self):
+        self.bt.probe_devices()
+        timer.report()
+        return False
+
     def do_startup(self):
         # Read the configuration file, connect monitor to directories
         Gtk.Application.do_startup(self)
         self.init_config()
         self.read_config()
+        timer.mark('config')
     
     def init_config(self):
         # Initialize configuration stuff
-        path = BaseDirectory.save_config_path('textoter')
-        self.config_file = os.path.join(path, 'textoter')
+        self.config_file = config.config_file()
         section = TextoterApplication.SECTION
         self.config = configparser.RawConfigParser()
         self.config.add_section(section)
@@ -279,50 +530,58 @@ class TextoterApplication(Gtk.Application):
         # Defaults
         self.config.set(section, TextoterApplication.HISTORY_LIST, '')
         self.config.set(section, TextoterApplication.DEVICE, '')
+        self.config.set(section, TextoterApplication.FOLDERS, ';'.join(FOLDERS))
+        self.config.set(section, TextoterApplication.REGION, '')
 
     def sanitize_list(self, lst):
         # Remove leading and trailing white spaces when creating the list
         return [x for x in [x.strip() for x in lst] if len(x) > 0]
 
-    def actions_from_config(self, config):
+    def actions_from_config(self, cfg):
         # Retrieve infos from configuration file
         section = TextoterApplication.SECTION
 
-        history_list = config.get(section, TextoterApplication.HISTORY_LIST)
+        history_list = cfg.get(section, TextoterApplication.HISTORY_LIST)
         history_list = self.sanitize_list(history_list.split(';'))
-        device = config.get(section, TextoterApplication.DEVICE)
+        device = cfg.get(section, TextoterApplication.DEVICE)
         device = device.strip()
+        folders = cfg.get(section, TextoterApplication.FOLDERS)
+        folders = [f for f in self.sanitize_list(folders.split(';')) if f.count('/') == 1]
+        region = cfg.get(section, TextoterApplication.REGION).strip()
         actions = {
             'history_list': (True, history_list),
             'device': (True, device),
-            'ports': {},
+            'folders': (True, folders),
+            'region': (True, region),
+            'ports': config.ports_from_config(cfg),
+            'devices': config.devices_from_config(cfg),
         }
-        for s in config.sections():
-            if s in [TextoterApplication.SECTION]:
-                continue
-            actions['ports'][s] = config.getint(s, 'port')
-        print(actions)
         return actions
 
-    def actions_to_config(self, actions, config):
+    def actions_to_config(self, actions, cfg):
         # Send infos to configuration file
         section = TextoterApplication.SECTION
         history_list = ';'.join(actions['history_list'][1])
         device = actions['device'][1]
-        config.set(section, TextoterApplication.HISTORY_LIST, history_list)
-        config.set(section, TextoterApplication.DEVICE, device)
-        for dev, port in actions['ports'].items():
-            if not config.has_section(dev):
-                config.add_section(dev)
-            config.set(dev, 'port', port)
+        cfg.set(section, TextoterApplication.HISTORY_LIST, history_list)
+        cfg.set(section, TextoterApplication.DEVICE, device)
+        cfg.set(section, TextoterApplication.FOLDERS, ';'.join(actions['folders'][1]))
+        cfg.set(section, TextoterApplication.REGION, actions['region'][1])
+        config.ports_to_config(actions['ports'], cfg)
+        config.devices_to_config(actions['devices'], cfg)
     
     def read_config(self):
         # Just read the configuration file
         self.config.read(self.config_file)
         self.actions = self.actions_from_config(self.config)
+        if self.actions['region'][1]:
+            set_default_region(self.actions['region'][1])
 
     def write_config(self):
         # Just write the configuration file
+        if self.bt is not None:
+            self.actions['ports'] = dict(self.bt.ports.items())
+            self.actions['devices'].update(self.bt.get_devices())
         self.actions_to_config(self.actions, self.config)
         with open(self.config_file, 'w') as f:
             self.config.write(f)